@@ -1,10 +1,28 @@
 # app.py
+import os
+
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
 
+from dip_cache import LRUCache
+from dip_catalog import replace_nan_with_chinese, get_option_lists
+from dip_diff import get_catalog_diff
+from dip_fuzzy import 默认匹配阈值
+from dip_grouping import group_case_cached, group_cases, grouping_cache
+from dip_io import (read_catalog_excel, load_catalog_snapshot_file, save_catalog_snapshot, normalize_catalog,
+                    ensure_normalized, load_category_suffixes, compact_catalog, catalog_memory_report, read_case_file,
+                    file_sha256)
+from dip_montecarlo import simulate_point_value_risk, summarize_simulation
+from dip_pointvalue import (estimate_point_values, estimate_point_values_iterative, prepare_point_value_cases,
+                            默认高倍率界限, 默认低倍率界限)
+from dip_registry import catalog_registry
+from dip_search import get_search_indexes
+from dip_store import CatalogStore
+from dip_sweep import sweep_dip_metrics, sweep_matrix, 扫描参数
+
 # 设置页面配置（必须放在最前面）
 st.set_page_config(
     page_title="DIP病种分析工具",
@@ -52,6 +70,79 @@ def create_default_diagnosis_database():
     return pd.DataFrame(data)
 
 
+# 目录快照所在目录，可通过环境变量DIP_SNAPSHOT_DIR指定
+SNAPSHOT_DIR = os.environ.get(
+    'DIP_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog_snapshot')
+)
+
+# 多版本目录库所在目录，可通过环境变量DIP_STORE_DIR指定
+STORE_DIR = os.environ.get(
+    'DIP_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog_store')
+)
+catalog_store = CatalogStore(STORE_DIR)
+
+# 入组规则文件（综合病种操作类别对应的DIP组别后缀），可通过环境变量DIP_RULES_FILE指定
+RULES_FILE = os.environ.get(
+    'DIP_RULES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dip_rules.json')
+)
+
+
+# 读取入组规则：规则文件修改后下次运行即生效，文件不存在或有误时使用内置规则
+def get_category_suffixes():
+    """获取操作类别 -> DIP组别后缀"""
+    if not os.path.exists(RULES_FILE):
+        return None
+    try:
+        return load_category_suffixes(RULES_FILE)
+    except ValueError as e:
+        st.sidebar.error(f"入组规则文件有误，使用内置规则: {e}")
+        return None
+
+
+# 每次运行只读取一次入组规则
+分组规则 = get_category_suffixes()
+
+
+# 目录名称 -> 内置默认目录
+默认目录 = {
+    'dip_database': create_default_dip_database,
+    'surgery_database': create_default_surgery_database,
+    'diagnosis_database': create_default_diagnosis_database
+}
+
+
+# 读取快照文件并注册到进程级注册表，同一文件（路径和修改时间相同）在进程中只读取一次
+def register_snapshot_file(snapshot_path):
+    """返回快照文件中目录的版本键"""
+    return catalog_registry.register_source(
+        ('snapshot', snapshot_path, os.path.getmtime(snapshot_path)),
+        lambda: compact_catalog(normalize_catalog(load_catalog_snapshot_file(snapshot_path)))
+    )
+
+
+# 获取启动目录：已切换到目录库中的版本时使用该版本，其次是快照目录中的快照，否则使用内置的默认目录
+def get_startup_version(name):
+    """获取启动或恢复默认时使用的目录版本键（目录已规范化空值并紧凑化，注册在进程级注册表中）"""
+    版本名称 = st.session_state.get('store_version_name')
+    if 版本名称:
+        try:
+            return register_snapshot_file(catalog_store.snapshot_path(版本名称, name))
+        except (OSError, ValueError):
+            # 版本已被删除，改用启动目录
+            st.session_state.store_version_name = None
+
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f'{name}.npz')
+    if os.path.exists(snapshot_path):
+        return register_snapshot_file(snapshot_path)
+    return catalog_registry.register_source(
+        ('default', name),
+        lambda: compact_catalog(normalize_catalog(默认目录[name]()))
+    )
+
+
 # 初始化session state
 if 'dip_base_score_input' not in st.session_state:
     st.session_state.dip_base_score_input = 27.7173  # 默认值
@@ -59,14 +150,14 @@ if 'dip_base_score_input' not in st.session_state:
 if 'dip_base_score_slider' not in st.session_state:
     st.session_state.dip_base_score_slider = 27.7173  # 默认值
 
-if 'dip_database' not in st.session_state:
-    st.session_state.dip_database = create_default_dip_database()
+if 'dip_database_version' not in st.session_state:
+    st.session_state.dip_database_version = get_startup_version('dip_database')
 
-if 'surgery_database' not in st.session_state:
-    st.session_state.surgery_database = create_default_surgery_database()
+if 'surgery_database_version' not in st.session_state:
+    st.session_state.surgery_database_version = get_startup_version('surgery_database')
 
-if 'diagnosis_database' not in st.session_state:
-    st.session_state.diagnosis_database = create_default_diagnosis_database()
+if 'diagnosis_database_version' not in st.session_state:
+    st.session_state.diagnosis_database_version = get_startup_version('diagnosis_database')
 
 if 'uploaded_file' not in st.session_state:
     st.session_state.uploaded_file = None
@@ -102,186 +193,102 @@ if 'custom_diagnosis_input' not in st.session_state:
     st.session_state.custom_diagnosis_input = ""
 
 
-# 新增函数：将NaN值替换为中文"无"
-def replace_nan_with_chinese(value):
-    """将NaN、None或空值替换为中文'无'"""
-    if pd.isna(value) or value is None or value == "":
-        return "无"
-    return value
-
-
-# 新增函数：处理诊断编码，截取到小数点后第一位
-def truncate_diagnosis_code(diagnosis_code):
-    """处理诊断编码，截取到小数点后第一位"""
-    if not diagnosis_code or diagnosis_code == "无":
-        return ""
-
-    # 如果编码中包含小数点
-    if '.' in diagnosis_code:
-        parts = diagnosis_code.split('.')
-        if len(parts) >= 2:
-            # 截取小数点后第一位
-            decimal_part = parts[1][:1] if len(parts[1]) > 0 else ""
-            return f"{parts[0]}.{decimal_part}"
-
-    # 如果没有小数点，返回原编码
-    return diagnosis_code
-
-
-# 新增函数：在诊断目录中查找诊断编码
-def find_diagnosis_code(diagnosis_input):
-    """在诊断目录中查找诊断编码"""
-    if not diagnosis_input or diagnosis_input == "无":
-        return None
-
-    # 首先检查输入是否是诊断编码格式（包含字母和数字）
-    # 假设诊断编码以字母开头
-    if diagnosis_input[0].isalpha() and any(char.isdigit() for char in diagnosis_input):
-        # 可能是诊断编码，直接使用
-        return diagnosis_input
-
-    # 否则按诊断名称查找
-    matching_records = st.session_state.diagnosis_database[
-        st.session_state.diagnosis_database['诊断名称'] == diagnosis_input
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]['诊断编码']
-
-    return None
-
-
-# 新增函数：在DIP数据库中查找匹配的诊断记录
-def find_matching_diagnosis(truncated_diagnosis_code):
-    """在DIP数据库中查找匹配的诊断记录"""
-    if not truncated_diagnosis_code:
-        return None
-
-    # 在DIP数据库中查找匹配的诊断编码
-    matching_records = st.session_state.dip_database[
-        st.session_state.dip_database['诊断编码'] == truncated_diagnosis_code
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]
-
-    return None
-
-
-# 新增函数：在DIP数据库中查找匹配的操作记录
-def find_matching_operation(diagnosis_code, operation_input):
-    """在DIP数据库中查找匹配的操作记录"""
-    if not operation_input or operation_input == "无":
-        return None
-
-    # 首先尝试匹配操作编码
-    matching_records = st.session_state.dip_database[
-        (st.session_state.dip_database['诊断编码'] == diagnosis_code) &
-        (st.session_state.dip_database['操作编码'] == operation_input)
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]
-
-    # 如果操作编码不匹配，尝试匹配操作名称
-    matching_records = st.session_state.dip_database[
-        (st.session_state.dip_database['诊断编码'] == diagnosis_code) &
-        (st.session_state.dip_database['操作名称'] == operation_input)
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]
-
-    return None
-
-
-# 新增函数：在手术操作分类目录中查找操作类别
-def find_operation_category(operation_input):
-    """在手术操作分类目录中查找操作类别"""
-    if not operation_input or operation_input == "无":
-        return None
-
-    # 首先尝试匹配操作编码
-    matching_records = st.session_state.surgery_database[
-        st.session_state.surgery_database['操作编码'] == operation_input
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]['操作类别']
-
-    # 如果操作编码不匹配，尝试匹配操作名称
-    matching_records = st.session_state.surgery_database[
-        st.session_state.surgery_database['操作名称'] == operation_input
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]['操作类别']
-
-    return None
-
-
-# 新增函数：根据诊断编码获取病种类型
-def get_diagnosis_type(diagnosis_code):
-    """根据诊断编码获取病种类型"""
-    if not diagnosis_code or diagnosis_code == "无":
-        return None
-
-    matching_records = st.session_state.dip_database[
-        st.session_state.dip_database['诊断编码'] == diagnosis_code
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]['病种类型']
-
-    return None
-
-
-# 新增函数：根据诊断编码和操作类别获取综合病种的DIP信息
-def get_comprehensive_dip_info(diagnosis_code, operation_category):
-    """根据诊断编码和操作类别获取综合病种的DIP信息"""
-    if not diagnosis_code or not operation_category:
-        return None
-
-    # 根据操作类别确定DIP组别
-    if operation_category in ['手术', '介入治疗']:
-        dip_suffix = '手术组'
-    elif operation_category == '治疗性操作':
-        dip_suffix = '治疗组'
-    elif operation_category == '诊断性操作':
-        dip_suffix = '诊断组'
-    else:
-        return None
-
-    # 查找匹配的综合病种记录
-    matching_records = st.session_state.dip_database[
-        (st.session_state.dip_database['诊断编码'] == diagnosis_code) &
-        (st.session_state.dip_database['DIP名称'].str.contains(dip_suffix))
-        ]
-
-    if not matching_records.empty:
-        return matching_records.iloc[0]
-
-    return None
-
+# 目录名称 -> (上传文件的会话键, 上传已处理的会话键)
+上传状态键 = {
+    'dip_database': ('uploaded_file', 'file_processed'),
+    'surgery_database': ('uploaded_surgery_file', 'surgery_file_processed'),
+    'diagnosis_database': ('uploaded_diagnosis_file', 'diagnosis_file_processed')
+}
 
-# 新增函数：根据诊断编码获取无操作的DIP信息
-def get_diagnosis_only_dip_info(diagnosis_code):
-    """根据诊断编码获取无操作的DIP信息（用于基层病种和核心病种）"""
-    if not diagnosis_code or diagnosis_code == "无":
-        return None
 
-    # 查找诊断编码匹配且操作编码为空的记录
-    matching_records = st.session_state.dip_database[
-        (st.session_state.dip_database['诊断编码'] == diagnosis_code) &
-        ((st.session_state.dip_database['操作编码'] == "无") |
-         (st.session_state.dip_database['操作编码'].isna()) |
-         (st.session_state.dip_database['操作编码'] == ""))
-        ]
+# 会话中保存目录版本键，并持有（pin）当前使用的目录对象，目录本身在进程级注册表中共享、不复制
+def get_catalog(name):
+    """取出当前会话使用的目录（只读，不能修改）"""
+    catalog = catalog_registry.get(st.session_state[f'{name}_version'])
+    if catalog is None:
+        # 会话持有的目录不会被淘汰，走到这里说明目录已不在进程中（如会话在持有前被淘汰），提示后恢复为启动目录
+        st.warning("当前会话使用的目录版本已从目录注册表中移除，已恢复为启动目录，请重新上传目录或重新选择目录版本")
+        上传文件键, 已处理键 = 上传状态键[name]
+        st.session_state[上传文件键] = None
+        st.session_state[已处理键] = False
+        st.session_state.store_version_name = None
+        st.session_state[f'{name}_version'] = get_startup_version(name)
+        catalog = catalog_registry.get(st.session_state[f'{name}_version'])
+    # 会话持有目录对象的引用，注册表淘汰该版本后仍能从弱引用中取回
+    st.session_state[f'{name}_pin'] = catalog
+    return catalog
+
+
+# 获取当前目录的字典索引，同一组目录版本和规则在进程中只构建一次，目录被替换后自动切换
+def get_catalog_index():
+    """获取当前DIP目录、手术操作分类目录和诊断目录的索引"""
+    目录 = {name: get_catalog(name) for name in 默认目录}  # 确保三个版本都在注册表中
+    index = catalog_registry.get_index(*[st.session_state[f'{name}_version'] for name in 默认目录], 分组规则)
+    if index is None:
+        # 取出目录后其中的版本又被其他会话注册的版本淘汰，用已取出的目录重新注册后重建索引
+        for name, catalog in 目录.items():
+            st.session_state[f'{name}_version'] = catalog_registry.register(catalog)
+        index = catalog_registry.get_index(*[st.session_state[f'{name}_version'] for name in 默认目录], 分组规则)
+    if index is None:
+        st.error("目录索引构建失败：当前目录版本已不在目录注册表中，请刷新页面或重新上传目录")
+        st.stop()
+    return index
+
+
+# 在手动输入框下方显示模糊匹配的相近候选及得分
+def show_fuzzy_candidates(title, candidates):
+    """显示模糊匹配候选列表"""
+    if candidates:
+        st.caption(f"{title}: " + "；".join(f"{编码} {名称}（{得分:.2f}）" for 编码, 名称, 得分 in candidates))
+
+
+# 上传病例的解析和入组结果按文件内容和目录版本缓存，所有会话共享，拖动滑块重新运行时不再重新读取和入组
+最大病例缓存条目数 = 4
+uploaded_cases_cache = LRUCache(最大病例缓存条目数)
+
+
+# 读取参数分析中上传的一批病例，没有入组的DIP基准分值列时按当前目录入组
+def load_uploaded_cases(uploaded_file):
+    """读取上传的病例文件（.csv或Excel），返回包含入组的DIP基准分值的病例表（缓存共享，不能修改）"""
+    index = get_catalog_index()
+
+    def create():
+        uploaded_file.seek(0)
+        cases = read_case_file(uploaded_file)
+        if '入组的DIP基准分值' not in cases.columns:
+            cases = pd.concat([cases, group_cases(index, cases)], axis=1)
+        return cases
+
+    # 文件格式由扩展名决定，扩展名也作为缓存键的一部分
+    key = (file_sha256(uploaded_file.getvalue()), os.path.splitext(uploaded_file.name)[1].lower(), index.version)
+    return uploaded_cases_cache.get_or_create(key, create)
+
+
+# 蒙特卡洛模拟中可选的分布：显示名称 -> (分布名称, 参数名称)
+分布选项 = {
+    '正态': ('normal', ['均值', '标准差']),
+    '均匀': ('uniform', ['下限', '上限']),
+    '三角': ('triangular', ['下限', '众数', '上限']),
+    '固定': ('fixed', ['取值'])
+}
 
-    if not matching_records.empty:
-        return matching_records.iloc[0]
 
-    return None
+# 选择一个参数的抽样分布，默认参数围绕侧边栏的当前值
+def distribution_input(label, 当前值, 默认分布, key):
+    """显示分布类型和参数输入框，返回(分布名称, 参数)"""
+    显示名称 = st.selectbox(f"{label}分布", list(分布选项), index=list(分布选项).index(默认分布), key=f'{key}_type')
+    分布名称, 参数名称 = 分布选项[显示名称]
+    默认参数 = {
+        'normal': (当前值, 当前值 * 0.05),
+        'uniform': (当前值 * 0.9, 当前值 * 1.1),
+        'triangular': (当前值 * 0.9, 当前值, 当前值 * 1.1),
+        'fixed': (当前值,)
+    }[分布名称]
+    params = tuple(
+        st.number_input(f"{label}{名称}", value=float(默认值), format="%.4f", key=f'{key}_{分布名称}_{i}')
+        for i, (名称, 默认值) in enumerate(zip(参数名称, 默认参数))
+    )
+    return 分布名称, params
 
 
 def calculate_dip_metrics(
@@ -336,8 +343,8 @@ uploaded_file = st.sidebar.file_uploader(
 # 处理上传的DIP目录文件
 if uploaded_file is not None and uploaded_file != st.session_state.uploaded_file:
     try:
-        # 读取Excel文件
-        dip_data = pd.read_excel(uploaded_file)
+        # 读取Excel文件（按文件内容缓存，相同目录只解析一次；紧凑化后各会话共享同一份）
+        dip_data = read_catalog_excel(uploaded_file.getvalue(), compact=True)
 
         # 检查必要的列是否存在
         required_columns = ['诊断名称', '诊断编码', '操作名称', '操作编码', '入组的DIP基准分值']
@@ -346,13 +353,9 @@ if uploaded_file is not None and uploaded_file != st.session_state.uploaded_file
         if missing_columns:
             st.sidebar.error(f"上传的文件缺少必要列: {', '.join(missing_columns)}")
         else:
-            # 将NaN值替换为中文"无"
-            for col in dip_data.columns:
-                if dip_data[col].dtype == 'object':  # 只处理字符串类型的列
-                    dip_data[col] = dip_data[col].apply(replace_nan_with_chinese)
-
-            # 更新DIP数据库
-            st.session_state.dip_database = dip_data
+            # 更新DIP数据库，记录上传前的目录版本用于变更对比
+            st.session_state.dip_diff_base_version = st.session_state.dip_database_version
+            st.session_state.dip_database_version = catalog_registry.register(dip_data)
             st.session_state.uploaded_file = uploaded_file
             st.session_state.file_processed = True
             st.sidebar.success(f"成功导入DIP目录！共 {len(dip_data)} 条记录")
@@ -361,7 +364,7 @@ if uploaded_file is not None and uploaded_file != st.session_state.uploaded_file
         st.sidebar.error(f"文件读取错误: {str(e)}")
 elif uploaded_file is None and st.session_state.uploaded_file is not None:
     # 如果用户删除了上传的文件，恢复为默认数据
-    st.session_state.dip_database = create_default_dip_database()
+    st.session_state.dip_database_version = get_startup_version('dip_database')
     st.session_state.uploaded_file = None
     st.session_state.file_processed = False
 
@@ -376,8 +379,8 @@ uploaded_surgery_file = st.sidebar.file_uploader(
 # 处理上传的手术操作分类目录文件
 if uploaded_surgery_file is not None and uploaded_surgery_file != st.session_state.uploaded_surgery_file:
     try:
-        # 读取Excel文件
-        surgery_data = pd.read_excel(uploaded_surgery_file)
+        # 读取Excel文件（按文件内容缓存，相同目录只解析一次；紧凑化后各会话共享同一份）
+        surgery_data = read_catalog_excel(uploaded_surgery_file.getvalue(), compact=True)
 
         # 检查必要的列是否存在
         required_columns = ['操作编码', '操作名称', '操作类别']
@@ -386,13 +389,8 @@ if uploaded_surgery_file is not None and uploaded_surgery_file != st.session_sta
         if missing_columns:
             st.sidebar.error(f"上传的文件缺少必要列: {', '.join(missing_columns)}")
         else:
-            # 将NaN值替换为中文"无"
-            for col in surgery_data.columns:
-                if surgery_data[col].dtype == 'object':  # 只处理字符串类型的列
-                    surgery_data[col] = surgery_data[col].apply(replace_nan_with_chinese)
-
             # 更新手术操作分类数据库
-            st.session_state.surgery_database = surgery_data
+            st.session_state.surgery_database_version = catalog_registry.register(surgery_data)
             st.session_state.uploaded_surgery_file = uploaded_surgery_file
             st.session_state.surgery_file_processed = True
             st.sidebar.success(f"成功导入手术操作分类目录！共 {len(surgery_data)} 条记录")
@@ -401,7 +399,7 @@ if uploaded_surgery_file is not None and uploaded_surgery_file != st.session_sta
         st.sidebar.error(f"文件读取错误: {str(e)}")
 elif uploaded_surgery_file is None and st.session_state.uploaded_surgery_file is not None:
     # 如果用户删除了上传的文件，恢复为默认数据
-    st.session_state.surgery_database = create_default_surgery_database()
+    st.session_state.surgery_database_version = get_startup_version('surgery_database')
     st.session_state.uploaded_surgery_file = None
     st.session_state.surgery_file_processed = False
 
@@ -416,8 +414,8 @@ uploaded_diagnosis_file = st.sidebar.file_uploader(
 # 处理上传的诊断编码及名称目录文件
 if uploaded_diagnosis_file is not None and uploaded_diagnosis_file != st.session_state.uploaded_diagnosis_file:
     try:
-        # 读取Excel文件
-        diagnosis_data = pd.read_excel(uploaded_diagnosis_file)
+        # 读取Excel文件（按文件内容缓存，相同目录只解析一次；紧凑化后各会话共享同一份）
+        diagnosis_data = read_catalog_excel(uploaded_diagnosis_file.getvalue(), compact=True)
 
         # 检查必要的列是否存在
         required_columns = ['诊断编码', '诊断名称']
@@ -426,13 +424,8 @@ if uploaded_diagnosis_file is not None and uploaded_diagnosis_file != st.session
         if missing_columns:
             st.sidebar.error(f"上传的文件缺少必要列: {', '.join(missing_columns)}")
         else:
-            # 将NaN值替换为中文"无"
-            for col in diagnosis_data.columns:
-                if diagnosis_data[col].dtype == 'object':  # 只处理字符串类型的列
-                    diagnosis_data[col] = diagnosis_data[col].apply(replace_nan_with_chinese)
-
             # 更新诊断编码及名称数据库
-            st.session_state.diagnosis_database = diagnosis_data
+            st.session_state.diagnosis_database_version = catalog_registry.register(diagnosis_data)
             st.session_state.uploaded_diagnosis_file = uploaded_diagnosis_file
             st.session_state.diagnosis_file_processed = True
             st.sidebar.success(f"成功导入诊断编码及名称目录！共 {len(diagnosis_data)} 条记录")
@@ -441,10 +434,85 @@ if uploaded_diagnosis_file is not None and uploaded_diagnosis_file != st.session
         st.sidebar.error(f"文件读取错误: {str(e)}")
 elif uploaded_diagnosis_file is None and st.session_state.uploaded_diagnosis_file is not None:
     # 如果用户删除了上传的文件，恢复为默认数据
-    st.session_state.diagnosis_database = create_default_diagnosis_database()
+    st.session_state.diagnosis_database_version = get_startup_version('diagnosis_database')
     st.session_state.uploaded_diagnosis_file = None
     st.session_state.diagnosis_file_processed = False
 
+# 目录快照：保存当前规范化后的目录，下次启动时直接加载，无需再解析Excel
+st.sidebar.header('目录快照')
+if st.sidebar.button("保存当前目录为快照", help=f"快照保存到 {SNAPSHOT_DIR}，启动时优先从快照加载目录"):
+    try:
+        save_catalog_snapshot(SNAPSHOT_DIR, {
+            'dip_database': get_catalog('dip_database'),
+            'surgery_database': get_catalog('surgery_database'),
+            'diagnosis_database': get_catalog('diagnosis_database')
+        })
+        st.sidebar.success(f"目录快照已保存到 {SNAPSHOT_DIR}")
+    except Exception as e:
+        st.sidebar.error(f"快照保存错误: {str(e)}")
+
+# 多版本目录库：按名称保存和切换整套目录（不同地区、不同目录版本、不同点值），切换时不重新解析Excel
+st.sidebar.header('目录版本库')
+目录版本列表 = catalog_store.list_versions()
+目录版本名称 = [metadata['名称'] for metadata in 目录版本列表]
+当前目录选项 = "（上传或默认目录）"
+当前版本名称 = st.session_state.get('store_version_name')
+选择的版本 = st.sidebar.selectbox(
+    "切换目录版本", [当前目录选项] + 目录版本名称,
+    index=(目录版本名称.index(当前版本名称) + 1) if 当前版本名称 in 目录版本名称 else 0
+)
+if 选择的版本 != 当前目录选项 and 选择的版本 != 当前版本名称:
+    try:
+        # 快照和索引由进程级注册表共享，已加载过的版本切换时直接使用
+        st.session_state.store_version_name = 选择的版本
+        for name in 默认目录:
+            st.session_state[f'{name}_version'] = register_snapshot_file(catalog_store.snapshot_path(选择的版本, name))
+        st.sidebar.success(f"已切换到目录版本: {选择的版本}")
+    except (OSError, ValueError) as e:
+        st.session_state.store_version_name = 当前版本名称
+        st.sidebar.error(f"目录版本切换错误: {str(e)}")
+elif 选择的版本 == 当前目录选项 and 当前版本名称:
+    # 退出目录库版本，恢复为快照或默认目录
+    st.session_state.store_version_name = None
+    for name in 默认目录:
+        st.session_state[f'{name}_version'] = get_startup_version(name)
+
+# 当前目录版本的元数据（说明、点值）
+当前版本信息 = next((metadata for metadata in 目录版本列表
+                  if metadata['名称'] == st.session_state.get('store_version_name')), None)
+if 当前版本信息 and 当前版本信息.get('说明'):
+    st.sidebar.caption(当前版本信息['说明'])
+
+with st.sidebar.expander("保存当前目录为新版本"):
+    新版本名称 = st.text_input("版本名称", placeholder="例如: 南充4.0-2024")
+    新版本说明 = st.text_input("版本说明", placeholder="例如: 南充市DIP病种及分值目录库4.0版")
+    居民点值 = st.number_input("居民点值", min_value=0.0, max_value=200.0, value=63.3253, step=0.0001, format="%.4f")
+    职工点值 = st.number_input("职工点值", min_value=0.0, max_value=200.0, value=73.6011, step=0.0001, format="%.4f")
+    if st.button("保存目录版本"):
+        try:
+            catalog_store.save(新版本名称, {name: get_catalog(name) for name in 默认目录}, 新版本说明,
+                               {'居民': 居民点值, '职工': 职工点值})
+            st.success(f"目录版本已保存: {新版本名称}")
+        except (OSError, ValueError) as e:
+            st.error(f"目录版本保存错误: {str(e)}")
+
+# 目录内存占用：重复取值多的列以categorical存储，显示紧凑化前后的内存
+with st.sidebar.expander("目录内存占用"):
+    for 目录名称, 目录 in [('DIP病种及分值目录', get_catalog('dip_database')),
+                       ('手术操作分类目录', get_catalog('surgery_database')),
+                       ('诊断编码及名称目录', get_catalog('diagnosis_database'))]:
+        紧凑前, 紧凑后 = catalog_memory_report(目录)
+        节省比例 = (1 - 紧凑后 / 紧凑前) if 紧凑前 else 0.0
+        st.write(f"**{目录名称}:** {紧凑前 / 1024:,.1f} KB → {紧凑后 / 1024:,.1f} KB（节省 {节省比例:.1%}）")
+    # 编码列按int32编号存储（编码字典随目录索引在会话之间共享）与按object字符串存储的对比
+    编码字典 = get_catalog_index().code_dictionary
+    编码内存 = [编码字典.memory_report(get_catalog(name)) for name in 默认目录]
+    编码object字节数 = sum(report['object字节数'] for report in 编码内存)
+    编码int32字节数 = sum(report['int32字节数'] for report in 编码内存)
+    st.caption(f"编码列（诊断编码、操作编码、DIP编码）: object {编码object字节数 / 1024:,.1f} KB → "
+               f"int32 {编码int32字节数 / 1024:,.1f} KB + 编码字典 {编码字典.nbytes() / 1024:,.1f} KB"
+               f"（{len(编码字典)} 个编码）")
+
 # 侧边栏输入参数
 st.sidebar.header('输入参数')
 
@@ -501,6 +569,12 @@ with col2:
         默认点值 = 63.3253
     else:  # 职工
         默认点值 = 73.6011
+    # 当前目录版本保存了点值时使用该版本的点值
+    if 当前版本信息 and 点值类型 in 当前版本信息.get('点值', {}):
+        默认点值 = float(当前版本信息['点值'][点值类型])
+    # 使用了年终点值估算的结果时优先使用估算点值
+    if 点值类型 in st.session_state.get('estimated_point_values', {}):
+        默认点值 = float(st.session_state.estimated_point_values[点值类型])
 
     # 点值输入
     点值 = st.number_input('点值', min_value=0.0, max_value=200.0, value=默认点值, step=0.0001, format="%.4f")
@@ -511,15 +585,16 @@ with col2:
 # 智能DIP病种选择
 st.sidebar.header('智能DIP病种选择')
 
-# 初始化变量
-诊断名称 = st.session_state.dip_database.iloc[0]['诊断名称']
-诊断编码 = st.session_state.dip_database.iloc[0]['诊断编码']
-操作名称 = st.session_state.dip_database.iloc[0]['操作名称']
-操作编码 = st.session_state.dip_database.iloc[0]['操作编码']
-入组的DIP基准分值 = st.session_state.dip_database.iloc[0]['入组的DIP基准分值']
-DIP编码 = st.session_state.dip_database.iloc[0].get('DIP编码', '无')
-DIP名称 = st.session_state.dip_database.iloc[0].get('DIP名称', '无')
-病种类型 = st.session_state.dip_database.iloc[0].get('病种类型', '无')
+# 初始化变量（取DIP目录第一条记录）
+首条记录 = get_catalog('dip_database').iloc[0]
+诊断名称 = 首条记录['诊断名称']
+诊断编码 = 首条记录['诊断编码']
+操作名称 = 首条记录['操作名称']
+操作编码 = 首条记录['操作编码']
+入组的DIP基准分值 = 首条记录['入组的DIP基准分值']
+DIP编码 = 首条记录.get('DIP编码', '无')
+DIP名称 = 首条记录.get('DIP名称', '无')
+病种类型 = 首条记录.get('病种类型', '无')
 
 # 确保所有字段都使用"无"而不是"nan"
 诊断名称 = replace_nan_with_chinese(诊断名称)
@@ -536,23 +611,23 @@ st.sidebar.subheader("传统选择")
 # 添加查询顺序选择
 查询顺序 = st.sidebar.radio("查询顺序", ["先诊断后操作", "先操作后诊断"], horizontal=True, key="query_order")
 
+# 手动输入的诊断名称或操作在目录中找不到完全一致的记录时，按名称相似度取最接近的候选入组
+模糊匹配 = st.sidebar.checkbox("手动输入模糊匹配", value=True, key="fuzzy_match",
+                           help=f"名称相似度不低于{默认匹配阈值}时按最接近的目录记录入组")
+
+# 下拉框选项按目录版本预先生成并缓存，控件变化引起的重新运行不再重建
+选项列表 = get_option_lists(get_catalog_index())
+
+# 诊断、操作的完整列表很长，改为输入编码或名称搜索，下拉框只显示匹配度最高的选项
+搜索索引 = get_search_indexes(get_catalog_index())
+
 if 查询顺序 == "先诊断后操作":
     col1, col2 = st.sidebar.columns(2)
 
     with col1:
-        # 诊断选择
-        诊断列表 = st.session_state.dip_database[['诊断编码', '诊断名称']].drop_duplicates()
-        诊断选项 = []
-
-        # 将"手动输入诊断..."放在第一行
-        诊断选项.append("手动输入诊断...")
-
-        # 然后添加目录中的诊断选项
-        for _, row in 诊断列表.iterrows():
-            诊断编码_显示 = replace_nan_with_chinese(row['诊断编码'])
-            诊断名称_显示 = replace_nan_with_chinese(row['诊断名称'])
-            if 诊断编码_显示 != "无":  # 过滤掉无诊断编码的记录
-                诊断选项.append(f"{诊断编码_显示} - {诊断名称_显示}")
+        # 诊断选择：将"手动输入诊断..."放在第一行，然后是按编码前缀或名称搜索到的诊断选项
+        诊断搜索 = st.text_input("搜索诊断", key="diagnosis_search", placeholder="输入诊断编码或名称")
+        诊断选项 = ["手动输入诊断..."] + 搜索索引['诊断选项'].search(诊断搜索)
 
         # 设置默认值为"手动输入诊断..."
         default_diagnosis_index = 0
@@ -567,6 +642,8 @@ if 查询顺序 == "先诊断后操作":
                 value=st.session_state.custom_diagnosis_input,
                 placeholder="例如: 急性心肌梗死 或 I21.9"
             )
+            show_fuzzy_candidates("相近诊断", get_catalog_index().find_diagnosis_candidates(
+                st.session_state.custom_diagnosis_input.strip()))
         elif selected_diagnosis and selected_diagnosis != "手动输入诊断...":
             # 提取诊断编码（去除"无"的情况）
             诊断编码_传统 = selected_diagnosis.split(" - ")[0]
@@ -574,11 +651,8 @@ if 查询顺序 == "先诊断后操作":
                 诊断编码_传统 = ""
 
             # 根据诊断编码获取对应的诊断名称
-            匹配记录 = st.session_state.dip_database[
-                st.session_state.dip_database['诊断编码'] == 诊断编码_传统
-                ]
-            if not 匹配记录.empty:
-                诊断记录 = 匹配记录.iloc[0]
+            诊断记录 = get_catalog_index().find_matching_diagnosis(诊断编码_传统)
+            if 诊断记录 is not None:
                 诊断名称_传统 = replace_nan_with_chinese(诊断记录['诊断名称'])
 
     with col2:
@@ -596,24 +670,8 @@ if 查询顺序 == "先诊断后操作":
                 诊断编码_传统 = ""
 
             if 诊断编码_传统:
-                # 筛选有操作编码的记录（去除操作编码为"无"的记录）
-                操作列表 = st.session_state.dip_database[
-                    (st.session_state.dip_database['诊断编码'] == 诊断编码_传统) &
-                    (st.session_state.dip_database['操作编码'] != "无") &
-                    (~st.session_state.dip_database['操作编码'].isna()) &
-                    (st.session_state.dip_database['操作编码'] != "")
-                    ][['操作编码', '操作名称', '病种类型', '入组的DIP基准分值']].drop_duplicates()
-
-                if len(操作列表) > 0:
-                    for _, row in 操作列表.iterrows():
-                        操作编码_显示 = replace_nan_with_chinese(row['操作编码'])
-                        操作名称_显示 = replace_nan_with_chinese(row['操作名称'])
-                        病种类型_显示 = replace_nan_with_chinese(row['病种类型'])
-                        基准分值_显示 = row['入组的DIP基准分值']
-
-                        # 在下拉选项中直接显示病种类型和基准分值
-                        display_text = f"{操作编码_显示} - {操作名称_显示} | 病种类型: {病种类型_显示} | 分值: {基准分值_显示:.4f}"
-                        操作选项.append(display_text)
+                # 该诊断下有操作编码的选项（已预先生成，直接显示病种类型和基准分值）
+                操作选项.extend(选项列表['诊断操作选项'].get(诊断编码_传统, []))
 
         # 操作选择框
         selected_operation = st.selectbox("选择操作", 操作选项, key="operation_select")
@@ -626,25 +684,16 @@ if 查询顺序 == "先诊断后操作":
                 value=st.session_state.custom_operation_input,
                 placeholder="例如: 13.4100x001 或 白内障超声乳化抽吸术"
             )
+            show_fuzzy_candidates("相近操作", get_catalog_index().find_operation_candidates(
+                st.session_state.custom_operation_input.strip()))
 
 else:  # 先操作后诊断
     col1, col2 = st.sidebar.columns(2)
 
     with col1:
-        # 操作选择
-        操作列表 = st.session_state.dip_database[['操作编码', '操作名称']].drop_duplicates()
-        操作选项 = []
-
-        # 将"手动输入操作..."和"无操作的"放在前面
-        操作选项.append("手动输入操作...")
-        操作选项.append("无操作的")
-
-        # 然后添加目录中的操作选项
-        for _, row in 操作列表.iterrows():
-            操作编码_显示 = replace_nan_with_chinese(row['操作编码'])
-            操作名称_显示 = replace_nan_with_chinese(row['操作名称'])
-            if 操作编码_显示 != "无":  # 过滤掉无操作编码的记录
-                操作选项.append(f"{操作编码_显示} - {操作名称_显示}")
+        # 操作选择：将"手动输入操作..."和"无操作的"放在前面，然后是按编码前缀或名称搜索到的操作选项
+        操作搜索 = st.text_input("搜索操作", key="operation_search", placeholder="输入操作编码或名称")
+        操作选项 = ["手动输入操作...", "无操作的"] + 搜索索引['操作选项'].search(操作搜索)
 
         # 操作选择框
         selected_operation = st.selectbox("选择操作", 操作选项, key="operation_first_select")
@@ -657,6 +706,8 @@ else:  # 先操作后诊断
                 value=st.session_state.custom_operation_input,
                 placeholder="例如: 13.4100x001 或 白内障超声乳化抽吸术"
             )
+            show_fuzzy_candidates("相近操作", get_catalog_index().find_operation_candidates(
+                st.session_state.custom_operation_input.strip()))
 
     with col2:
         # 诊断选择（根据操作筛选）
@@ -667,32 +718,16 @@ else:  # 先操作后诊断
 
         if selected_operation and selected_operation != "手动输入操作...":
             if selected_operation == "无操作的":
-                # 如果是无操作的情况，显示所有有无操作记录的诊断
-                诊断列表 = st.session_state.dip_database[
-                    (st.session_state.dip_database['操作编码'] == "无") |
-                    (st.session_state.dip_database['操作编码'].isna()) |
-                    (st.session_state.dip_database['操作编码'] == "")
-                    ][['诊断编码', '诊断名称', '病种类型', '入组的DIP基准分值']].drop_duplicates()
+                # 如果是无操作的情况，显示所有有无操作记录的诊断（预先生成，无需筛选整个目录）
+                诊断选项.extend(选项列表['无操作诊断选项'])
             else:
                 # 提取操作编码
                 操作编码_传统 = selected_operation.split(" - ")[
                     0] if " - " in selected_operation else selected_operation
 
                 if 操作编码_传统 and 操作编码_传统 != "无":
-                    诊断列表 = st.session_state.dip_database[
-                        st.session_state.dip_database['操作编码'] == 操作编码_传统
-                        ][['诊断编码', '诊断名称', '病种类型', '入组的DIP基准分值']].drop_duplicates()
-
-            if len(诊断列表) > 0:
-                for _, row in 诊断列表.iterrows():
-                    诊断编码_显示 = replace_nan_with_chinese(row['诊断编码'])
-                    诊断名称_显示 = replace_nan_with_chinese(row['诊断名称'])
-                    病种类型_显示 = replace_nan_with_chinese(row['病种类型'])
-                    基准分值_显示 = row['入组的DIP基准分值']
-
-                    # 在下拉选项中直接显示病种类型和基准分值
-                    display_text = f"{诊断编码_显示} - {诊断名称_显示} | 病种类型: {病种类型_显示} | 分值: {基准分值_显示:.4f}"
-                    诊断选项.append(display_text)
+                    # 按操作编码反查诊断（预先生成，直接显示病种类型和基准分值）
+                    诊断选项.extend(选项列表['操作诊断选项'].get(操作编码_传统, []))
 
         selected_diagnosis = st.selectbox("选择诊断", 诊断选项, key="diagnosis_second_select")
 
@@ -704,6 +739,8 @@ else:  # 先操作后诊断
                 value=st.session_state.custom_diagnosis_input,
                 placeholder="例如: 急性心肌梗死 或 I21.9"
             )
+            show_fuzzy_candidates("相近诊断", get_catalog_index().find_diagnosis_candidates(
+                st.session_state.custom_diagnosis_input.strip()))
 
 # 添加查询入组按钮
 if st.sidebar.button("查询入组", type="primary"):
@@ -714,333 +751,28 @@ if st.sidebar.button("查询入组", type="primary"):
 # 显示入组情况（仅在点击了查询入组按钮后显示）
 if st.session_state.show_group_info and (
         st.session_state.selected_diagnosis or st.session_state.custom_diagnosis_input):
-    # 处理诊断信息
-    if 查询顺序 == "先诊断后操作":
-        if st.session_state.selected_diagnosis == "手动输入诊断..." and st.session_state.custom_diagnosis_input:
-            # 手动输入诊断模式
-            诊断输入 = st.session_state.custom_diagnosis_input.strip()
-
-            # 在诊断目录中查找诊断编码
-            诊断编码_原始 = find_diagnosis_code(诊断输入)
-
-            if 诊断编码_原始:
-                # 截取诊断编码到小数点后第一位
-                诊断编码_传统 = truncate_diagnosis_code(诊断编码_原始)
-                诊断名称_传统 = 诊断输入
-                入组情况_诊断 = f"手动输入诊断: {诊断输入} -> 编码: {诊断编码_原始} -> 截断后: {诊断编码_传统}"
-            else:
-                # 如果没有找到诊断编码，尝试将输入作为编码处理
-                诊断编码_传统 = truncate_diagnosis_code(诊断输入)
-                诊断名称_传统 = 诊断输入
-                入组情况_诊断 = f"手动输入诊断: {诊断输入} -> 直接作为编码处理 -> 截断后: {诊断编码_传统}"
-        elif st.session_state.selected_diagnosis and st.session_state.selected_diagnosis != "手动输入诊断...":
-            # 正常选择诊断模式
-            诊断编码_传统 = st.session_state.selected_diagnosis.split(" - ")[
-                0] if " - " in st.session_state.selected_diagnosis else st.session_state.selected_diagnosis
-            诊断名称_传统 = st.session_state.selected_diagnosis.split(" - ")[
-                1] if " - " in st.session_state.selected_diagnosis else st.session_state.selected_diagnosis
-            if 诊断编码_传统 == "无":
-                诊断编码_传统 = ""
-            入组情况_诊断 = "正常选择诊断"
-        else:
-            诊断编码_传统 = ""
-            诊断名称_传统 = "无"
-            入组情况_诊断 = "未选择诊断"
-
-    else:  # 先操作后诊断
-        if st.session_state.selected_diagnosis == "手动输入诊断..." and st.session_state.custom_diagnosis_input:
-            # 手动输入诊断模式
-            诊断输入 = st.session_state.custom_diagnosis_input.strip()
-
-            # 在诊断目录中查找诊断编码
-            诊断编码_原始 = find_diagnosis_code(诊断输入)
-
-            if 诊断编码_原始:
-                # 截取诊断编码到小数点后第一位
-                诊断编码_传统 = truncate_diagnosis_code(诊断编码_原始)
-                诊断名称_传统 = 诊断输入
-                入组情况_诊断 = f"手动输入诊断: {诊断输入} -> 编码: {诊断编码_原始} -> 截断后: {诊断编码_传统}"
-            else:
-                # 如果没有找到诊断编码，尝试将输入作为编码处理
-                诊断编码_传统 = truncate_diagnosis_code(诊断输入)
-                诊断名称_传统 = 诊断输入
-                入组情况_诊断 = f"手动输入诊断: {诊断输入} -> 直接作为编码处理 -> 截断后: {诊断编码_传统}"
-        elif st.session_state.selected_diagnosis and st.session_state.selected_diagnosis != "手动输入诊断...":
-            # 正常选择诊断模式
-            诊断编码_传统 = st.session_state.selected_diagnosis.split(" - ")[
-                0] if " - " in st.session_state.selected_diagnosis else st.session_state.selected_diagnosis
-            诊断名称_传统 = st.session_state.selected_diagnosis.split(" - ")[
-                1] if " - " in st.session_state.selected_diagnosis else st.session_state.selected_diagnosis
-            if 诊断编码_传统 == "无":
-                诊断编码_传统 = ""
-            入组情况_诊断 = "正常选择诊断"
-        else:
-            诊断编码_传统 = ""
-            诊断名称_传统 = "无"
-            入组情况_诊断 = "未选择诊断"
-
-    # 处理操作信息
-    if 查询顺序 == "先诊断后操作":
-        if st.session_state.selected_operation == "手动输入操作...":
-            # 手动输入操作模式
-            if st.session_state.custom_operation_input:
-                # 用户输入的内容作为操作编码或操作名称
-                操作输入 = st.session_state.custom_operation_input.strip()
-
-                # 获取诊断的病种类型
-                诊断病种类型 = get_diagnosis_type(诊断编码_传统)
-
-                # 情况1：在DIP目录库中查找匹配的操作
-                匹配记录 = find_matching_operation(诊断编码_传统, 操作输入)
-
-                if 匹配记录 is not None:
-                    # 情况1：在DIP目录库中找到匹配记录
-                    操作编码_传统 = 匹配记录['操作编码']
-                    操作名称_传统 = 匹配记录['操作名称']
-                    入组情况_操作 = "情况1：在DIP目录库中直接匹配入组"
-                elif 诊断病种类型 == "综合病种":
-                    # 情况2：诊断是综合病种，查找操作类别
-                    操作类别 = find_operation_category(操作输入)
-
-                    if 操作类别:
-                        # 根据操作类别获取综合病种的DIP信息
-                        综合病种记录 = get_comprehensive_dip_info(诊断编码_传统, 操作类别)
-
-                        if 综合病种记录 is not None:
-                            # 情况2：成功匹配综合病种
-                            操作编码_传统 = 操作输入
-                            操作名称_传统 = 操作输入
-                            匹配记录 = 综合病种记录
-                            入组情况_操作 = f"情况2：综合病种匹配，操作类别为{操作类别}"
-                        else:
-                            # 未找到匹配的综合病种记录
-                            操作编码_传统 = 操作输入
-                            操作名称_传统 = 操作输入
-                            匹配记录 = None
-                            入组情况_操作 = "无法入组：未找到匹配的综合病种记录"
-                    else:
-                        # 未找到操作类别
-                        操作编码_传统 = 操作输入
-                        操作名称_传统 = 操作输入
-                        匹配记录 = None
-                        入组情况_操作 = "无法入组：未找到操作类别"
-                elif 诊断病种类型 in ["基层病种", "核心病种"] and (not 操作输入 or 操作输入 == "无"):
-                    # 情况3：基层病种或核心病种，操作为空
-                    无操作记录 = get_diagnosis_only_dip_info(诊断编码_传统)
-
-                    if 无操作记录 is not None:
-                        # 情况3：成功匹配无操作的病种
-                        操作编码_传统 = "无"
-                        操作名称_传统 = "无"
-                        匹配记录 = 无操作记录
-                        入组情况_操作 = f"情况3：{诊断病种类型}，无操作直接入组"
-                    else:
-                        # 未找到无操作的病种记录
-                        操作编码_传统 = "无"
-                        操作名称_传统 = "无"
-                        匹配记录 = None
-                        入组情况_操作 = f"无法入组：未找到{诊断病种类型}的无操作记录"
-                else:
-                    # 其他情况：无法入组
-                    操作编码_传统 = 操作输入
-                    操作名称_传统 = 操作输入
-                    匹配记录 = None
-                    入组情况_操作 = "无法入组：不满足入组条件"
-            else:
-                # 用户未输入操作
-                操作编码_传统 = "无"
-                操作名称_传统 = "无"
-                匹配记录 = None
-                入组情况_操作 = "未输入操作"
-        elif st.session_state.selected_operation == "无操作的":
-            # 用户选择了"无操作的"选项
-            操作编码_传统 = "无"
-            操作名称_传统 = "无"
-
-            # 获取诊断的病种类型
-            诊断病种类型 = get_diagnosis_type(诊断编码_传统)
-
-            if 诊断病种类型 in ["基层病种", "核心病种"]:
-                # 情况3：基层病种或核心病种，操作为空
-                无操作记录 = get_diagnosis_only_dip_info(诊断编码_传统)
-
-                if 无操作记录 is not None:
-                    # 情况3：成功匹配无操作的病种
-                    匹配记录 = 无操作记录
-                    入组情况_操作 = f"情况3：{诊断病种类型}，无操作直接入组"
-                else:
-                    # 未找到无操作的病种记录
-                    匹配记录 = None
-                    入组情况_操作 = f"无法入组：未找到{诊断病种类型}的无操作记录"
-            else:
-                # 综合病种不能无操作
-                匹配记录 = None
-                入组情况_操作 = "无法入组：综合病种必须有操作"
-        else:
-            # 正常选择操作模式
-            if st.session_state.selected_operation and st.session_state.selected_operation != "手动输入操作..." and st.session_state.selected_operation != "无操作的":
-                操作编码_传统 = st.session_state.selected_operation.split(" - ")[
-                    0] if " - " in st.session_state.selected_operation else st.session_state.selected_operation
-                操作名称_传统 = st.session_state.selected_operation.split(" - ")[
-                    1] if " - " in st.session_state.selected_operation else "无"
-
-                # 在DIP目录库中查找匹配记录
-                匹配记录 = find_matching_operation(诊断编码_传统, 操作编码_传统)
-                入组情况_操作 = "正常选择：在DIP目录库中匹配"
-            else:
-                操作编码_传统 = "无"
-                操作名称_传统 = "无"
-                匹配记录 = None
-                入组情况_操作 = "未选择操作"
-    else:  # 先操作后诊断
-        if st.session_state.selected_operation == "手动输入操作...":
-            # 手动输入操作模式
-            if st.session_state.custom_operation_input:
-                # 用户输入的内容作为操作编码或操作名称
-                操作输入 = st.session_state.custom_operation_input.strip()
-
-                # 获取诊断的病种类型
-                诊断病种类型 = get_diagnosis_type(诊断编码_传统)
-
-                # 情况1：在DIP目录库中查找匹配的操作
-                匹配记录 = find_matching_operation(诊断编码_传统, 操作输入)
-
-                if 匹配记录 is not None:
-                    # 情况1：在DIP目录库中找到匹配记录
-                    操作编码_传统 = 匹配记录['操作编码']
-                    操作名称_传统 = 匹配记录['操作名称']
-                    入组情况_操作 = "情况1：在DIP目录库中直接匹配入组"
-                elif 诊断病种类型 == "综合病种":
-                    # 情况2：诊断是综合病种，查找操作类别
-                    操作类别 = find_operation_category(操作输入)
-
-                    if 操作类别:
-                        # 根据操作类别获取综合病种的DIP信息
-                        综合病种记录 = get_comprehensive_dip_info(诊断编码_传统, 操作类别)
-
-                        if 综合病种记录 is not None:
-                            # 情况2：成功匹配综合病种
-                            操作编码_传统 = 操作输入
-                            操作名称_传统 = 操作输入
-                            匹配记录 = 综合病种记录
-                            入组情况_操作 = f"情况2：综合病种匹配，操作类别为{操作类别}"
-                        else:
-                            # 未找到匹配的综合病种记录
-                            操作编码_传统 = 操作输入
-                            操作名称_传统 = 操作输入
-                            匹配记录 = None
-                            入组情况_操作 = "无法入组：未找到匹配的综合病种记录"
-                    else:
-                        # 未找到操作类别
-                        操作编码_传统 = 操作输入
-                        操作名称_传统 = 操作输入
-                        匹配记录 = None
-                        入组情况_操作 = "无法入组：未找到操作类别"
-                elif 诊断病种类型 in ["基层病种", "核心病种"] and (not 操作输入 or 操作输入 == "无"):
-                    # 情况3：基层病种或核心病种，操作为空
-                    无操作记录 = get_diagnosis_only_dip_info(诊断编码_传统)
-
-                    if 无操作记录 is not None:
-                        # 情况3：成功匹配无操作的病种
-                        操作编码_传统 = "无"
-                        操作名称_传统 = "无"
-                        匹配记录 = 无操作记录
-                        入组情况_操作 = f"情况3：{诊断病种类型}，无操作直接入组"
-                    else:
-                        # 未找到无操作的病种记录
-                        操作编码_传统 = "无"
-                        操作名称_传统 = "无"
-                        匹配记录 = None
-                        入组情况_操作 = f"无法入组：未找到{诊断病种类型}的无操作记录"
-                else:
-                    # 其他情况：无法入组
-                    操作编码_传统 = 操作输入
-                    操作名称_传统 = 操作输入
-                    匹配记录 = None
-                    入组情况_操作 = "无法入组：不满足入组条件"
-            else:
-                # 用户未输入操作
-                操作编码_传统 = "无"
-                操作名称_传统 = "无"
-                匹配记录 = None
-                入组情况_操作 = "未输入操作"
-        elif st.session_state.selected_operation == "无操作的":
-            # 用户选择了"无操作的"选项
-            操作编码_传统 = "无"
-            操作名称_传统 = "无"
-
-            # 获取诊断的病种类型
-            诊断病种类型 = get_diagnosis_type(诊断编码_传统)
-
-            if 诊断病种类型 in ["基层病种", "核心病种"]:
-                # 情况3：基层病种或核心病种，操作为空
-                无操作记录 = get_diagnosis_only_dip_info(诊断编码_传统)
-
-                if 无操作记录 is not None:
-                    # 情况3：成功匹配无操作的病种
-                    匹配记录 = 无操作记录
-                    入组情况_操作 = f"情况3：{诊断病种类型}，无操作直接入组"
-                else:
-                    # 未找到无操作的病种记录
-                    匹配记录 = None
-                    入组情况_操作 = f"无法入组：未找到{诊断病种类型}的无操作记录"
-            else:
-                # 综合病种不能无操作
-                匹配记录 = None
-                入组情况_操作 = "无法入组：综合病种必须有操作"
-        else:
-            # 正常选择操作模式
-            if st.session_state.selected_operation and st.session_state.selected_operation != "手动输入操作..." and st.session_state.selected_operation != "无操作的":
-                操作编码_传统 = st.session_state.selected_operation.split(" - ")[
-                    0] if " - " in st.session_state.selected_operation else st.session_state.selected_operation
-                操作名称_传统 = st.session_state.selected_operation.split(" - ")[
-                    1] if " - " in st.session_state.selected_operation else "无"
-
-                # 在DIP目录库中查找匹配记录
-                匹配记录 = find_matching_operation(诊断编码_传统, 操作编码_传统)
-                入组情况_操作 = "正常选择：在DIP目录库中匹配"
-            else:
-                操作编码_传统 = "无"
-                操作名称_传统 = "无"
-                匹配记录 = None
-                入组情况_操作 = "未选择操作"
-
-    if 操作编码_传统 == "无":
-        操作编码_传统 = ""
-
-    # 如果没有匹配记录，尝试在DIP数据库中查找匹配的诊断记录
-    if 匹配记录 is None and 诊断编码_传统:
-        匹配记录 = find_matching_diagnosis(诊断编码_传统)
-        if 匹配记录 is not None:
-            入组情况_诊断 = f"手动输入诊断匹配成功: {诊断编码_传统}"
-
-    # 获取完整的记录信息
-    if 匹配记录 is not None:
-        # 找到匹配记录
-        诊断名称_传统 = replace_nan_with_chinese(匹配记录['诊断名称'])
-        诊断编码_传统 = 诊断编码_传统
-        操作名称_传统 = replace_nan_with_chinese(匹配记录['操作名称']) if '操作名称' in 匹配记录 else 操作名称_传统
-        操作编码_传统 = 操作编码_传统 if 操作编码_传统 else replace_nan_with_chinese(匹配记录.get('操作编码', '无'))
-        入组的DIP基准分值_传统 = 匹配记录['入组的DIP基准分值']
-        # 同步更新session state中的基准分值
-        st.session_state.dip_base_score = 入组的DIP基准分值_传统
-        DIP编码_传统 = replace_nan_with_chinese(匹配记录.get('DIP编码', '无'))
-        DIP名称_传统 = replace_nan_with_chinese(匹配记录.get('DIP名称', '无'))
-        病种类型_传统 = replace_nan_with_chinese(匹配记录.get('病种类型', '无'))
-        可入组 = True
-    else:
-        # 未找到匹配记录
-        诊断名称_传统 = 诊断名称_传统 if '诊断名称_传统' in locals() else "无"
-        诊断编码_传统 = 诊断编码_传统
-        操作名称_传统 = 操作名称_传统 if '操作名称_传统' in locals() else "无"
-        操作编码_传统 = 操作编码_传统
-        入组的DIP基准分值_传统 = 27.7173  # 使用图片中的默认值
-        # 同步更新session state中的基准分值
-        st.session_state.dip_base_score = 入组的DIP基准分值_传统
-        DIP编码_传统 = "无"
-        DIP名称_传统 = "无法入组"
-        病种类型_传统 = "无法入组"
-        可入组 = False
+    # 按入组流程对当前选择入组（入组逻辑在dip_grouping.py中，与命令行批量入组共用）
+    # 入组结果按目录版本和输入缓存，只调整费用等参数时不再重复入组
+    分组结果 = group_case_cached(
+        get_catalog_index(), 查询顺序,
+        st.session_state.selected_diagnosis, st.session_state.custom_diagnosis_input,
+        st.session_state.selected_operation, st.session_state.custom_operation_input,
+        默认匹配阈值 if 模糊匹配 else None
+    )
+    诊断名称_传统 = 分组结果['诊断名称']
+    诊断编码_传统 = 分组结果['诊断编码']
+    操作名称_传统 = 分组结果['操作名称']
+    操作编码_传统 = 分组结果['操作编码']
+    入组的DIP基准分值_传统 = 分组结果['入组的DIP基准分值']
+    DIP编码_传统 = 分组结果['DIP编码']
+    DIP名称_传统 = 分组结果['DIP名称']
+    病种类型_传统 = 分组结果['病种类型']
+    入组情况_诊断 = 分组结果['入组情况_诊断']
+    入组情况_操作 = 分组结果['入组情况_操作']
+    可入组 = 分组结果['可入组']
+
+    # 同步更新session state中的基准分值
+    st.session_state.dip_base_score = 入组的DIP基准分值_传统
 
     # 更新全局变量
     诊断名称 = 诊断名称_传统
@@ -1073,6 +805,7 @@ if st.session_state.show_group_info and (
         st.write(f"**诊断名称:** {诊断名称}")
         st.write(f"**操作编码:** {操作编码}")
         st.write(f"**操作名称:** {操作名称}")
+        st.caption(f"入组结果缓存：{len(grouping_cache)} 条，命中 {grouping_cache.hits} 次，未命中 {grouping_cache.misses} 次")
 
 # 添加入组的DIP基准分值输入框
 # 使用session state来存储和同步分值
@@ -1210,6 +943,153 @@ fig.update_layout(
 
 st.plotly_chart(fig, use_container_width=True)
 
+# 参数敏感性分析：在两个参数的取值网格上一次计算当前病例（或上传的一批病例）的指标，其余参数取侧边栏的值
+st.header('参数敏感性分析')
+if st.checkbox("显示参数敏感性分析（点值、医院等级系数、成本率的网格扫描）", key='show_sweep'):
+    # 参数 -> (最小值, 最大值, 默认范围, 步长)
+    扫描范围 = {
+        '点值': (40.0, 120.0, (60.0, 80.0), 0.5),
+        '医院等级系数': (0.5, 2.0, (0.9, 1.2), 0.01),
+        '医疗性收入成本率': (0.0, 1.5, (0.3, 1.0), 0.05),
+        '药耗成本率': (0.0, 1.5, (0.3, 1.0), 0.05)
+    }
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        横轴参数 = st.selectbox("横轴参数", 扫描参数, index=0, key='sweep_x')
+        横轴范围 = st.slider(f"{横轴参数}范围", *扫描范围[横轴参数], key=f'sweep_x_range_{横轴参数}')
+    with col2:
+        纵轴参数 = st.selectbox("纵轴参数", [name for name in 扫描参数 if name != 横轴参数], index=1, key='sweep_y')
+        纵轴范围 = st.slider(f"{纵轴参数}范围", *扫描范围[纵轴参数], key=f'sweep_y_range_{纵轴参数}')
+    with col3:
+        扫描指标选择 = st.selectbox("指标", ['DIP盈亏金额', '病例真实盈亏金额', 'DIP核算金额', 'DIP回款率'],
+                                key='sweep_metric')
+        网格点数 = st.number_input("每个参数的取值个数", min_value=2, max_value=101, value=21, key='sweep_points')
+        图表类型 = st.radio("图表类型", ['热力图', '等高线图'], horizontal=True, key='sweep_chart')
+
+    扫描病例文件 = st.file_uploader(
+        "上传一批病例（可选，.csv或Excel）：没有入组的DIP基准分值列时按当前目录入组；不上传时对当前病例扫描",
+        type=['csv', 'xlsx', 'xls'], key='sweep_cases'
+    )
+    try:
+        if 扫描病例文件 is not None:
+            扫描病例 = load_uploaded_cases(扫描病例文件)
+        else:
+            扫描病例 = pd.DataFrame([{
+                '诊疗费用': 诊疗费用, '检查检验费用': 检查检验费用, '药品费用': 药品费用, '耗材费用': 耗材费用,
+                '统筹基金支付金额': 统筹基金支付金额, '入组的DIP基准分值': 入组的DIP基准分值
+            }])
+        参数网格 = {'点值': 点值, '医院等级系数': 医院等级系数,
+                  '医疗性收入成本率': 医疗性收入成本率, '药耗成本率': 药耗成本率}
+        参数网格[横轴参数] = np.linspace(*横轴范围, int(网格点数))
+        参数网格[纵轴参数] = np.linspace(*纵轴范围, int(网格点数))
+        扫描矩阵 = sweep_matrix(sweep_dip_metrics(扫描病例, 参数网格), 横轴参数, 纵轴参数, 扫描指标选择)
+    except (OSError, ValueError) as e:
+        st.error(f"参数敏感性分析失败: {str(e)}")
+    else:
+        图表 = go.Heatmap if 图表类型 == '热力图' else go.Contour
+        sweep_fig = go.Figure(图表(
+            z=扫描矩阵.to_numpy(), x=扫描矩阵.columns, y=扫描矩阵.index,
+            colorscale='RdYlGn', zmid=1.0 if 扫描指标选择 == 'DIP回款率' else 0.0,
+            colorbar=dict(title=扫描指标选择)
+        ))
+        sweep_fig.update_layout(height=500, xaxis_title=横轴参数, yaxis_title=纵轴参数,
+                                title_text=f"{扫描指标选择}（{'合计' if len(扫描病例) > 1 else '当前病例'}）")
+        st.plotly_chart(sweep_fig, use_container_width=True)
+        st.caption(f"病例数: {len(扫描病例)}，网格: {int(网格点数)}×{int(网格点数)}，其余参数取侧边栏的值")
+
+# 点值风险模拟：结算点值年终才确定，按分布抽样点值和成本率，查看DIP盈亏金额合计的分布
+st.header('点值风险模拟')
+if st.checkbox("显示点值风险模拟（蒙特卡洛）", key='show_montecarlo'):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        点值分布 = distribution_input('点值', 点值, '正态', 'mc_point')
+    with col2:
+        医疗性收入成本率分布 = distribution_input('医疗性收入成本率', 医疗性收入成本率, '固定', 'mc_medical')
+    with col3:
+        药耗成本率分布 = distribution_input('药耗成本率', 药耗成本率, '固定', 'mc_drug')
+    col1, col2 = st.columns(2)
+    with col1:
+        抽样次数 = st.number_input("抽样次数", min_value=1000, max_value=1000000, value=100000, step=10000,
+                               key='mc_draws')
+    with col2:
+        随机数种子 = st.number_input("随机数种子", min_value=0, value=0, step=1, key='mc_seed')
+
+    模拟病例文件 = st.file_uploader(
+        "上传一批病例（可选，.csv或Excel）：没有入组的DIP基准分值列时按当前目录入组；不上传时对当前病例模拟",
+        type=['csv', 'xlsx', 'xls'], key='mc_cases'
+    )
+    try:
+        if 模拟病例文件 is not None:
+            模拟病例 = load_uploaded_cases(模拟病例文件)
+        else:
+            模拟病例 = pd.DataFrame([{
+                '诊疗费用': 诊疗费用, '检查检验费用': 检查检验费用, '药品费用': 药品费用, '耗材费用': 耗材费用,
+                '统筹基金支付金额': 统筹基金支付金额, '入组的DIP基准分值': 入组的DIP基准分值
+            }])
+        模拟结果 = simulate_point_value_risk(
+            模拟病例,
+            {'点值': 点值分布, '医疗性收入成本率': 医疗性收入成本率分布, '药耗成本率': 药耗成本率分布},
+            int(抽样次数), 医院等级系数, int(随机数种子)
+        )
+    except (OSError, ValueError) as e:
+        st.error(f"点值风险模拟失败: {str(e)}")
+    else:
+        模拟汇总 = summarize_simulation(模拟结果)
+        st.dataframe(模拟汇总)
+
+        mc_fig = go.Figure(go.Histogram(x=模拟结果['DIP盈亏金额'], nbinsx=100, name="DIP盈亏金额"))
+        for 百分位 in ['P5', 'P50', 'P95']:
+            mc_fig.add_vline(x=模拟汇总.loc[0, 百分位], line_dash="dash", line_color="red",
+                             annotation_text=百分位)
+        mc_fig.update_layout(height=400, xaxis_title="DIP盈亏金额合计", yaxis_title="抽样次数",
+                             title_text=f"DIP盈亏金额合计的分布（{len(模拟病例)} 个病例，{len(模拟结果)} 次抽样）")
+        st.plotly_chart(mc_fig, use_container_width=True)
+
+# 年终点值估算：由居民、职工的统筹基金预算和一批入组病例的总分值反推点值
+st.header('年终点值估算')
+if st.checkbox("显示年终点值估算", key='show_point_value_estimate'):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        居民基金预算 = st.number_input("居民统筹基金预算（元）", min_value=0.0, value=0.0, step=1000000.0,
+                                 format="%.2f", key='pv_budget_resident')
+        职工基金预算 = st.number_input("职工统筹基金预算（元）", min_value=0.0, value=0.0, step=1000000.0,
+                                 format="%.2f", key='pv_budget_employee')
+    with col2:
+        估算方法 = st.radio("估算方法", ['总分值法', '迭代法（高低倍率调整）'], key='pv_method')
+    with col3:
+        高倍率界限 = st.number_input("高倍率界限", min_value=1.0, value=默认高倍率界限, step=0.1, key='pv_high_ratio')
+        低倍率界限 = st.number_input("低倍率界限", min_value=0.0, max_value=1.0, value=默认低倍率界限, step=0.1,
+                                key='pv_low_ratio')
+
+    估算病例文件 = st.file_uploader(
+        "上传全部病例（.csv或Excel）：没有入组的DIP基准分值列时按当前目录入组；没有参保类型列时全部计入当前点值类型",
+        type=['csv', 'xlsx', 'xls'], key='pv_cases'
+    )
+    基金预算 = {名称: 预算 for 名称, 预算 in [('居民', 居民基金预算), ('职工', 职工基金预算)] if 预算 > 0}
+    if 估算病例文件 is None or not 基金预算:
+        st.info("请输入统筹基金预算并上传病例文件")
+    else:
+        try:
+            估算病例 = prepare_point_value_cases([load_uploaded_cases(估算病例文件)], 医院等级系数,
+                                             默认参保类型=点值类型)
+            if 估算方法 == '总分值法':
+                点值估算 = estimate_point_values(估算病例, 基金预算)
+            else:
+                点值估算 = estimate_point_values_iterative(估算病例, 基金预算, 高倍率界限, 低倍率界限)
+        except (OSError, ValueError) as e:
+            st.error(f"年终点值估算失败: {str(e)}")
+        else:
+            st.dataframe(点值估算)
+            估算点值 = {row['参保类型']: row['估算点值'] for _, row in 点值估算.iterrows() if pd.notna(row['估算点值'])}
+            if 估算方法 != '总分值法' and not 点值估算['是否收敛'].all():
+                st.warning("部分参保类型的迭代没有收敛，请检查基金预算和倍率界限")
+
+            def use_estimated_point_values():
+                st.session_state.estimated_point_values = 估算点值
+
+            st.button("使用估算点值", on_click=use_estimated_point_values, disabled=not 估算点值,
+                      help="侧边栏的点值默认取估算点值")
+
 # 显示当前选择的DIP信息
 st.header('当前选择的DIP病种信息')
 col1, col2 = st.columns(2)
@@ -1237,30 +1117,36 @@ with col2:
 
 # 显示DIP数据库
 st.header('当前DIP病种及分值目录库')
-# 在显示前处理数据库中的NaN值
-display_database = st.session_state.dip_database.copy()
-for col in display_database.columns:
-    if display_database[col].dtype == 'object':
-        display_database[col] = display_database[col].apply(replace_nan_with_chinese)
-st.dataframe(display_database)
+# 目录在导入时已规范化NaN值，这里不再逐个单元格处理
+st.dataframe(ensure_normalized(get_catalog('dip_database')))
+
+# 上传新的DIP目录后，与上传前的目录对比新增、删除和分值调整的病种组合
+对比基准版本 = st.session_state.get('dip_diff_base_version')
+if 对比基准版本 and 对比基准版本 != st.session_state.dip_database_version:
+    原目录 = catalog_registry.get(对比基准版本)
+    if 原目录 is not None:
+        try:
+            差异明细, 差异汇总 = get_catalog_diff(对比基准版本, st.session_state.dip_database_version,
+                                           原目录, get_catalog('dip_database'), 分组规则)
+        except ValueError as e:
+            st.error(f"目录变更对比失败: {str(e)}")
+        else:
+            with st.expander("📊 目录变更对比（与上传前的目录）", expanded=True):
+                st.write("**按病种类型汇总**")
+                st.dataframe(差异汇总)
+                有变化 = 差异明细[差异明细['变化类型'] != '未变化']
+                st.write(f"**有变化的病种组合:** {len(有变化)} 个")
+                st.dataframe(有变化)
 
 # 显示手术操作分类目录
 st.header('当前手术操作分类目录')
-# 在显示前处理数据库中的NaN值
-display_surgery_database = st.session_state.surgery_database.copy()
-for col in display_surgery_database.columns:
-    if display_surgery_database[col].dtype == 'object':
-        display_surgery_database[col] = display_surgery_database[col].apply(replace_nan_with_chinese)
-st.dataframe(display_surgery_database)
+# 目录在导入时已规范化NaN值，这里不再逐个单元格处理
+st.dataframe(ensure_normalized(get_catalog('surgery_database')))
 
 # 显示诊断编码及名称目录
 st.header('当前诊断编码及名称目录')
-# 在显示前处理数据库中的NaN值
-display_diagnosis_database = st.session_state.diagnosis_database.copy()
-for col in display_diagnosis_database.columns:
-    if display_diagnosis_database[col].dtype == 'object':
-        display_diagnosis_database[col] = display_diagnosis_database[col].apply(replace_nan_with_chinese)
-st.dataframe(display_diagnosis_database)
+# 目录在导入时已规范化NaN值，这里不再逐个单元格处理
+st.dataframe(ensure_normalized(get_catalog('diagnosis_database')))
 
 # 详细计算数据表格
 st.header('详细计算数据')
@@ -0,0 +1,289 @@
+# dip_batch.py - 命令行批量入组与指标计算（不依赖Streamlit和Plotly，可在结算服务器上定时运行）
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from dip_catalog import CatalogIndex
+from dip_fuzzy import 默认匹配阈值
+from dip_grouping import group_cases, 分组列
+from dip_incremental import (DependencyTracker, load_dependencies, read_scored_file, save_dependencies,
+                             update_scored_results)
+from dip_io import (ResultWriter, iter_case_chunks, load_catalog_file, load_catalog_snapshot, load_category_suffixes,
+                    read_case_file, write_result_file, 目录必要列)
+from dip_metrics import (calculate_dip_metrics_frame, 默认点值, 默认医院等级系数,
+                         默认医疗性收入成本率, 默认药耗成本率)
+from dip_store import CatalogStore
+
+# 多进程模式下每个任务处理的病例数
+每块病例数 = 100000
+
+# 内存对比中的结果编码列
+结果编码列 = ['入组诊断编码', '入组操作编码', 'DIP编码']
+
+# 工作进程中的目录索引，由进程池初始化函数设置，每个进程只接收一次
+_worker_index = None
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="DIP病种批量入组与费用分析：读取病例文件和目录，输出入组结果和DIP指标"
+    )
+    parser.add_argument('cases', help="病例文件（.csv或Excel），需包含诊断编码（或诊断名称）、四项费用和统筹基金支付金额")
+    parser.add_argument('-o', '--output', required=True, help="结果文件（.csv或Excel）")
+    parser.add_argument('--snapshot-dir', help="目录快照所在目录，单独指定的目录文件优先")
+    parser.add_argument('--store-dir', default='catalog_store', help="多版本目录库所在目录")
+    parser.add_argument('--catalog-version', help="使用目录库中的命名版本（同时使用该版本保存的点值），单独指定的目录文件优先")
+    parser.add_argument('--dip-catalog', help="DIP病种及分值目录（.xlsx/.csv/.npz）")
+    parser.add_argument('--surgery-catalog', help="手术操作分类目录（.xlsx/.csv/.npz）")
+    parser.add_argument('--diagnosis-catalog', help="诊断编码及名称目录（.xlsx/.csv/.npz）")
+    parser.add_argument('--rules', help="入组规则文件（JSON），配置综合病种操作类别对应的DIP组别后缀")
+    parser.add_argument('--point-type', choices=list(默认点值), default='职工', help="点值类型，决定默认点值")
+    parser.add_argument('--point-value', type=float, help="点值，默认按点值类型取值")
+    parser.add_argument('--level-coefficient', type=float, help=f"医院等级系数，默认{默认医院等级系数}")
+    parser.add_argument('--medical-cost-ratio', type=float, help=f"医疗性收入成本率，默认{默认医疗性收入成本率}")
+    parser.add_argument('--drug-cost-ratio', type=float, help=f"药耗成本率，默认{默认药耗成本率}")
+    parser.add_argument('--workers', type=int, default=1, help="工作进程数，0表示使用全部CPU，默认1（单进程）")
+    parser.add_argument('--chunk-rows', type=int, default=每块病例数, help="多进程或流式模式下每块的病例数")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help=f"目录中找不到的诊断名称和操作按名称模糊匹配入组（最低得分默认{默认匹配阈值}）")
+    parser.add_argument('--fuzzy-threshold', type=float, default=默认匹配阈值, help="模糊匹配最低得分（0~1）")
+    parser.add_argument('--stream', action='store_true',
+                        help="流式模式：按块读取、入组并写出，内存占用与文件大小无关（适用于超大的结算导出文件）")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量模式：cases为之前输出的结果文件，按其依赖记录只重算受目录或参数变化影响的病例和指标列，"
+                             "未指定的参数沿用上次的取值")
+    parser.add_argument('--memory-report', action='store_true',
+                        help="汇总中输出结果编码列按object字符串与按int32编号存储的内存对比")
+    return parser
+
+
+def load_catalogs(snapshot_dir=None, dip_catalog=None, surgery_catalog=None, diagnosis_catalog=None,
+                  store_dir=None, catalog_version=None):
+    """加载三个目录：先读目录库版本或快照目录，再用单独指定的文件覆盖；缺少的辅助目录使用空目录"""
+    if catalog_version:
+        catalogs = CatalogStore(store_dir).load(catalog_version)
+    else:
+        catalogs = load_catalog_snapshot(snapshot_dir) if snapshot_dir else {}
+    for name, file_path in [('dip_database', dip_catalog),
+                            ('surgery_database', surgery_catalog),
+                            ('diagnosis_database', diagnosis_catalog)]:
+        if file_path:
+            catalogs[name] = load_catalog_file(file_path, name)
+
+    if 'dip_database' not in catalogs:
+        raise ValueError("未指定DIP病种及分值目录（--dip-catalog 或 --snapshot-dir）")
+    for name in ['surgery_database', 'diagnosis_database']:
+        if name not in catalogs:
+            catalogs[name] = pd.DataFrame(columns=目录必要列[name])
+    return catalogs
+
+
+def resolve_point_value(point_value, point_type, store_dir=None, catalog_version=None, default=None):
+    """确定点值：指定的点值优先，其次为目录库版本保存的点值，再次为default，最后按点值类型取默认点值"""
+    if point_value is None and catalog_version:
+        point_value = CatalogStore(store_dir).get_metadata(catalog_version).get('点值', {}).get(point_type)
+    if point_value is None:
+        point_value = default
+    if point_value is None:
+        point_value = 默认点值[point_type]
+    return point_value
+
+
+def build_catalog_index(catalogs, category_suffixes=None):
+    """由目录字典构建目录索引"""
+    return CatalogIndex(catalogs['dip_database'], catalogs['surgery_database'], catalogs['diagnosis_database'],
+                        category_suffixes)
+
+
+def score_cases(index, cases, 医疗性收入成本率, 药耗成本率, 医院等级系数, 点值, fuzzy_threshold=None):
+    """对病例表入组并计算DIP指标，返回 病例原始列 + 分组列 + 指标列"""
+    grouped = group_cases(index, cases, fuzzy_threshold)
+    cases = cases.drop(columns=[col for col in 分组列 if col in cases.columns])
+    scored = pd.concat([cases, grouped], axis=1)
+    metrics = calculate_dip_metrics_frame(scored, 医疗性收入成本率, 药耗成本率, 医院等级系数, 点值)
+    scored = scored.drop(columns=[col for col in metrics.columns if col in scored.columns])
+    return pd.concat([scored, metrics], axis=1)
+
+
+def _init_worker(index):
+    """进程池初始化：保存目录索引，之后的任务不再重复传输目录"""
+    global _worker_index
+    _worker_index = index
+
+
+def _score_chunk(task):
+    """在工作进程中对一块病例入组并计算指标"""
+    cases, params = task
+    return score_cases(_worker_index, cases, *params)
+
+
+def score_cases_parallel(index, cases, 医疗性收入成本率, 药耗成本率, 医院等级系数, 点值,
+                         workers=1, chunk_rows=每块病例数, fuzzy_threshold=None):
+    """多进程入组并计算DIP指标
+
+    病例表按行切分成连续的块，由进程池并行处理后按原始顺序合并，
+    结果与单进程完全一致，不受进程数影响。workers<=1或病例数不足一块时直接在当前进程计算。
+    """
+    if workers is not None and workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(cases) <= chunk_rows:
+        return score_cases(index, cases, 医疗性收入成本率, 药耗成本率, 医院等级系数, 点值, fuzzy_threshold)
+
+    params = (医疗性收入成本率, 药耗成本率, 医院等级系数, 点值, fuzzy_threshold)
+    tasks = [(cases.iloc[start:start + chunk_rows], params) for start in range(0, len(cases), chunk_rows)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as executor:
+        results = list(executor.map(_score_chunk, tasks))
+    return pd.concat(results)
+
+
+def iter_scored_chunks(index, chunks, 医疗性收入成本率, 药耗成本率, 医院等级系数, 点值, workers=1,
+                       fuzzy_threshold=None):
+    """对病例块序列逐块入组并计算指标，按输入顺序产出结果
+
+    多进程时同时在途的块数限制为进程数的2倍，读取速度快于计算时也不会积压在内存中。
+    """
+    if workers is not None and workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for cases in chunks:
+            yield score_cases(index, cases, 医疗性收入成本率, 药耗成本率, 医院等级系数, 点值, fuzzy_threshold)
+        return
+
+    params = (医疗性收入成本率, 药耗成本率, 医院等级系数, 点值, fuzzy_threshold)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as executor:
+        pending = deque()
+        for cases in chunks:
+            pending.append(executor.submit(_score_chunk, (cases, params)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class BatchSummary:
+    """逐块累加的入组和金额汇总，不需要保留全部病例
+
+    指定code_dictionary时同时累加结果编码列按object字符串与按int32编号存储的内存。
+    """
+
+    def __init__(self, code_dictionary=None):
+        self.code_dictionary = code_dictionary
+        self.object字节数 = 0
+        self.int32字节数 = 0
+        self.病例数 = 0
+        self.可入组病例数 = 0
+        self.DIP核算金额合计 = 0.0
+        self.DIP盈亏金额合计 = 0.0
+        self.病例真实盈亏金额合计 = 0.0
+
+    def update(self, scored):
+        """累加一块结果"""
+        self.病例数 += len(scored)
+        self.可入组病例数 += int(scored['可入组'].sum())
+        self.DIP核算金额合计 += float(scored['DIP核算金额'].sum())
+        self.DIP盈亏金额合计 += float(scored['DIP盈亏金额'].sum())
+        self.病例真实盈亏金额合计 += float(scored['病例真实盈亏金额'].sum())
+        if self.code_dictionary is not None:
+            report = self.code_dictionary.memory_report(scored, 结果编码列)
+            self.object字节数 += report['object字节数']
+            self.int32字节数 += report['int32字节数']
+        return self
+
+    def print(self, elapsed):
+        """输出汇总信息"""
+        print(f"病例数: {self.病例数}，可入组: {self.可入组病例数}，耗时: {elapsed:.2f}秒")
+        print(f"DIP核算金额合计: {self.DIP核算金额合计:,.2f}")
+        print(f"DIP盈亏金额合计: {self.DIP盈亏金额合计:,.2f}")
+        print(f"病例真实盈亏金额合计: {self.病例真实盈亏金额合计:,.2f}")
+        if self.code_dictionary is not None:
+            字典字节数 = self.code_dictionary.nbytes()
+            节省字节数 = self.object字节数 - self.int32字节数 - 字典字节数
+            print(f"编码列内存（{'、'.join(结果编码列)}）: object {self.object字节数 / 2 ** 20:,.1f} MB → "
+                  f"int32 {self.int32字节数 / 2 ** 20:,.1f} MB + 编码字典 {字典字节数 / 2 ** 20:,.1f} MB，"
+                  f"节省 {节省字节数 / 2 ** 20:,.1f} MB")
+
+
+def run_stream(index, args, 点值, fuzzy_threshold=None, tracker=None, summary=None):
+    """流式模式：逐块读取病例、入组计算、写出结果并累加汇总，报告每秒处理行数"""
+    summary = summary if summary is not None else BatchSummary()
+    start = time.perf_counter()
+    chunks = iter_case_chunks(args.cases, args.chunk_rows)
+    with ResultWriter(args.output) as writer:
+        for scored in iter_scored_chunks(index, chunks, args.medical_cost_ratio, args.drug_cost_ratio,
+                                         args.level_coefficient, 点值, args.workers, fuzzy_threshold):
+            writer.write(scored)
+            summary.update(scored)
+            if tracker is not None:
+                tracker.update(scored)
+            elapsed = time.perf_counter() - start
+            print(f"已处理 {summary.病例数} 行，{summary.病例数 / max(elapsed, 1e-9):,.0f} 行/秒", file=sys.stderr)
+    return summary
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    fuzzy_threshold = args.fuzzy_threshold if args.fuzzy else None
+
+    start = time.perf_counter()
+    try:
+        if args.incremental and args.stream:
+            raise ValueError("增量模式不能与--stream同时使用")
+        previous = load_dependencies(args.cases) if args.incremental else None
+        # 未指定的参数：增量模式沿用上次的取值，否则使用默认值
+        参数默认值 = previous['参数'] if previous else {
+            '医疗性收入成本率': 默认医疗性收入成本率, '药耗成本率': 默认药耗成本率, '医院等级系数': 默认医院等级系数}
+        for attr, col in [('medical_cost_ratio', '医疗性收入成本率'), ('drug_cost_ratio', '药耗成本率'),
+                          ('level_coefficient', '医院等级系数')]:
+            if getattr(args, attr) is None:
+                setattr(args, attr, 参数默认值[col])
+        点值 = resolve_point_value(args.point_value, args.point_type, args.store_dir, args.catalog_version,
+                                 previous['参数']['点值'] if previous else None)
+        参数 = {'医疗性收入成本率': args.medical_cost_ratio, '药耗成本率': args.drug_cost_ratio,
+              '医院等级系数': args.level_coefficient, '点值': 点值}
+        catalogs = load_catalogs(args.snapshot_dir, args.dip_catalog, args.surgery_catalog, args.diagnosis_catalog,
+                                 args.store_dir, args.catalog_version)
+        category_suffixes = load_category_suffixes(args.rules) if args.rules else None
+        index = build_catalog_index(catalogs, category_suffixes)
+        if fuzzy_threshold is not None:
+            # 在主进程中构建模糊匹配器，随目录索引一起传给工作进程
+            index.fuzzy_matchers()
+        report = None
+        summary = BatchSummary(index.code_dictionary if args.memory_report else None)
+        if args.stream:
+            tracker = DependencyTracker(index, 参数, fuzzy_threshold)
+            run_stream(index, args, 点值, fuzzy_threshold, tracker, summary)
+            metadata = tracker.metadata()
+        elif args.incremental:
+            scored, metadata, report = update_scored_results(read_scored_file(args.cases), previous, index, 参数,
+                                                             fuzzy_threshold)
+            write_result_file(scored, args.output)
+            summary.update(scored)
+        else:
+            cases = read_case_file(args.cases)
+            scored = score_cases_parallel(index, cases, args.medical_cost_ratio, args.drug_cost_ratio,
+                                          args.level_coefficient, 点值, args.workers, args.chunk_rows,
+                                          fuzzy_threshold)
+            write_result_file(scored, args.output)
+            summary.update(scored)
+            metadata = DependencyTracker(index, 参数, fuzzy_threshold).update(scored).metadata()
+        # 依赖记录与结果文件一起保存，之后可以按它增量重算
+        save_dependencies(args.output, metadata)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    summary.print(time.perf_counter() - start)
+    if report is not None:
+        print(f"重新入组: {report['重新入组行数']} 行，重算指标: {report['重算指标行数']} 行"
+              f"（{'、'.join(report['重算指标列']) or '无'}）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# dip_cache.py - 进程级LRU缓存
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """线程安全的LRU缓存，记录命中和未命中次数
+
+    缓存为进程级，Streamlit的所有浏览器会话共享；超过容量时淘汰最久未使用的条目。
+    缓存的对象会被多个会话同时引用，调用方不能原地修改。
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """取出缓存的对象，未命中时返回None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """放入对象，超过容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, key, create):
+        """取出缓存的对象，未命中时调用create()生成并放入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """清空缓存并重置计数"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
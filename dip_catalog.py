@@ -0,0 +1,343 @@
+# dip_catalog.py - DIP目录索引
+import hashlib
+import re
+import unicodedata
+
+import pandas as pd
+
+from dip_cache import LRUCache
+from dip_codes import CodeDictionary
+from dip_fuzzy import build_fuzzy_matchers, 默认候选条数
+
+# 下拉框选项缓存最多保留的目录版本数
+最大选项缓存条目数 = 8
+
+# 综合病种按操作类别确定DIP组别（DIP名称中包含的组别后缀），可由规则文件覆盖
+默认操作类别组别 = {
+    '手术': '手术组',
+    '介入治疗': '手术组',
+    '治疗性操作': '治疗组',
+    '诊断性操作': '诊断组'
+}
+
+
+def _is_missing(value):
+    """判断值是否缺失（None、NaN或pd.NA），比逐个调用pd.isna快"""
+    return value is None or value is pd.NA or value != value
+
+
+def is_empty_value(value):
+    """判断目录中的值是否为空（NaN、None、空字符串或中文'无'）"""
+    return _is_missing(value) or value == "" or value == "无"
+
+
+def replace_nan_with_chinese(value):
+    """将NaN、None或空值替换为中文'无'"""
+    if pd.isna(value) or value is None or value == "":
+        return "无"
+    return value
+
+
+def normalize_diagnosis_key(diagnosis_code):
+    """诊断编码的查找键：全角转半角、去除首尾空白、字母转大写，扩展编码中的"x"（首字母之后）统一为小写
+
+    规则与dip_grouping.normalize_diagnosis_codes一致（不截断），目录索引的键和查找时的编码都按此规范化，
+    I10.X与I10.x、i10.x查找到同一条目录记录；不以"字母+数字"开头的取值只去除首尾空白。
+    """
+    if not isinstance(diagnosis_code, str):
+        return diagnosis_code
+    text = unicodedata.normalize('NFKC', diagnosis_code).strip()
+    upper = text.upper()
+    if re.match(r'[A-Z]\d', upper):
+        return upper[:1] + upper[1:].replace('X', 'x')
+    return text
+
+
+def catalog_hash(catalog):
+    """计算目录内容的哈希（列名和各行取值），内容相同的目录哈希相同"""
+    digest = hashlib.sha256()
+    digest.update('\x1f'.join(str(col) for col in catalog.columns).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(catalog, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _column_values(database, column):
+    """取出目录中的一列，列不存在时返回全None列表"""
+    if column in database.columns:
+        return database[column].tolist()
+    return [None] * len(database)
+
+
+class CatalogIndex:
+    """DIP病种目录、手术操作分类目录和诊断目录的字典索引
+
+    每次加载目录时构建一次，入组查询只做字典查找，不再对整个目录做布尔筛选。
+    所有查找都保留原有"取第一条匹配记录"的语义；诊断编码键按normalize_diagnosis_key规范化，与批量入组的规范化一致。
+    category_suffixes为操作类别 -> 组别后缀，默认使用默认操作类别组别。
+    """
+
+    def __init__(self, dip_database, surgery_database, diagnosis_database, category_suffixes=None):
+        self.dip_database = dip_database
+        self.surgery_database = surgery_database
+        self.diagnosis_database = diagnosis_database
+        self.category_suffixes = dict(category_suffixes if category_suffixes is not None else 默认操作类别组别)
+        # DIP目录内容哈希，作为下拉框选项等派生数据的缓存键
+        self.dip_version = catalog_hash(dip_database)
+
+        # 诊断编码 -> 行号列表；(诊断编码, 操作编码) -> 行号；(诊断编码, 操作名称) -> 行号
+        self.diagnosis_rows = {}
+        self.operation_code_rows = {}
+        self.operation_name_rows = {}
+        # 诊断编码 -> 无操作记录的行号（用于基层病种和核心病种）
+        self.no_operation_rows = {}
+
+        诊断编码列 = _column_values(dip_database, '诊断编码')
+        操作编码列 = _column_values(dip_database, '操作编码')
+        操作名称列 = _column_values(dip_database, '操作名称')
+        self.dip_names = _column_values(dip_database, 'DIP名称')
+        self.diagnosis_types = _column_values(dip_database, '病种类型')
+        诊断编码列 = [normalize_diagnosis_key(诊断编码) for 诊断编码 in 诊断编码列]
+        for pos, (诊断编码, 操作编码, 操作名称) in enumerate(zip(诊断编码列, 操作编码列, 操作名称列)):
+            if _is_missing(诊断编码):
+                continue
+            self.diagnosis_rows.setdefault(诊断编码, []).append(pos)
+            if is_empty_value(操作编码):
+                self.no_operation_rows.setdefault(诊断编码, pos)
+            if not _is_missing(操作编码):
+                self.operation_code_rows.setdefault((诊断编码, 操作编码), pos)
+            if not _is_missing(操作名称):
+                self.operation_name_rows.setdefault((诊断编码, 操作名称), pos)
+
+        # (诊断编码, 组别后缀) -> 该诊断下第一条DIP名称包含组别后缀的行号（综合病种情况2）
+        self.comprehensive_rows = {}
+        组别后缀 = list(dict.fromkeys(self.category_suffixes.values()))
+        for pos, (诊断编码, DIP名称) in enumerate(zip(诊断编码列, self.dip_names)):
+            if _is_missing(诊断编码) or not isinstance(DIP名称, str):
+                continue
+            for suffix in 组别后缀:
+                if suffix in DIP名称:
+                    self.comprehensive_rows.setdefault((诊断编码, suffix), pos)
+
+        # 操作编码/操作名称 -> 操作类别
+        self.operation_category_by_code = {}
+        self.operation_category_by_name = {}
+        for 操作编码, 操作名称, 操作类别 in zip(_column_values(surgery_database, '操作编码'),
+                                          _column_values(surgery_database, '操作名称'),
+                                          _column_values(surgery_database, '操作类别')):
+            if not _is_missing(操作编码):
+                self.operation_category_by_code.setdefault(操作编码, 操作类别)
+            if not _is_missing(操作名称):
+                self.operation_category_by_name.setdefault(操作名称, 操作类别)
+
+        # 诊断名称 -> 诊断编码
+        self.diagnosis_code_by_name = {}
+        for 诊断编码, 诊断名称 in zip(_column_values(diagnosis_database, '诊断编码'),
+                                    _column_values(diagnosis_database, '诊断名称')):
+            if not _is_missing(诊断名称):
+                self.diagnosis_code_by_name.setdefault(诊断名称, 诊断编码)
+
+        # 三个目录和组别规则的整体版本，作为入组结果等依赖全部目录的缓存键
+        digest = hashlib.sha256(self.dip_version.encode('utf-8'))
+        digest.update(catalog_hash(surgery_database).encode('utf-8'))
+        digest.update(catalog_hash(diagnosis_database).encode('utf-8'))
+        digest.update(repr(sorted(self.category_suffixes.items(), key=repr)).encode('utf-8'))
+        self.version = digest.hexdigest()
+
+        # 三个目录的编码编号字典，登记后冻结；索引在会话之间共享，病例入组时只在覆盖层中登记病例编码
+        self.code_dictionary = CodeDictionary()
+        for database in [dip_database, surgery_database, diagnosis_database]:
+            self.code_dictionary.register_catalog(database)
+        self.code_dictionary.freeze()
+
+        # 模糊匹配器在第一次需要时构建，不使用模糊匹配时不增加加载时间
+        self._fuzzy_matchers = None
+
+    def fuzzy_matchers(self):
+        """诊断和操作的模糊匹配器，第一次调用时构建"""
+        if self._fuzzy_matchers is None:
+            self._fuzzy_matchers = build_fuzzy_matchers(
+                self.dip_database, self.surgery_database, self.diagnosis_database)
+        return self._fuzzy_matchers
+
+    def find_diagnosis_candidates(self, diagnosis_input, limit=默认候选条数, min_score=0.0):
+        """按诊断名称模糊匹配，返回[(诊断编码, 诊断名称, 得分)]，按得分从高到低排序"""
+        if not diagnosis_input or diagnosis_input == "无":
+            return []
+        return self.fuzzy_matchers()['诊断'].match(diagnosis_input, limit, min_score)
+
+    def find_operation_candidates(self, operation_input, limit=默认候选条数, min_score=0.0):
+        """按操作名称模糊匹配，返回[(操作编码, 操作名称, 得分)]，按得分从高到低排序"""
+        if not operation_input or operation_input == "无":
+            return []
+        return self.fuzzy_matchers()['操作'].match(operation_input, limit, min_score)
+
+    def row(self, pos):
+        """按行号取出DIP目录记录"""
+        return self.dip_database.iloc[pos]
+
+    def find_diagnosis_code(self, diagnosis_input):
+        """在诊断目录中查找诊断编码"""
+        if not diagnosis_input or diagnosis_input == "无":
+            return None
+
+        # 诊断编码以字母开头且包含数字时，直接作为编码使用
+        if diagnosis_input[0].isalpha() and any(char.isdigit() for char in diagnosis_input):
+            return diagnosis_input
+
+        return self.diagnosis_code_by_name.get(diagnosis_input)
+
+    def diagnosis_positions(self, diagnosis_code):
+        """诊断编码（按normalize_diagnosis_key规范化后）在DIP目录中的全部行号，没有时返回None"""
+        return self.diagnosis_rows.get(normalize_diagnosis_key(diagnosis_code))
+
+    def find_matching_diagnosis(self, truncated_diagnosis_code):
+        """在DIP数据库中查找匹配的诊断记录"""
+        if not truncated_diagnosis_code:
+            return None
+
+        rows = self.diagnosis_positions(truncated_diagnosis_code)
+        if rows:
+            return self.row(rows[0])
+
+        return None
+
+    def find_matching_operation(self, diagnosis_code, operation_input):
+        """在DIP数据库中查找匹配的操作记录，先匹配操作编码，再匹配操作名称"""
+        if not operation_input or operation_input == "无":
+            return None
+
+        diagnosis_code = normalize_diagnosis_key(diagnosis_code)
+        pos = self.operation_code_rows.get((diagnosis_code, operation_input))
+        if pos is None:
+            pos = self.operation_name_rows.get((diagnosis_code, operation_input))
+        if pos is not None:
+            return self.row(pos)
+
+        return None
+
+    def find_operation_category(self, operation_input):
+        """在手术操作分类目录中查找操作类别，先匹配操作编码，再匹配操作名称"""
+        if not operation_input or operation_input == "无":
+            return None
+
+        if operation_input in self.operation_category_by_code:
+            return self.operation_category_by_code[operation_input]
+
+        return self.operation_category_by_name.get(operation_input)
+
+    def get_diagnosis_type(self, diagnosis_code):
+        """根据诊断编码获取病种类型"""
+        if not diagnosis_code or diagnosis_code == "无":
+            return None
+
+        rows = self.diagnosis_positions(diagnosis_code)
+        if rows:
+            return self.diagnosis_types[rows[0]]
+
+        return None
+
+    def get_comprehensive_dip_info(self, diagnosis_code, operation_category):
+        """根据诊断编码和操作类别获取综合病种的DIP信息"""
+        if not diagnosis_code or not operation_category:
+            return None
+
+        # 根据操作类别确定DIP组别
+        dip_suffix = self.category_suffixes.get(operation_category)
+        if dip_suffix is None:
+            return None
+
+        # 查预先编译的(诊断编码, 组别后缀)表
+        pos = self.comprehensive_rows.get((normalize_diagnosis_key(diagnosis_code), dip_suffix))
+        if pos is not None:
+            return self.row(pos)
+
+        return None
+
+    def get_diagnosis_only_dip_info(self, diagnosis_code):
+        """根据诊断编码获取无操作的DIP信息（用于基层病种和核心病种）"""
+        if not diagnosis_code or diagnosis_code == "无":
+            return None
+
+        pos = self.no_operation_rows.get(normalize_diagnosis_key(diagnosis_code))
+        if pos is not None:
+            return self.row(pos)
+
+        return None
+
+
+def _display_values(database, column):
+    """取出一列用于界面显示的值（空值显示为'无'），列不存在时全部为'无'"""
+    return [replace_nan_with_chinese(value) for value in _column_values(database, column)]
+
+
+def build_option_lists(dip_database):
+    """生成传统选择下拉框的选项（不含"手动输入"等固定选项）
+
+    返回字典：
+    - 诊断选项：先诊断后操作时的诊断列表，"诊断编码 - 诊断名称"
+    - 诊断操作选项：诊断编码 -> 该诊断下有操作的选项列表，带病种类型和分值
+    - 操作选项：先操作后诊断时的操作列表，"操作编码 - 操作名称"
+    - 操作诊断选项：操作编码 -> 含该操作的诊断选项列表，带病种类型和分值
+    - 无操作诊断选项：有无操作记录的诊断选项列表，带病种类型和分值
+    """
+    诊断列表 = dip_database[['诊断编码', '诊断名称']].drop_duplicates()
+    诊断选项 = [f"{诊断编码} - {诊断名称}"
+                for 诊断编码, 诊断名称 in zip(_display_values(诊断列表, '诊断编码'),
+                                            _display_values(诊断列表, '诊断名称'))
+                if 诊断编码 != "无"]  # 过滤掉无诊断编码的记录
+
+    # 只保留有操作编码的记录（去除操作编码为"无"的记录）
+    有操作 = dip_database[[not is_empty_value(value) for value in _column_values(dip_database, '操作编码')]]
+    操作明细列 = [col for col in ['诊断编码', '操作编码', '操作名称', '病种类型', '入组的DIP基准分值']
+                  if col in 有操作.columns]
+    操作明细 = 有操作[操作明细列].drop_duplicates()
+    诊断操作选项 = {}
+    for 诊断编码, 操作编码, 操作名称, 病种类型, 基准分值 in zip(
+            _display_values(操作明细, '诊断编码'), _display_values(操作明细, '操作编码'),
+            _display_values(操作明细, '操作名称'), _display_values(操作明细, '病种类型'),
+            _column_values(操作明细, '入组的DIP基准分值')):
+        # 在下拉选项中直接显示病种类型和基准分值
+        诊断操作选项.setdefault(str(诊断编码), []).append(
+            f"{操作编码} - {操作名称} | 病种类型: {病种类型} | 分值: {基准分值:.4f}")
+
+    # 先操作后诊断：操作编码 -> 诊断选项，以及"无操作的"诊断选项
+    操作诊断选项 = {}
+    无操作诊断选项 = []
+    诊断明细列 = [col for col in ['操作编码', '诊断编码', '诊断名称', '病种类型', '入组的DIP基准分值']
+                  if col in dip_database.columns]
+    诊断明细 = dip_database[诊断明细列].drop_duplicates()
+    for 原始操作编码, 诊断编码, 诊断名称, 病种类型, 基准分值 in zip(
+            _column_values(诊断明细, '操作编码'), _display_values(诊断明细, '诊断编码'),
+            _display_values(诊断明细, '诊断名称'), _display_values(诊断明细, '病种类型'),
+            _column_values(诊断明细, '入组的DIP基准分值')):
+        # 在下拉选项中直接显示病种类型和基准分值
+        display_text = f"{诊断编码} - {诊断名称} | 病种类型: {病种类型} | 分值: {基准分值:.4f}"
+        if is_empty_value(原始操作编码):
+            无操作诊断选项.append(display_text)
+        else:
+            操作诊断选项.setdefault(str(原始操作编码), []).append(display_text)
+    # 不同操作编码下同一诊断只显示一次
+    无操作诊断选项 = list(dict.fromkeys(无操作诊断选项))
+
+    操作列表 = dip_database[['操作编码', '操作名称']].drop_duplicates()
+    操作选项 = [f"{操作编码} - {操作名称}"
+                for 操作编码, 操作名称 in zip(_display_values(操作列表, '操作编码'),
+                                            _display_values(操作列表, '操作名称'))
+                if 操作编码 != "无"]  # 过滤掉无操作编码的记录
+
+    return {
+        '诊断选项': 诊断选项,
+        '诊断操作选项': 诊断操作选项,
+        '操作选项': 操作选项,
+        '操作诊断选项': 操作诊断选项,
+        '无操作诊断选项': 无操作诊断选项
+    }
+
+
+# 下拉框选项按DIP目录内容哈希缓存，所有会话共享，滑块等控件变化时不再重建
+option_lists_cache = LRUCache(最大选项缓存条目数)
+
+
+def get_option_lists(index):
+    """获取目录索引对应的下拉框选项，同一版本目录只生成一次"""
+    return option_lists_cache.get_or_create(index.dip_version, lambda: build_option_lists(index.dip_database))
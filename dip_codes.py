@@ -0,0 +1,114 @@
+# dip_codes.py - 诊断/操作/DIP编码的整数编号字典
+import sys
+
+import numpy as np
+import pandas as pd
+
+# 目录中登记到编码字典的编码列
+编码列 = ['诊断编码', '操作编码', 'DIP编码']
+
+# 空值的编号
+缺失编号 = -1
+
+
+class CodeDictionary:
+    """编码 <-> int32编号的字典
+
+    目录加载时登记目录中的全部编码后冻结，随目录索引在所有会话之间共享，之后不再修改。
+    病例入组时在目录字典上创建覆盖层（overlay），病例中目录没有的编码只登记在覆盖层中、编号接在目录编码之后，
+    用完即丢弃；同一编码在目录和病例中编号相同，连接和分组聚合在int32编号数组上进行，不再反复对字符串求哈希。
+    编号只在当前进程内有效。
+    """
+
+    def __init__(self, base=None):
+        # base为冻结的目录字典，本字典只登记base中没有的编码
+        self.base = base
+        self.codes = []
+        self._ids = {}
+        self.frozen = False
+
+    def __len__(self):
+        return (len(self.base) if self.base is not None else 0) + len(self.codes)
+
+    def freeze(self):
+        """冻结字典，之后不能再登记新编码，返回字典本身"""
+        self.frozen = True
+        return self
+
+    def overlay(self):
+        """在冻结的字典上创建覆盖层，新编码只登记在覆盖层中"""
+        if not self.frozen:
+            raise ValueError("只能在冻结的编码字典上创建覆盖层")
+        return CodeDictionary(self)
+
+    def _find(self, code):
+        """查找编码的编号，没有时返回None"""
+        code_id = self.base._find(code) if self.base is not None else None
+        if code_id is None:
+            code_id = self._ids.get(code)
+        return code_id
+
+    def encode(self, values):
+        """将一列编码转换为int32编号数组，新编码登记到字典中，空值编号为-1"""
+        positions, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+        ids = np.empty(len(uniques), dtype=np.int32)
+        for i, code in enumerate(uniques):
+            if code is None or code is pd.NA or code != code:
+                ids[i] = 缺失编号
+                continue
+            code_id = self._find(code)
+            if code_id is None:
+                if self.frozen:
+                    raise ValueError(f"编码字典已冻结，不能登记新编码: {code}")
+                code_id = len(self)
+                self._ids[code] = code_id
+                self.codes.append(code)
+            ids[i] = code_id
+        return ids.take(positions)
+
+    def all_codes(self):
+        """按编号顺序排列的全部编码（包括base中的编码）"""
+        return (self.base.all_codes() if self.base is not None else []) + self.codes
+
+    def decode(self, ids):
+        """将编号数组还原为编码（object数组），-1还原为None"""
+        ids = np.asarray(ids)
+        all_codes = self.all_codes()
+        codes = np.empty(len(all_codes) + 1, dtype=object)
+        codes[:-1] = all_codes
+        codes[-1] = None
+        return codes[np.where(ids < 0, len(all_codes), ids)]
+
+    def register_catalog(self, catalog):
+        """登记目录中全部编码列的编码"""
+        for col in 编码列:
+            if col in catalog.columns:
+                self.encode(catalog[col])
+
+    def nbytes(self):
+        """字典本身（不含base）占用的内存（编码字符串和索引），字节"""
+        return (sum(sys.getsizeof(code) for code in self.codes) +
+                sys.getsizeof(self.codes) + sys.getsizeof(self._ids))
+
+    def memory_report(self, frame, columns=None):
+        """对比编码列按object字符串存储与按int32编号存储的内存占用
+
+        返回字典：每列的 object字节数/int32字节数，以及合计、字典自身字节数和节省的字节数。
+        字典在所有使用同一目录的会话和病例之间共享，只计算一次。
+        """
+        columns = [col for col in (columns or 编码列) if col in frame.columns]
+        report = {'列': {}}
+        object_total = 0
+        int32_total = 0
+        for col in columns:
+            # categorical列也按object字符串布局计算
+            object_bytes = int(frame[col].astype(object).memory_usage(deep=True, index=False))
+            int32_bytes = len(frame) * np.dtype(np.int32).itemsize
+            report['列'][col] = {'object字节数': object_bytes, 'int32字节数': int32_bytes}
+            object_total += object_bytes
+            int32_total += int32_bytes
+        report['object字节数'] = object_total
+        report['int32字节数'] = int32_total
+        report['字典字节数'] = self.nbytes()
+        report['节省字节数'] = object_total - int32_total - report['字典字节数']
+        return report
@@ -0,0 +1,149 @@
+# dip_diff.py - 两个DIP目录版本之间的差异对比
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from dip_cache import LRUCache
+from dip_catalog import 默认操作类别组别
+from dip_io import load_catalog_file, load_category_suffixes, write_result_file
+
+# 目录中的组合键：综合病种的手术组、治疗组、诊断组诊断编码相同、操作编码都为"无"，按DIP名称中的组别后缀区分
+差异键列 = ['诊断编码', '操作编码', '组别']
+
+# 重复组合键报错时最多列出的组合数
+最多列出重复键数 = 5
+
+# 差异结果中从目录带出的描述列
+差异描述列 = ['DIP编码', 'DIP名称', '病种类型']
+
+# 基准分值保留4位小数，变化小于该值视为未变化
+分值容差 = 5e-5
+
+# 变化类型
+变化类型列表 = ['新增', '删除', '分值调整', '未变化']
+
+# 差异对比缓存最多保留的版本组合数
+最大差异缓存条目数 = 8
+
+
+def dip_group_labels(dip_names, category_suffixes=None):
+    """DIP名称中包含的组别后缀（与入组时按组别后缀查找综合病种记录一致），不含组别后缀时为空字符串"""
+    suffixes = list(dict.fromkeys((category_suffixes if category_suffixes is not None else 默认操作类别组别).values()))
+    return [next((suffix for suffix in suffixes if suffix in name), "") if isinstance(name, str) else ""
+            for name in dip_names]
+
+
+def _group_table(catalog, category_suffixes=None):
+    """取出目录的组合键、描述列和基准分值；同一组合键有多条记录时无法确定对应关系，抛出ValueError"""
+    columns = ['诊断编码', '操作编码'] + [col for col in 差异描述列 if col in catalog.columns] + ['入组的DIP基准分值']
+    table = catalog[columns].copy()
+    # categorical列转为普通列，两个版本的类别不同也能直接连接
+    for col in columns:
+        if isinstance(table[col].dtype, pd.CategoricalDtype):
+            table[col] = table[col].astype(object)
+    dip_names = catalog['DIP名称'].tolist() if 'DIP名称' in catalog.columns else [None] * len(catalog)
+    table['组别'] = dip_group_labels(dip_names, category_suffixes)
+
+    重复 = table[table.duplicated(subset=差异键列, keep=False)].drop_duplicates(subset=差异键列)
+    if len(重复):
+        示例 = "；".join(f"{row['诊断编码']}/{row['操作编码']}/{row['组别'] or '无组别'}"
+                       for _, row in 重复.head(最多列出重复键数).iterrows())
+        raise ValueError(f"目录中有{len(重复)}个重复的(诊断编码, 操作编码, 组别)组合，无法对比: {示例}")
+    table['入组的DIP基准分值'] = pd.to_numeric(table['入组的DIP基准分值'], errors='coerce')
+    return table
+
+
+def diff_catalogs(old_catalog, new_catalog, category_suffixes=None):
+    """按(诊断编码, 操作编码, 组别)对两个DIP目录做哈希连接，返回每个组合的变化
+
+    组别为DIP名称中的组别后缀（category_suffixes的取值，默认使用默认操作类别组别），区分综合病种的各组。
+    返回列：诊断编码、操作编码、组别、DIP编码、DIP名称、病种类型（新目录优先）、原基准分值、新基准分值、
+    分值变化、变化比例、变化类型（新增/删除/分值调整/未变化）。
+    """
+    old = _group_table(old_catalog, category_suffixes)
+    new = _group_table(new_catalog, category_suffixes)
+    merged = old.merge(new, on=差异键列, how='outer', suffixes=('_原', '_新'), indicator=True)
+
+    result = merged[差异键列].copy()
+    for col in 差异描述列:
+        新列, 原列 = f'{col}_新', f'{col}_原'
+        if 新列 in merged.columns and 原列 in merged.columns:
+            result[col] = merged[新列].where(merged[新列].notna(), merged[原列])
+        elif 新列 in merged.columns or 原列 in merged.columns:
+            result[col] = merged[新列 if 新列 in merged.columns else 原列]
+        else:
+            result[col] = "无"
+
+    原分值 = merged['入组的DIP基准分值_原'].to_numpy(dtype=np.float64)
+    新分值 = merged['入组的DIP基准分值_新'].to_numpy(dtype=np.float64)
+    result['原基准分值'] = 原分值
+    result['新基准分值'] = 新分值
+    result['分值变化'] = 新分值 - 原分值
+    变化比例 = np.full(len(merged), np.nan)
+    np.divide(新分值 - 原分值, 原分值, out=变化比例, where=(原分值 != 0) & ~np.isnan(原分值))
+    result['变化比例'] = 变化比例
+
+    来源 = merged['_merge'].to_numpy()
+    分值不同 = ~np.isclose(新分值, 原分值, rtol=0.0, atol=分值容差, equal_nan=True)
+    result['变化类型'] = np.select(
+        [来源 == 'right_only', 来源 == 'left_only', 分值不同],
+        ['新增', '删除', '分值调整'],
+        default='未变化'
+    )
+    return result
+
+
+def summarize_catalog_diff(diff):
+    """按病种类型汇总差异：各变化类型的组合数，以及分值调整组合的分值变化合计和平均变化比例"""
+    counts = pd.crosstab(diff['病种类型'], diff['变化类型']).reindex(columns=变化类型列表, fill_value=0)
+    调整 = diff[diff['变化类型'] == '分值调整']
+    summary = counts.join(调整.groupby('病种类型').agg(分值变化合计=('分值变化', 'sum'),
+                                                     平均变化比例=('变化比例', 'mean')))
+    summary['分值变化合计'] = summary['分值变化合计'].fillna(0.0)
+    合计 = pd.DataFrame([{**{col: int(counts[col].sum()) for col in 变化类型列表},
+                        '分值变化合计': 调整['分值变化'].sum(), '平均变化比例': 调整['变化比例'].mean()}],
+                      index=['合计'])
+    summary = pd.concat([summary, 合计])
+    summary.index.name = '病种类型'
+    return summary.reset_index()
+
+
+# 差异对比按两个目录版本缓存，所有会话共享
+catalog_diff_cache = LRUCache(最大差异缓存条目数)
+
+
+def get_catalog_diff(old_version, new_version, old_catalog, new_catalog, category_suffixes=None):
+    """获取两个目录版本之间的差异，同一对版本和组别规则只计算一次，返回(差异明细, 病种类型汇总)"""
+    def create():
+        diff = diff_catalogs(old_catalog, new_catalog, category_suffixes)
+        return diff, summarize_catalog_diff(diff)
+    规则键 = None if category_suffixes is None else tuple(sorted(category_suffixes.items(), key=repr))
+    return catalog_diff_cache.get_or_create((old_version, new_version, 规则键), create)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比两个DIP病种及分值目录版本，输出新增、删除和分值调整的病种组合")
+    parser.add_argument('old', help="原目录（.xlsx/.csv/.npz）")
+    parser.add_argument('new', help="新目录（.xlsx/.csv/.npz）")
+    parser.add_argument('-o', '--output', help="差异明细文件（.csv或Excel），只包含有变化的组合")
+    parser.add_argument('--rules', help="入组规则文件（JSON），配置综合病种操作类别对应的DIP组别后缀")
+    args = parser.parse_args(argv)
+
+    try:
+        category_suffixes = load_category_suffixes(args.rules) if args.rules else None
+        diff = diff_catalogs(load_catalog_file(args.old, 'dip_database'), load_catalog_file(args.new, 'dip_database'),
+                             category_suffixes)
+        if args.output:
+            write_result_file(diff[diff['变化类型'] != '未变化'], args.output)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    print(summarize_catalog_diff(diff).to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# dip_fuzzy.py - 诊断/操作名称模糊匹配
+import re
+import unicodedata
+
+import numpy as np
+
+# 手动输入模糊匹配的默认最低得分（0~1），低于该得分的候选不用于入组
+默认匹配阈值 = 0.6
+
+# 界面上显示的候选条数
+默认候选条数 = 5
+
+# 名称中被忽略的字符：标点、括号、空白等
+_忽略字符 = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    """名称规范化：全角转半角、字母转大写、去除标点括号和空白"""
+    return _忽略字符.sub('', unicodedata.normalize('NFKC', str(text)).upper())
+
+
+def text_grams(text):
+    """规范化文本的两字组合集合，单字文本返回该字本身"""
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FuzzyMatcher:
+    """基于两字组合倒排索引的名称模糊匹配
+
+    得分为查询与候选名称两字组合集合的Dice系数（2|A∩B| / (|A|+|B|)），
+    例如"特发性(原发性)高血压"与"特发性高血压"的得分为0.83。查询时只累加倒排表中
+    命中的条目，不与整个目录逐条比较，批量入组时可以对每个病例调用。
+    """
+
+    def __init__(self, codes, names):
+        self.codes = []
+        self.names = []
+        # 原始编码/名称 -> 条目编号，用于判断输入是否已能精确匹配
+        self._exact = {}
+        seen = set()
+        for code, name in zip(codes, names):
+            if code is None or code != code or name is None or name != name:
+                continue
+            code, name = str(code).strip(), str(name).strip()
+            if not code or code == "无" or (code, name) in seen:
+                continue
+            seen.add((code, name))
+            self._exact.setdefault(code, len(self.codes))
+            self._exact.setdefault(name, len(self.codes))
+            self.codes.append(code)
+            self.names.append(name)
+
+        postings = {}
+        gram_counts = []
+        for i, name in enumerate(self.names):
+            grams = text_grams(normalize_text(name))
+            gram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self._gram_counts = np.array(gram_counts, dtype=np.int32)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    @classmethod
+    def from_catalogs(cls, sources):
+        """由多个(目录, 编码列, 名称列)构建，缺少列的目录跳过"""
+        codes, names = [], []
+        for catalog, code_col, name_col in sources:
+            if code_col in catalog.columns and name_col in catalog.columns:
+                codes.extend(catalog[code_col].tolist())
+                names.extend(catalog[name_col].tolist())
+        return cls(codes, names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def exact(self, text):
+        """输入与某条目的编码或名称完全一致时返回该条目的编码，否则返回None"""
+        i = self._exact.get(str(text).strip())
+        return None if i is None else self.codes[i]
+
+    def match(self, text, limit=默认候选条数, min_score=0.0):
+        """返回得分最高的候选列表[(编码, 名称, 得分)]，按得分从高到低排序"""
+        grams = text_grams(normalize_text(text))
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not hits or limit <= 0:
+            return []
+
+        # 每个条目命中的两字组合数
+        counts = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        candidates = np.flatnonzero(counts)
+        scores = 2.0 * counts[candidates] / (len(grams) + self._gram_counts[candidates])
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        # 得分相同时名称更短、在目录中更靠前的排在前面
+        order = np.lexsort((candidates, self._gram_counts[candidates], -scores))
+        return [(self.codes[i], self.names[i], float(scores[j]))
+                for j, i in zip(order.tolist(), candidates[order].tolist())]
+
+    def best_match(self, text, min_score=默认匹配阈值):
+        """返回得分不低于min_score的最佳候选(编码, 名称, 得分)，没有时返回None"""
+        candidates = self.match(text, 1, min_score)
+        return candidates[0] if candidates else None
+
+
+def build_fuzzy_matchers(dip_database, surgery_database, diagnosis_database):
+    """由三个目录构建诊断和操作的模糊匹配器"""
+    return {
+        '诊断': FuzzyMatcher.from_catalogs([(diagnosis_database, '诊断编码', '诊断名称'),
+                                          (dip_database, '诊断编码', '诊断名称')]),
+        '操作': FuzzyMatcher.from_catalogs([(surgery_database, '操作编码', '操作名称'),
+                                          (dip_database, '操作编码', '操作名称')])
+    }
@@ -0,0 +1,383 @@
+# dip_grouping.py - DIP入组逻辑（不依赖Streamlit，界面和命令行共用）
+import numpy as np
+import pandas as pd
+
+from dip_cache import LRUCache
+from dip_catalog import is_empty_value, replace_nan_with_chinese
+
+# 下拉框中的特殊选项
+手动输入诊断 = "手动输入诊断..."
+手动输入操作 = "手动输入操作..."
+无操作选项 = "无操作的"
+
+# 未能入组时界面上使用的默认基准分值
+默认DIP基准分值 = 27.7173
+
+# 单病例入组结果缓存最多保留的条目数
+最大分组缓存条目数 = 1024
+
+# 入组结果中的分组列（批量入组时追加到病例表）
+分组列 = ['入组诊断编码', '入组操作编码', 'DIP编码', 'DIP名称', '病种类型',
+          '入组的DIP基准分值', '入组情况_诊断', '入组情况_操作', '可入组']
+
+
+def truncate_diagnosis_code(diagnosis_code):
+    """处理诊断编码，截取到小数点后第一位"""
+    if not diagnosis_code or diagnosis_code == "无":
+        return ""
+
+    # 如果编码中包含小数点
+    if '.' in diagnosis_code:
+        parts = diagnosis_code.split('.')
+        if len(parts) >= 2:
+            # 截取小数点后第一位
+            decimal_part = parts[1][:1] if len(parts[1]) > 0 else ""
+            return f"{parts[0]}.{decimal_part}"
+
+    # 如果没有小数点，返回原编码
+    return diagnosis_code
+
+
+def _map_unique(values, func):
+    """对每个不同取值只调用一次func，再按原顺序展开，返回与values索引一致的Series"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    results = pd.Series([func(value) for value in uniques], dtype=object)
+    return pd.Series(results.to_numpy().take(codes), index=values.index)
+
+
+def normalize_diagnosis_codes(codes, truncate=True):
+    """整列规范化诊断编码，返回与codes索引一致的Series
+
+    全角转半角、去除首尾空白、字母转大写，国家临床版扩展编码中的"x"（首字母之后）统一为小写，
+    truncate为True时与truncate_diagnosis_code一致截取到小数点后第一位（如K35.800x001 -> K35.8）。
+    先对不同取值去重再用向量化字符串操作处理，耗时与不同编码数成正比而不是与行数成正比。
+    空值和"无"返回空字符串；不以"字母+数字"开头的取值（如诊断名称）只去除首尾空白。
+    目录索引的诊断编码键按相同规则（dip_catalog.normalize_diagnosis_key）规范化，目录中写作I10.X的编码同样能匹配。
+    """
+    if not isinstance(codes, pd.Series):
+        codes = pd.Series(codes)
+    positions, uniques = pd.factorize(codes, use_na_sentinel=False)
+    values = pd.Series(uniques, dtype=object)
+
+    empty = values.map(is_empty_value).to_numpy(dtype=bool)
+    text = values.where(~empty, "").astype(str).str.normalize('NFKC').str.strip()
+    upper = text.str.upper()
+    is_code = upper.str.match(r'[A-Z]\d').to_numpy(dtype=bool)
+    normalized = upper.str[:1] + upper.str[1:].str.replace('X', 'x', regex=False)
+    if truncate:
+        # 第一个小数点之前的部分 + 小数点 + 小数点后第一位
+        parts = normalized.str.extract(r'^([^.]*)\.([^.]?)')
+        has_dot = parts[0].notna().to_numpy()
+        normalized = normalized.where(~has_dot, parts[0] + '.' + parts[1])
+
+    result = text.where(~is_code, normalized).where(~empty, "")
+    return pd.Series(result.to_numpy(dtype=object).take(positions), index=codes.index)
+
+
+def resolve_diagnosis(index, selected_diagnosis, custom_diagnosis_input, fuzzy_threshold=None):
+    """处理诊断信息，返回(诊断编码, 诊断名称, 入组情况_诊断)
+
+    fuzzy_threshold不为None时，诊断名称在目录中找不到完全一致的记录则按模糊匹配得分最高的候选取编码。
+    """
+    if selected_diagnosis == 手动输入诊断 and custom_diagnosis_input:
+        # 手动输入诊断模式
+        诊断输入 = custom_diagnosis_input.strip()
+
+        # 在诊断目录中查找诊断编码
+        诊断编码_原始 = index.find_diagnosis_code(诊断输入)
+
+        # 名称不完全一致时尝试模糊匹配
+        匹配说明 = ""
+        if not 诊断编码_原始 and fuzzy_threshold is not None:
+            候选 = index.fuzzy_matchers()['诊断'].best_match(诊断输入, fuzzy_threshold)
+            if 候选 is not None:
+                诊断编码_原始 = 候选[0]
+                匹配说明 = f" -> 模糊匹配: {候选[1]}（得分{候选[2]:.2f}）"
+
+        if 诊断编码_原始:
+            # 截取诊断编码到小数点后第一位
+            诊断编码 = truncate_diagnosis_code(诊断编码_原始)
+            return 诊断编码, 诊断输入, f"手动输入诊断: {诊断输入}{匹配说明} -> 编码: {诊断编码_原始} -> 截断后: {诊断编码}"
+
+        # 如果没有找到诊断编码，尝试将输入作为编码处理
+        诊断编码 = truncate_diagnosis_code(诊断输入)
+        return 诊断编码, 诊断输入, f"手动输入诊断: {诊断输入} -> 直接作为编码处理 -> 截断后: {诊断编码}"
+
+    if selected_diagnosis and selected_diagnosis != 手动输入诊断:
+        # 正常选择诊断模式
+        诊断编码 = selected_diagnosis.split(" - ")[0] if " - " in selected_diagnosis else selected_diagnosis
+        诊断名称 = selected_diagnosis.split(" - ")[1] if " - " in selected_diagnosis else selected_diagnosis
+        if 诊断编码 == "无":
+            诊断编码 = ""
+        return 诊断编码, 诊断名称, "正常选择诊断"
+
+    return "", "无", "未选择诊断"
+
+
+def _group_without_operation(index, 诊断编码):
+    """基层病种或核心病种无操作入组，返回(匹配记录, 入组情况_操作)"""
+    诊断病种类型 = index.get_diagnosis_type(诊断编码)
+
+    if 诊断病种类型 not in ["基层病种", "核心病种"]:
+        # 综合病种不能无操作
+        return None, "无法入组：综合病种必须有操作"
+
+    # 情况3：基层病种或核心病种，操作为空
+    无操作记录 = index.get_diagnosis_only_dip_info(诊断编码)
+    if 无操作记录 is not None:
+        return 无操作记录, f"情况3：{诊断病种类型}，无操作直接入组"
+
+    return None, f"无法入组：未找到{诊断病种类型}的无操作记录"
+
+
+def _group_manual_operation(index, 诊断编码, 操作输入):
+    """手动输入操作的入组流程，返回(操作编码, 操作名称, 匹配记录, 入组情况_操作)"""
+    # 获取诊断的病种类型
+    诊断病种类型 = index.get_diagnosis_type(诊断编码)
+
+    # 情况1：在DIP目录库中查找匹配的操作
+    匹配记录 = index.find_matching_operation(诊断编码, 操作输入)
+    if 匹配记录 is not None:
+        return 匹配记录['操作编码'], 匹配记录['操作名称'], 匹配记录, "情况1：在DIP目录库中直接匹配入组"
+
+    if 诊断病种类型 == "综合病种":
+        # 情况2：诊断是综合病种，查找操作类别
+        操作类别 = index.find_operation_category(操作输入)
+        if not 操作类别:
+            return 操作输入, 操作输入, None, "无法入组：未找到操作类别"
+
+        # 根据操作类别获取综合病种的DIP信息
+        综合病种记录 = index.get_comprehensive_dip_info(诊断编码, 操作类别)
+        if 综合病种记录 is not None:
+            return 操作输入, 操作输入, 综合病种记录, f"情况2：综合病种匹配，操作类别为{操作类别}"
+        return 操作输入, 操作输入, None, "无法入组：未找到匹配的综合病种记录"
+
+    if 诊断病种类型 in ["基层病种", "核心病种"] and (not 操作输入 or 操作输入 == "无"):
+        # 情况3：基层病种或核心病种，操作为空
+        无操作记录 = index.get_diagnosis_only_dip_info(诊断编码)
+        if 无操作记录 is not None:
+            return "无", "无", 无操作记录, f"情况3：{诊断病种类型}，无操作直接入组"
+        return "无", "无", None, f"无法入组：未找到{诊断病种类型}的无操作记录"
+
+    # 其他情况：无法入组
+    return 操作输入, 操作输入, None, "无法入组：不满足入组条件"
+
+
+def _fuzzy_operation_input(index, 操作输入, fuzzy_threshold):
+    """操作输入在目录中没有完全一致的编码或名称时，换成模糊匹配得分最高的操作编码，返回(操作输入, 匹配说明)"""
+    matcher = index.fuzzy_matchers()['操作']
+    if not 操作输入 or 操作输入 == "无" or matcher.exact(操作输入) is not None:
+        return 操作输入, ""
+
+    候选 = matcher.best_match(操作输入, fuzzy_threshold)
+    if 候选 is None:
+        return 操作输入, ""
+    return 候选[0], f"模糊匹配操作: {操作输入} -> {候选[0]} {候选[1]}（得分{候选[2]:.2f}）；"
+
+
+def resolve_operation(index, 诊断编码, selected_operation, custom_operation_input, fuzzy_threshold=None):
+    """处理操作信息，返回(操作编码, 操作名称, 匹配记录, 入组情况_操作)
+
+    fuzzy_threshold不为None时，手动输入的操作在目录中找不到完全一致的编码或名称则按模糊匹配的候选入组。
+    """
+    if selected_operation == 手动输入操作:
+        # 手动输入操作模式
+        if custom_operation_input:
+            # 用户输入的内容作为操作编码或操作名称
+            操作输入 = custom_operation_input.strip()
+            匹配说明 = ""
+            if fuzzy_threshold is not None:
+                操作输入, 匹配说明 = _fuzzy_operation_input(index, 操作输入, fuzzy_threshold)
+            操作编码, 操作名称, 匹配记录, 入组情况_操作 = _group_manual_operation(index, 诊断编码, 操作输入)
+            return 操作编码, 操作名称, 匹配记录, 匹配说明 + 入组情况_操作
+        return "无", "无", None, "未输入操作"
+
+    if selected_operation == 无操作选项:
+        # 用户选择了"无操作的"选项
+        匹配记录, 入组情况_操作 = _group_without_operation(index, 诊断编码)
+        return "无", "无", 匹配记录, 入组情况_操作
+
+    if selected_operation:
+        # 正常选择操作模式，在DIP目录库中查找匹配记录
+        操作编码 = selected_operation.split(" - ")[0] if " - " in selected_operation else selected_operation
+        操作名称 = selected_operation.split(" - ")[1] if " - " in selected_operation else "无"
+        匹配记录 = index.find_matching_operation(诊断编码, 操作编码)
+        return 操作编码, 操作名称, 匹配记录, "正常选择：在DIP目录库中匹配"
+
+    return "无", "无", None, "未选择操作"
+
+
+def group_case(index, selected_diagnosis, custom_diagnosis_input, selected_operation, custom_operation_input,
+               fuzzy_threshold=None):
+    """按 情况1直接匹配 -> 情况2综合病种 -> 情况3无操作 -> 诊断兜底 的顺序对单个病例入组
+
+    参数与界面上的选择一致：selected_*为下拉框选项，custom_*为手动输入内容。
+    fuzzy_threshold为手动输入模糊匹配的最低得分，None表示只做精确匹配。
+    返回包含诊断、操作、DIP信息、入组情况和可入组标记的字典。
+    """
+    诊断编码, 诊断名称, 入组情况_诊断 = resolve_diagnosis(
+        index, selected_diagnosis, custom_diagnosis_input, fuzzy_threshold)
+    操作编码, 操作名称, 匹配记录, 入组情况_操作 = resolve_operation(
+        index, 诊断编码, selected_operation, custom_operation_input, fuzzy_threshold)
+
+    if 操作编码 == "无":
+        操作编码 = ""
+
+    # 如果没有匹配记录，尝试在DIP数据库中查找匹配的诊断记录
+    if 匹配记录 is None and 诊断编码:
+        匹配记录 = index.find_matching_diagnosis(诊断编码)
+        if 匹配记录 is not None:
+            入组情况_诊断 = f"手动输入诊断匹配成功: {诊断编码}"
+
+    if 匹配记录 is not None:
+        # 找到匹配记录
+        return {
+            '诊断编码': 诊断编码,
+            '诊断名称': replace_nan_with_chinese(匹配记录['诊断名称']),
+            '操作编码': 操作编码 if 操作编码 else replace_nan_with_chinese(匹配记录.get('操作编码', '无')),
+            '操作名称': replace_nan_with_chinese(匹配记录['操作名称']) if '操作名称' in 匹配记录 else 操作名称,
+            '入组的DIP基准分值': 匹配记录['入组的DIP基准分值'],
+            'DIP编码': replace_nan_with_chinese(匹配记录.get('DIP编码', '无')),
+            'DIP名称': replace_nan_with_chinese(匹配记录.get('DIP名称', '无')),
+            '病种类型': replace_nan_with_chinese(匹配记录.get('病种类型', '无')),
+            '入组情况_诊断': 入组情况_诊断,
+            '入组情况_操作': 入组情况_操作,
+            '可入组': True,
+            '匹配记录': 匹配记录
+        }
+
+    # 未找到匹配记录
+    return {
+        '诊断编码': 诊断编码,
+        '诊断名称': 诊断名称,
+        '操作编码': 操作编码,
+        '操作名称': 操作名称,
+        '入组的DIP基准分值': 默认DIP基准分值,
+        'DIP编码': "无",
+        'DIP名称': "无法入组",
+        '病种类型': "无法入组",
+        '入组情况_诊断': 入组情况_诊断,
+        '入组情况_操作': 入组情况_操作,
+        '可入组': False,
+        '匹配记录': None
+    }
+
+
+# 单病例入组结果缓存，所有会话共享；键中包含目录整体版本，目录或规则变化后自然失效
+grouping_cache = LRUCache(最大分组缓存条目数)
+
+
+def group_case_cached(index, 查询顺序, selected_diagnosis, custom_diagnosis_input, selected_operation,
+                      custom_operation_input, fuzzy_threshold=None):
+    """带缓存的group_case，键为(目录版本, 查询顺序, 诊断输入, 操作输入, 模糊匹配阈值)
+
+    只调整费用滑块等引起的重新运行、以及不同用户的相同查询直接返回缓存的入组结果。
+    返回的字典（包括匹配记录）被多个会话共享，调用方不能修改。
+    """
+    # 未选择手动输入时手动输入框的内容不影响入组，不放入缓存键
+    if selected_diagnosis != 手动输入诊断:
+        custom_diagnosis_input = None
+    if selected_operation != 手动输入操作:
+        custom_operation_input = None
+    key = (index.version, 查询顺序, selected_diagnosis, custom_diagnosis_input,
+           selected_operation, custom_operation_input, fuzzy_threshold)
+    return grouping_cache.get_or_create(key, lambda: group_case(
+        index, selected_diagnosis, custom_diagnosis_input, selected_operation, custom_operation_input,
+        fuzzy_threshold))
+
+
+def _case_input_column(cases, candidates):
+    """取病例表中第一个存在的输入列（编码优先于名称）"""
+    for col in candidates:
+        if col in cases.columns:
+            return cases[col]
+    raise ValueError(f"病例数据缺少必要列: {' 或 '.join(candidates)}")
+
+
+def _text_or_empty(value):
+    """把病例中的编码或名称转换为字符串，空值返回空字符串"""
+    if is_empty_value(value):
+        return ""
+    return str(value).strip()
+
+
+def group_case_inputs(index, 诊断输入, 操作输入, fuzzy_threshold=None):
+    """按手动输入的诊断和操作对单个病例入组，操作为空时按"无操作的"入组"""
+    if 操作输入:
+        return group_case(index, 手动输入诊断, 诊断输入, 手动输入操作, 操作输入, fuzzy_threshold)
+    return group_case(index, 手动输入诊断, 诊断输入, 无操作选项, "", fuzzy_threshold)
+
+
+def case_group_inputs(cases):
+    """取出病例表中用于入组的诊断和操作输入，返回两个与cases索引一致的Series
+
+    病例表需要包含诊断编码（或诊断名称），操作编码（或操作名称）可选；诊断编码整列规范化并截断，
+    同一诊断亚目下的不同编码合并为一个输入，没有操作列时操作输入为空字符串。
+    """
+    诊断列 = _case_input_column(cases, ['诊断编码', '诊断名称'])
+    if 诊断列.name == '诊断编码':
+        诊断输入 = normalize_diagnosis_codes(诊断列)
+    else:
+        诊断输入 = _map_unique(诊断列, _text_or_empty)
+    if '操作编码' in cases.columns or '操作名称' in cases.columns:
+        操作输入 = _map_unique(_case_input_column(cases, ['操作编码', '操作名称']), _text_or_empty)
+    else:
+        操作输入 = pd.Series("", index=cases.index)
+    return 诊断输入, 操作输入
+
+
+def unique_case_inputs(code_dictionary, 诊断输入, 操作输入):
+    """对(诊断, 操作)组合去重，返回(诊断列表, 操作列表, 每行对应的组合序号)
+
+    诊断、操作转换为code_dictionary中的编号，拼成64位整数键后去重。
+    """
+    诊断编号 = code_dictionary.encode(诊断输入).astype(np.int64)
+    操作编号 = code_dictionary.encode(操作输入).astype(np.int64)
+    unique_keys, codes = np.unique((诊断编号 << 32) | 操作编号, return_inverse=True)
+    诊断列表 = code_dictionary.decode((unique_keys >> 32).astype(np.int32))
+    操作列表 = code_dictionary.decode((unique_keys & 0xFFFFFFFF).astype(np.int32))
+    return 诊断列表, 操作列表, codes
+
+
+def group_unique_inputs(index, 诊断列表, 操作列表, fuzzy_threshold=None):
+    """对去重后的(诊断, 操作)组合逐个入组，返回每个组合一行的分组结果DataFrame"""
+    rows = []
+    for 诊断, 操作 in zip(诊断列表, 操作列表):
+        result = group_case_inputs(index, 诊断, 操作, fuzzy_threshold)
+        rows.append((
+            result['诊断编码'],
+            result['操作编码'],
+            result['DIP编码'],
+            result['DIP名称'],
+            result['病种类型'],
+            result['入组的DIP基准分值'] if result['可入组'] else float('nan'),
+            result['入组情况_诊断'],
+            result['入组情况_操作'],
+            result['可入组']
+        ))
+    return pd.DataFrame(rows, columns=分组列)
+
+
+def expand_unique_results(unique_results, codes, case_index):
+    """按每行对应的组合序号展开去重后的分组结果，返回行索引为case_index的DataFrame"""
+    grouped = unique_results.take(codes)
+    grouped.index = case_index
+    grouped['入组的DIP基准分值'] = grouped['入组的DIP基准分值'].astype(float)
+    grouped['可入组'] = grouped['可入组'].astype(bool)
+    return grouped
+
+
+def group_cases(index, cases, fuzzy_threshold=None):
+    """对病例表批量入组，返回与cases行索引一致的分组结果DataFrame
+
+    病例表需要包含诊断编码（或诊断名称），操作编码（或操作名称）可选。
+    相同的(诊断, 操作)组合只入组一次，耗时与不同组合数成正比而不是与病例数成正比；
+    组合去重在int32编号上进行：目录中的编码使用目录冻结字典的编号，病例中的其他取值只登记在本次调用的覆盖层中，
+    不修改进程共享的目录索引。
+    fuzzy_threshold不为None时，目录中找不到的诊断名称和操作按模糊匹配入组。
+    未能入组的病例入组的DIP基准分值为NaN，不参与金额汇总。
+    """
+    诊断输入, 操作输入 = case_group_inputs(cases)
+    诊断列表, 操作列表, codes = unique_case_inputs(index.code_dictionary.overlay(), 诊断输入, 操作输入)
+    unique_results = group_unique_inputs(index, 诊断列表, 操作列表, fuzzy_threshold)
+    return expand_unique_results(unique_results, codes, cases.index)
@@ -0,0 +1,185 @@
+# dip_incremental.py - 批量结果的依赖记录与增量重算：目录或参数变化时只重算受影响的病例和指标列
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dip_grouping import case_group_inputs, group_cases, 分组列
+from dip_io import read_case_file, 病例编码列
+from dip_metrics import affected_metric_columns, recalculate_dip_metrics, 参数列
+
+# 依赖记录文件名：结果文件名加该后缀
+依赖文件后缀 = '.deps.json'
+
+# 读取已有结果时按字符串读取的分组列
+结果文本列 = ['入组诊断编码', '入组操作编码', 'DIP编码', 'DIP名称', '病种类型', '入组情况_诊断', '入组情况_操作']
+
+
+def _fingerprint_value(value):
+    """依赖取值转换为可写入JSON的字符串，空值为None"""
+    if value is None or pd.isna(value):
+        return None
+    return str(value)
+
+
+def diagnosis_fingerprints(index, codes):
+    """DIP目录中每个诊断编码下全部记录（按目录顺序）的指纹，目录中没有的编码为None
+
+    入组只查找入组诊断编码下的记录（直接匹配、综合病种组别、无操作记录），这些记录不变时入组结果不变。
+    """
+    row_hashes = pd.util.hash_pandas_object(index.dip_database, index=False).to_numpy()
+    columns = '\x1f'.join(str(col) for col in index.dip_database.columns).encode('utf-8')
+    fingerprints = {}
+    for code in codes:
+        rows = index.diagnosis_positions(code)
+        fingerprints[code] = hashlib.sha1(columns + row_hashes[rows].tobytes()).hexdigest()[:16] if rows else None
+    return fingerprints
+
+
+def diagnosis_input_fingerprints(index, inputs):
+    """诊断输入（编码或名称）在诊断目录中对应的诊断编码"""
+    return {value: _fingerprint_value(index.find_diagnosis_code(value)) for value in inputs}
+
+
+def operation_input_fingerprints(index, inputs):
+    """操作输入（编码或名称）在手术操作分类目录中的操作类别"""
+    return {value: _fingerprint_value(index.find_operation_category(value)) for value in inputs}
+
+
+# 依赖键类型 -> 指纹函数
+依赖指纹函数 = {
+    '入组诊断编码': diagnosis_fingerprints,
+    '诊断输入': diagnosis_input_fingerprints,
+    '操作输入': operation_input_fingerprints
+}
+
+
+def dependency_keys(scored):
+    """结果表每行的依赖键：入组诊断编码、规范化后的诊断输入和操作输入，返回 类型 -> Series"""
+    诊断输入, 操作输入 = case_group_inputs(scored)
+    return {
+        '入组诊断编码': scored['入组诊断编码'].fillna("").astype(str),
+        '诊断输入': 诊断输入,
+        '操作输入': 操作输入
+    }
+
+
+class DependencyTracker:
+    """逐块登记批量结果依赖的目录键及其指纹，生成依赖记录
+
+    依赖记录包括计算参数、模糊匹配阈值、组别规则、目录整体版本，以及结果中出现过的每个依赖键在当时目录中的指纹；
+    只保存不同的键，大小与病例数无关。
+    """
+
+    def __init__(self, index, 参数, fuzzy_threshold=None):
+        self.index = index
+        self.参数 = dict(参数)
+        self.fuzzy_threshold = fuzzy_threshold
+        self.dependencies = {类型: {} for 类型 in 依赖指纹函数}
+
+    def update(self, scored):
+        """登记一块结果中新出现的依赖键"""
+        for 类型, keys in dependency_keys(scored).items():
+            known = self.dependencies[类型]
+            new_keys = [key for key in pd.unique(keys.to_numpy()) if key not in known]
+            known.update(依赖指纹函数[类型](self.index, new_keys))
+        return self
+
+    def metadata(self):
+        """依赖记录（可写入JSON）"""
+        return {
+            '参数': self.参数,
+            '模糊匹配阈值': self.fuzzy_threshold,
+            '组别规则': self.index.category_suffixes,
+            '目录版本': self.index.version,
+            '依赖': self.dependencies
+        }
+
+
+def dependency_path(result_path):
+    """结果文件对应的依赖记录文件路径"""
+    return result_path + 依赖文件后缀
+
+
+def save_dependencies(result_path, metadata):
+    """写出结果文件的依赖记录"""
+    with open(dependency_path(result_path), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+def load_dependencies(result_path):
+    """读取结果文件的依赖记录，没有记录时抛出ValueError"""
+    path = dependency_path(result_path)
+    if not os.path.exists(path):
+        raise ValueError(f"结果文件没有依赖记录，不能增量重算: {path}")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_scored_file(result_path):
+    """读取已有的批量结果文件，编码列和分组文本列按字符串读取"""
+    return read_case_file(result_path, 病例编码列 + 结果文本列)
+
+
+def changed_rows(scored, metadata, index, fuzzy_threshold=None):
+    """按依赖记录找出在新目录下需要重新入组的行，返回布尔数组
+
+    目录版本和模糊匹配阈值都没有变化时不需要重新入组；模糊匹配阈值或组别规则变化、
+    或使用模糊匹配时目录有任何变化（候选来自整个目录），全部重新入组；
+    否则只重新入组依赖键的指纹发生变化（包括新出现的键）的行。
+    """
+    行数 = len(scored)
+    if metadata['目录版本'] == index.version and metadata['模糊匹配阈值'] == fuzzy_threshold:
+        return np.zeros(行数, dtype=bool)
+    if (metadata['模糊匹配阈值'] != fuzzy_threshold or fuzzy_threshold is not None or
+            metadata['组别规则'] != index.category_suffixes):
+        return np.ones(行数, dtype=bool)
+
+    mask = np.zeros(行数, dtype=bool)
+    for 类型, keys in dependency_keys(scored).items():
+        recorded = metadata['依赖'][类型]
+        distinct = pd.unique(keys.to_numpy())
+        current = 依赖指纹函数[类型](index, distinct)
+        changed = [key for key in distinct if key not in recorded or recorded[key] != current[key]]
+        if changed:
+            mask |= keys.isin(changed).to_numpy()
+    return mask
+
+
+def update_scored_results(scored, metadata, index, 参数, fuzzy_threshold=None):
+    """按新的目录和参数增量更新已有的批量结果，返回(新结果, 新依赖记录, 重算报告)
+
+    参数变化时只对全部行重算依赖该参数的指标列（如点值变化只重算DIP支付标准及其下游指标），
+    按行取值的参数列不受影响；目录变化时只对依赖键变化的行重新入组，并重算这些行依赖基准分值的指标列。
+    重算报告包括病例数、重新入组行数、重算指标行数和重算的指标列。
+    """
+    scored = scored.copy()
+    重算列 = []
+    重算行 = np.zeros(len(scored), dtype=bool)
+
+    changed_params = [col for col in 参数列
+                      if col not in scored.columns and 参数[col] != metadata['参数'].get(col)]
+    columns = affected_metric_columns(changed_params)
+    if columns:
+        scored[columns] = recalculate_dip_metrics(scored, columns, **参数)
+        重算列.extend(columns)
+        重算行[:] = True
+
+    mask = changed_rows(scored, metadata, index, fuzzy_threshold)
+    if mask.any():
+        scored.loc[mask, 分组列] = group_cases(index, scored[mask], fuzzy_threshold)
+        columns = affected_metric_columns(['入组的DIP基准分值'])
+        scored.loc[mask, columns] = recalculate_dip_metrics(scored[mask], columns, **参数)
+        重算列.extend(col for col in columns if col not in 重算列)
+        重算行 |= mask
+
+    report = {
+        '病例数': len(scored),
+        '重新入组行数': int(mask.sum()),
+        '重算指标行数': int(重算行.sum()),
+        '重算指标列': 重算列
+    }
+    new_metadata = DependencyTracker(index, 参数, fuzzy_threshold).update(scored).metadata()
+    return scored, new_metadata, report
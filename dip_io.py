@@ -0,0 +1,390 @@
+# dip_io.py - 目录文件读取、解析缓存与列式快照
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dip_cache import LRUCache
+
+# 解析缓存最多保留的目录数量
+最大缓存条目数 = 8
+
+# 目录快照中三个目录对应的文件名
+快照目录名称 = ['dip_database', 'surgery_database', 'diagnosis_database']
+
+# DataFrame.attrs中的已规范化标记，展示时据此跳过重复规范化
+规范化标记 = 'nan_normalized'
+
+# DataFrame.attrs中记录的紧凑化之前（object字符串存储）的内存字节数
+紧凑前字节数标记 = 'object_nbytes'
+
+# 不同取值数不超过行数该比例的字符串列转换为categorical
+分类列最大取值比例 = 0.5
+
+# 三个目录各自的必要列
+目录必要列 = {
+    'dip_database': ['诊断名称', '诊断编码', '操作名称', '操作编码', '入组的DIP基准分值'],
+    'surgery_database': ['操作编码', '操作名称', '操作类别'],
+    'diagnosis_database': ['诊断编码', '诊断名称']
+}
+
+# 病例文件中按字符串读取的编码列，避免操作编码被解析成浮点数
+病例编码列 = ['诊断编码', '诊断名称', '操作编码', '操作名称']
+
+# 快照中字符串列取值的类型标记
+_取值类型 = {'str': 0, 'int': 1, 'float': 2, 'missing': 3, 'bool': 4}
+
+
+def file_sha256(file_bytes):
+    """计算文件内容的SHA-256"""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def normalize_catalog(catalog):
+    """将目录中字符串类型列的NaN、None和空字符串整列替换为中文'无'
+
+    按列向量化处理，并在DataFrame.attrs中记录已规范化标记，已规范化的目录直接返回。
+    """
+    if is_normalized(catalog):
+        return catalog
+    for col in catalog.columns:
+        if catalog[col].dtype == 'object':  # 只处理字符串类型的列
+            values = catalog[col].to_numpy()
+            empty = pd.isna(values) | (values == "")
+            if empty.any():
+                catalog[col] = catalog[col].where(~empty, "无")
+    catalog.attrs[规范化标记] = True
+    return catalog
+
+
+def is_normalized(catalog):
+    """目录是否已经做过空值规范化"""
+    return bool(catalog.attrs.get(规范化标记, False))
+
+
+def ensure_normalized(catalog):
+    """返回规范化后的目录：已规范化的直接返回原对象，否则规范化一个副本"""
+    if is_normalized(catalog):
+        return catalog
+    return normalize_catalog(catalog.copy())
+
+
+def catalog_nbytes(catalog):
+    """目录当前占用的内存字节数（含字符串内容）"""
+    return int(catalog.memory_usage(index=False, deep=True).sum())
+
+
+def compact_catalog(catalog, max_unique_ratio=分类列最大取值比例):
+    """将重复取值较多的字符串列（病种类型、操作类别、诊断编码、操作名称等）转换为categorical，返回新目录
+
+    每个不同取值只保存一份，各行只保存整数编码。原目录不修改；返回的目录已规范化空值，
+    attrs中记录紧凑化之前的内存字节数，供内存报告使用。
+    """
+    catalog = ensure_normalized(catalog)
+    compacted = catalog.copy(deep=False)
+    compacted.attrs[紧凑前字节数标记] = catalog.attrs.get(紧凑前字节数标记, catalog_nbytes(catalog))
+    for col in catalog.columns:
+        values = catalog[col]
+        if values.dtype == 'object' and len(values) > 0 and \
+                values.nunique(dropna=False) <= len(values) * max_unique_ratio:
+            compacted[col] = values.astype('category')
+    return compacted
+
+
+def catalog_memory_report(catalog):
+    """目录紧凑化前后的内存字节数：返回(紧凑前字节数, 当前字节数)，未紧凑化的目录两者相同"""
+    current = catalog_nbytes(catalog)
+    return int(catalog.attrs.get(紧凑前字节数标记, current)), current
+
+
+# 按文件内容SHA-256缓存解析后的目录，进程内所有会话共享
+catalog_parse_cache = LRUCache(最大缓存条目数)
+
+
+def read_catalog_excel(file_bytes, compact=False):
+    """读取目录Excel文件并规范化空值，内容相同的文件只解析一次
+
+    compact为True时返回紧凑化（categorical）的目录，同样按文件内容缓存，多个会话共享同一份；
+    中间的object目录只在解析时存在，不放入缓存，进程中不会同时保留同一目录的两种存储。
+    """
+    digest = file_sha256(file_bytes)
+    if compact:
+        return catalog_parse_cache.get_or_create(
+            (digest, 'compact'), lambda: compact_catalog(normalize_catalog(pd.read_excel(io.BytesIO(file_bytes)))))
+    return catalog_parse_cache.get_or_create(
+        digest,
+        lambda: normalize_catalog(pd.read_excel(io.BytesIO(file_bytes)))
+    )
+
+
+def _encode_object_column(values):
+    """将object列编码为整数编码 + 字符串字典 + 取值类型，保留数字和空值的原始类型"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    kinds = np.empty(len(uniques), dtype=np.int8)
+    texts = []
+    for i, value in enumerate(uniques):
+        if value is None or value is pd.NA or (isinstance(value, float) and value != value):
+            kinds[i] = _取值类型['missing']
+            texts.append("")
+        elif isinstance(value, (bool, np.bool_)):
+            kinds[i] = _取值类型['bool']
+            texts.append("1" if value else "0")
+        elif isinstance(value, (int, np.integer)):
+            kinds[i] = _取值类型['int']
+            texts.append(str(int(value)))
+        elif isinstance(value, (float, np.floating)):
+            kinds[i] = _取值类型['float']
+            texts.append(repr(float(value)))
+        else:
+            kinds[i] = _取值类型['str']
+            texts.append(str(value))
+    return codes.astype(np.int32), np.array(texts, dtype=str), kinds
+
+
+def _decode_object_column(codes, texts, kinds):
+    """按取值类型还原object列，只有非字符串取值需要逐个转换"""
+    uniques = texts.astype(object)
+    for i in np.flatnonzero(kinds != _取值类型['str']).tolist():
+        kind = kinds[i]
+        if kind == _取值类型['missing']:
+            uniques[i] = np.nan
+        elif kind == _取值类型['bool']:
+            uniques[i] = texts[i] == "1"
+        elif kind == _取值类型['int']:
+            uniques[i] = int(texts[i])
+        else:
+            uniques[i] = float(texts[i])
+    return uniques.take(codes) if len(uniques) else np.empty(len(codes), dtype=object)
+
+
+def save_catalog_snapshot_file(path, catalog):
+    """将单个目录保存为列式二进制快照（.npz）
+
+    数值列直接保存为NumPy数组；字符串列保存为int32编码加去重后的字符串字典，
+    读取时不需要pickle。
+    """
+    arrays = {'__columns__': np.array([str(col) for col in catalog.columns], dtype=str),
+              '__normalized__': np.array(is_normalized(catalog))}
+    for i, col in enumerate(catalog.columns):
+        values = catalog[col]
+        if values.dtype == 'object' or isinstance(values.dtype, pd.CategoricalDtype):
+            # categorical列按字符串列保存，读取后再按需紧凑化
+            codes, texts, kinds = _encode_object_column(values.to_numpy(dtype=object))
+            arrays[f'c{i}_codes'] = codes
+            arrays[f'c{i}_texts'] = texts
+            arrays[f'c{i}_kinds'] = kinds
+        else:
+            arrays[f'c{i}_values'] = values.to_numpy()
+    np.savez(path, **arrays)
+
+
+def load_catalog_snapshot_file(path):
+    """读取单个目录的列式二进制快照"""
+    with np.load(path, allow_pickle=False) as snapshot:
+        columns = snapshot['__columns__'].tolist()
+        data = {}
+        for i, col in enumerate(columns):
+            if f'c{i}_values' in snapshot.files:
+                data[col] = snapshot[f'c{i}_values']
+            else:
+                data[col] = _decode_object_column(snapshot[f'c{i}_codes'],
+                                                  snapshot[f'c{i}_texts'],
+                                                  snapshot[f'c{i}_kinds'])
+        normalized = '__normalized__' in snapshot.files and bool(snapshot['__normalized__'])
+    catalog = pd.DataFrame(data, columns=columns)
+    if normalized:
+        catalog.attrs[规范化标记] = True
+    return catalog
+
+
+def save_catalog_snapshot(directory, catalogs):
+    """将规范化后的目录保存到快照目录，catalogs为 目录名称 -> DataFrame"""
+    os.makedirs(directory, exist_ok=True)
+    for name, catalog in catalogs.items():
+        if name not in 快照目录名称:
+            raise ValueError(f"未知的目录名称: {name}")
+        # 先写临时文件再替换，避免其他进程读到写了一半的快照
+        path = os.path.join(directory, f'{name}.npz')
+        tmp_path = os.path.join(directory, f'{name}.tmp.npz')
+        save_catalog_snapshot_file(tmp_path, catalog)
+        os.replace(tmp_path, path)
+
+
+def load_catalog_snapshot(directory):
+    """从快照目录读取目录，返回 目录名称 -> DataFrame，只包含快照中存在的目录"""
+    catalogs = {}
+    if not directory or not os.path.isdir(directory):
+        return catalogs
+    for name in 快照目录名称:
+        path = os.path.join(directory, f'{name}.npz')
+        if os.path.exists(path):
+            catalogs[name] = load_catalog_snapshot_file(path)
+    return catalogs
+
+
+def check_required_columns(data, required_columns, file_path):
+    """检查必要列是否存在，缺少时抛出ValueError"""
+    missing_columns = [col for col in required_columns if col not in data.columns]
+    if missing_columns:
+        raise ValueError(f"{file_path} 缺少必要列: {', '.join(missing_columns)}")
+
+
+def load_category_suffixes(file_path):
+    """读取入组规则文件（JSON）中的"操作类别组别"：操作类别 -> DIP名称中的组别后缀"""
+    with open(file_path, encoding='utf-8') as f:
+        try:
+            rules = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{file_path} 不是有效的JSON: {e}")
+    mapping = rules.get('操作类别组别') if isinstance(rules, dict) else None
+    if not isinstance(mapping, dict) or not mapping:
+        raise ValueError(f"{file_path} 缺少\"操作类别组别\"配置")
+    for 操作类别, 组别后缀 in mapping.items():
+        if not isinstance(组别后缀, str) or not 组别后缀:
+            raise ValueError(f"{file_path} 中操作类别 {操作类别} 的组别后缀无效")
+    return mapping
+
+
+def load_catalog_file(file_path, name):
+    """按扩展名读取目录文件（.npz快照、.csv或Excel），并检查必要列"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.npz':
+        catalog = load_catalog_snapshot_file(file_path)
+    elif extension == '.csv':
+        catalog = normalize_catalog(pd.read_csv(file_path))
+    else:
+        with open(file_path, 'rb') as f:
+            catalog = read_catalog_excel(f.read())
+    check_required_columns(catalog, 目录必要列[name], file_path)
+    return catalog
+
+
+def read_case_file(file_path, text_columns=病例编码列):
+    """读取病例文件（.csv或Excel），编码列（text_columns）按字符串读取
+
+    file_path也可以是带name属性的文件对象（如界面上传的文件），按name的扩展名判断格式。
+    """
+    converters = {col: str for col in text_columns}
+    if os.path.splitext(getattr(file_path, 'name', file_path))[1].lower() == '.csv':
+        return pd.read_csv(file_path, dtype=converters, encoding='utf-8-sig')
+    return pd.read_excel(file_path, dtype=converters)
+
+
+def write_result_file(result, file_path):
+    """按扩展名写出结果文件（.csv或Excel），CSV带BOM以便Excel直接打开"""
+    if os.path.splitext(file_path)[1].lower() == '.csv':
+        result.to_csv(file_path, index=False, encoding='utf-8-sig')
+    else:
+        result.to_excel(file_path, index=False)
+
+
+def _case_chunk(rows, columns, start):
+    """把读取到的一批行转换为病例DataFrame，行索引延续文件中的行号，编码列转为字符串"""
+    chunk = pd.DataFrame(rows, columns=columns, index=pd.RangeIndex(start, start + len(rows)))
+    for col in 病例编码列:
+        if col in chunk.columns:
+            chunk[col] = chunk[col].map(lambda value: value if value is None else str(value))
+    return chunk
+
+
+def _iter_excel_chunks(file_path, chunk_rows):
+    """以openpyxl只读模式逐行读取xlsx，按固定行数产出病例块"""
+    # 只在流式读取xlsx时才需要openpyxl，延迟导入以加快命令行启动
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col) if col is not None else f'未命名列{i}' for i, col in enumerate(header)]
+        buffer = []
+        start = 0
+        for row in rows:
+            buffer.append(row[:len(columns)])
+            if len(buffer) >= chunk_rows:
+                yield _case_chunk(buffer, columns, start)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _case_chunk(buffer, columns, start)
+    finally:
+        workbook.close()
+
+
+def iter_case_chunks(file_path, chunk_rows, columns=None):
+    """流式读取病例文件，按固定行数逐块产出，内存占用与文件大小无关
+
+    CSV使用pandas分块读取，xlsx使用openpyxl只读模式；旧版.xls不支持流式读取，整体读入后再分块。
+    columns不为None时只保留其中存在的列，CSV读取时直接跳过其他列。
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        converters = {col: str for col in 病例编码列}
+        usecols = None if columns is None else (lambda col: col in columns)
+        yield from pd.read_csv(file_path, dtype=converters, encoding='utf-8-sig', chunksize=chunk_rows,
+                               usecols=usecols)
+        return
+    if extension in ('.xlsx', '.xlsm'):
+        chunks = _iter_excel_chunks(file_path, chunk_rows)
+    else:
+        cases = read_case_file(file_path)
+        chunks = (cases.iloc[start:start + chunk_rows] for start in range(0, len(cases), chunk_rows))
+    for chunk in chunks:
+        yield chunk if columns is None else chunk[[col for col in chunk.columns if col in columns]]
+
+
+class ResultWriter:
+    """逐块写出结果文件：CSV追加写入，Excel使用openpyxl只写模式，不需要在内存中保留全部结果"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.rows_written = 0
+        self._is_csv = os.path.splitext(file_path)[1].lower() == '.csv'
+        self._workbook = None
+        self._worksheet = None
+
+    def write(self, chunk):
+        """写出一块结果"""
+        if self._is_csv:
+            if self.rows_written == 0:
+                chunk.to_csv(self.file_path, index=False, encoding='utf-8-sig')
+            else:
+                chunk.to_csv(self.file_path, index=False, header=False, mode='a', encoding='utf-8')
+        else:
+            if self._workbook is None:
+                from openpyxl import Workbook
+
+                self._workbook = Workbook(write_only=True)
+                self._worksheet = self._workbook.create_sheet()
+                self._worksheet.append([str(col) for col in chunk.columns])
+            # 空值写为空单元格，避免NaN在Excel中显示为错误值
+            values = chunk.astype(object).where(chunk.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                self._worksheet.append(row)
+        self.rows_written += len(chunk)
+
+    def close(self):
+        """结束写出，Excel文件在此时保存"""
+        if self._is_csv:
+            if self.rows_written == 0:
+                pd.DataFrame().to_csv(self.file_path, index=False, encoding='utf-8-sig')
+        else:
+            if self._workbook is None:
+                from openpyxl import Workbook
+
+                self._workbook = Workbook(write_only=True)
+                self._workbook.create_sheet()
+            self._workbook.save(self.file_path)
+            self._workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,185 @@
+# dip_metrics.py - DIP指标批量计算
+import numpy as np
+import pandas as pd
+
+# 默认计算参数（与界面默认值一致）
+默认点值 = {'居民': 63.3253, '职工': 73.6011}
+默认医院等级系数 = 1.0330
+默认医疗性收入成本率 = 0.50
+默认药耗成本率 = 1.00
+
+# 批量计算时病例表中的费用列
+费用列 = ['诊疗费用', '检查检验费用', '药品费用', '耗材费用']
+
+# 可以按行变化的计算参数列
+参数列 = ['医疗性收入成本率', '药耗成本率', '医院等级系数', '点值']
+
+# 计算结果列（与calculate_dip_metrics返回的键一致）
+指标列 = ['住院总费用', '治疗成本', 'DIP支付标准', 'DIP核算金额',
+          '病例真实盈亏金额', 'DIP回款率', 'DIP盈亏金额', '入组的DIP分值']
+
+# 每个指标列依赖的输入列（含经由上游指标的间接依赖），增量重算时据此确定需要重算的指标列
+指标依赖 = {
+    '住院总费用': 费用列,
+    '治疗成本': 费用列 + ['医疗性收入成本率', '药耗成本率'],
+    '入组的DIP分值': ['入组的DIP基准分值', '医院等级系数'],
+    'DIP支付标准': ['入组的DIP基准分值', '医院等级系数', '点值'],
+    'DIP核算金额': 费用列 + ['统筹基金支付金额', '入组的DIP基准分值', '医院等级系数', '点值'],
+    '病例真实盈亏金额': 费用列 + ['医疗性收入成本率', '药耗成本率', '入组的DIP基准分值', '医院等级系数', '点值'],
+    'DIP回款率': 费用列 + ['统筹基金支付金额', '入组的DIP基准分值', '医院等级系数', '点值'],
+    'DIP盈亏金额': 费用列 + ['统筹基金支付金额', '入组的DIP基准分值', '医院等级系数', '点值']
+}
+
+
+def _as_float_array(value):
+    """将标量、列表、Series统一转换为float64数组"""
+    if isinstance(value, pd.Series):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float64)
+
+
+def calculate_dip_metrics_batch(
+        诊疗费用, 检查检验费用, 药品费用, 耗材费用,
+        医疗性收入成本率, 药耗成本率, 统筹基金支付金额,
+        入组的DIP基准分值, 医院等级系数, 点值
+):
+    """批量计算DIP相关指标，参数可以是标量或等长数组，按行广播，无Python循环"""
+    诊疗费用 = _as_float_array(诊疗费用)
+    检查检验费用 = _as_float_array(检查检验费用)
+    药品费用 = _as_float_array(药品费用)
+    耗材费用 = _as_float_array(耗材费用)
+    医疗性收入成本率 = _as_float_array(医疗性收入成本率)
+    药耗成本率 = _as_float_array(药耗成本率)
+    统筹基金支付金额 = _as_float_array(统筹基金支付金额)
+    入组的DIP基准分值 = _as_float_array(入组的DIP基准分值)
+    医院等级系数 = _as_float_array(医院等级系数)
+    点值 = _as_float_array(点值)
+
+    # 计算入组的DIP分值
+    入组的DIP分值 = 入组的DIP基准分值 * 医院等级系数
+
+    # 计算中间指标
+    住院总费用 = 诊疗费用 + 检查检验费用 + 药品费用 + 耗材费用
+    医疗性收入 = 诊疗费用 + 检查检验费用
+    药耗收入 = 药品费用 + 耗材费用
+    治疗成本 = 医疗性收入 * 医疗性收入成本率 + 药耗收入 * 药耗成本率
+    病人自付金额 = 住院总费用 - 统筹基金支付金额
+    DIP支付标准 = 入组的DIP分值 * 点值
+
+    # 根据新的DIP付费办法，DIP核算金额为负数时计算为0
+    DIP核算金额 = np.maximum(DIP支付标准 - 病人自付金额, 0.0)
+
+    # 计算目标指标
+    病例真实盈亏金额 = DIP支付标准 - 治疗成本
+
+    # 统筹基金支付金额为0时回款率记为0
+    DIP核算金额, 统筹基金支付金额 = np.broadcast_arrays(DIP核算金额, 统筹基金支付金额)
+    DIP回款率 = np.zeros(DIP核算金额.shape, dtype=np.float64)
+    np.divide(DIP核算金额, 统筹基金支付金额, out=DIP回款率, where=统筹基金支付金额 != 0)
+
+    DIP盈亏金额 = DIP核算金额 - 统筹基金支付金额
+
+    return {
+        '病例真实盈亏金额': 病例真实盈亏金额,
+        'DIP回款率': DIP回款率,
+        '住院总费用': 住院总费用,
+        '治疗成本': 治疗成本,
+        'DIP支付标准': DIP支付标准,
+        'DIP核算金额': DIP核算金额,
+        'DIP盈亏金额': DIP盈亏金额,
+        '入组的DIP分值': 入组的DIP分值
+    }
+
+
+def calculate_dip_metrics_frame(cases, 医疗性收入成本率=None, 药耗成本率=None, 医院等级系数=None, 点值=None):
+    """对整张病例表计算DIP指标
+
+    cases需要包含四项费用列、统筹基金支付金额和入组的DIP基准分值；
+    参数列（医疗性收入成本率、药耗成本率、医院等级系数、点值）如果在表中存在则按行取值，
+    否则使用传入的标量。返回与cases行索引一致的指标DataFrame。
+    """
+    默认参数 = {
+        '医疗性收入成本率': 医疗性收入成本率,
+        '药耗成本率': 药耗成本率,
+        '医院等级系数': 医院等级系数,
+        '点值': 点值
+    }
+
+    required_columns = 费用列 + ['统筹基金支付金额', '入组的DIP基准分值']
+    missing_columns = [col for col in required_columns if col not in cases.columns]
+    missing_columns += [col for col in 参数列 if col not in cases.columns and 默认参数[col] is None]
+    if missing_columns:
+        raise ValueError(f"病例数据缺少必要列: {', '.join(missing_columns)}")
+
+    参数 = {col: cases[col] if col in cases.columns else 默认参数[col] for col in 参数列}
+
+    results = calculate_dip_metrics_batch(
+        cases['诊疗费用'], cases['检查检验费用'], cases['药品费用'], cases['耗材费用'],
+        参数['医疗性收入成本率'], 参数['药耗成本率'], cases['统筹基金支付金额'],
+        cases['入组的DIP基准分值'], 参数['医院等级系数'], 参数['点值']
+    )
+
+    行数 = len(cases)
+    return pd.DataFrame(
+        {col: np.broadcast_to(results[col], (行数,)) for col in 指标列},
+        index=cases.index
+    )
+
+
+def affected_metric_columns(changed_inputs):
+    """依赖changed_inputs中任一输入列的指标列，按指标列顺序返回"""
+    changed_inputs = set(changed_inputs)
+    return [col for col in 指标列 if changed_inputs.intersection(指标依赖[col])]
+
+
+def recalculate_dip_metrics(frame, columns, 医疗性收入成本率=None, 药耗成本率=None, 医院等级系数=None, 点值=None):
+    """只重算columns中的指标列，返回只含这些列、行索引与frame一致的DataFrame
+
+    frame为已计算过指标的结果表，公式与calculate_dip_metrics_batch一致；不重算的上游指标直接取frame中的值，
+    例如只有点值变化时按已有的入组的DIP分值重算DIP支付标准及其下游指标，不再重算住院总费用和治疗成本。
+    参数列在frame中存在时按行取值，否则使用传入的标量。
+    """
+    默认参数 = {
+        '医疗性收入成本率': 医疗性收入成本率,
+        '药耗成本率': 药耗成本率,
+        '医院等级系数': 医院等级系数,
+        '点值': 点值
+    }
+    values = {}
+
+    def 输入(col):
+        if col in frame.columns:
+            return _as_float_array(frame[col])
+        if 默认参数.get(col) is None:
+            raise ValueError(f"病例数据缺少必要列: {col}")
+        return _as_float_array(默认参数[col])
+
+    def 指标(col):
+        return values[col] if col in values else _as_float_array(frame[col])
+
+    if '住院总费用' in columns:
+        values['住院总费用'] = 输入('诊疗费用') + 输入('检查检验费用') + 输入('药品费用') + 输入('耗材费用')
+    if '治疗成本' in columns:
+        values['治疗成本'] = ((输入('诊疗费用') + 输入('检查检验费用')) * 输入('医疗性收入成本率') +
+                          (输入('药品费用') + 输入('耗材费用')) * 输入('药耗成本率'))
+    if '入组的DIP分值' in columns:
+        values['入组的DIP分值'] = 输入('入组的DIP基准分值') * 输入('医院等级系数')
+    if 'DIP支付标准' in columns:
+        values['DIP支付标准'] = 指标('入组的DIP分值') * 输入('点值')
+    if 'DIP核算金额' in columns:
+        病人自付金额 = 指标('住院总费用') - 输入('统筹基金支付金额')
+        values['DIP核算金额'] = np.maximum(指标('DIP支付标准') - 病人自付金额, 0.0)
+    if '病例真实盈亏金额' in columns:
+        values['病例真实盈亏金额'] = 指标('DIP支付标准') - 指标('治疗成本')
+    if 'DIP回款率' in columns:
+        DIP核算金额, 统筹基金支付金额 = np.broadcast_arrays(指标('DIP核算金额'), 输入('统筹基金支付金额'))
+        values['DIP回款率'] = np.zeros(DIP核算金额.shape, dtype=np.float64)
+        np.divide(DIP核算金额, 统筹基金支付金额, out=values['DIP回款率'], where=统筹基金支付金额 != 0)
+    if 'DIP盈亏金额' in columns:
+        values['DIP盈亏金额'] = 指标('DIP核算金额') - 输入('统筹基金支付金额')
+
+    行数 = len(frame)
+    return pd.DataFrame(
+        {col: np.broadcast_to(values[col], (行数,)) for col in 指标列 if col in columns},
+        index=frame.index
+    )
@@ -0,0 +1,211 @@
+# dip_montecarlo.py - 点值风险模拟：按分布抽样点值和成本率，计算整批病例DIP盈亏金额合计的分布
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from dip_io import read_case_file, write_result_file
+from dip_metrics import 默认点值, 默认医院等级系数, 默认医疗性收入成本率, 默认药耗成本率, 费用列
+
+# 分布名称 -> 参数个数（fixed:取值，normal:均值:标准差，uniform:下限:上限，triangular:下限:众数:上限）
+分布参数个数 = {'fixed': 1, 'normal': 2, 'uniform': 2, 'triangular': 3}
+
+# 抽样的参数
+模拟参数 = ['点值', '医疗性收入成本率', '药耗成本率']
+
+# 每次抽样和计算的次数，限制中间数组的内存
+每批抽样次数 = 100000
+
+# 汇总时输出的百分位数
+默认百分位数 = [5, 25, 50, 75, 95]
+
+
+def parse_distribution(text):
+    """解析分布设置，如 normal:73.6011:3、uniform:0.4:0.6、triangular:60:73.6:80，单个数值表示固定值"""
+    parts = text.split(':')
+    if len(parts) == 1:
+        parts = ['fixed'] + parts
+    name = parts[0]
+    if name not in 分布参数个数 or len(parts) - 1 != 分布参数个数[name]:
+        raise ValueError(f"分布格式错误: {text}（可用 {', '.join(分布参数个数)}，如 normal:均值:标准差）")
+    try:
+        params = tuple(float(part) for part in parts[1:])
+    except ValueError:
+        raise ValueError(f"分布参数应为数值: {text}") from None
+    return check_distribution((name, params))
+
+
+def check_distribution(distribution):
+    """检查分布参数是否有效，返回distribution本身"""
+    name, params = distribution
+    if name not in 分布参数个数 or len(params) != 分布参数个数[name]:
+        raise ValueError(f"不支持的分布: {name}{params}")
+    if (name == 'normal' and params[1] < 0) or (name == 'uniform' and params[0] > params[1]) or \
+            (name == 'triangular' and not params[0] <= params[1] <= params[2]):
+        raise ValueError(f"分布参数无效: {name}{params}")
+    return distribution
+
+
+def sample_distribution(rng, distribution, size):
+    """按分布抽取size个样本；点值和成本率不能为负，小于0的样本取0"""
+    name, params = distribution
+    if name == 'fixed':
+        samples = np.full(size, params[0])
+    elif name == 'normal':
+        samples = rng.normal(params[0], params[1], size)
+    elif name == 'uniform':
+        samples = rng.uniform(params[0], params[1], size)
+    elif params[0] == params[2]:
+        samples = np.full(size, params[0])
+    else:
+        samples = rng.triangular(params[0], params[1], params[2], size)
+    return np.maximum(samples, 0.0)
+
+
+class DipProfitCurve:
+    """整批病例的DIP核算金额、DIP盈亏金额和病例真实盈亏金额合计作为点值、成本率的函数
+
+    单个病例的DIP核算金额 = max(分值 × 点值 - 病人自付金额, 0)，在点值超过临界点值（病人自付金额 / 分值）后
+    随点值线性增长。病例按临界点值排序并预先累加分值和病人自付金额，任意一批点值的合计只需一次二分查找，
+    结果与逐病例计算再求和一致，耗时与病例数无关；病例真实盈亏金额合计对点值和成本率是线性的，直接由合计量计算。
+    未能入组（基准分值为空）的病例不计金额，但统筹基金支付金额计入DIP回款率的分母。
+    cases中有医院等级系数列时按行取系数，否则使用传入的标量，与calculate_dip_metrics_frame一致。
+    """
+
+    def __init__(self, cases, 医院等级系数=默认医院等级系数):
+        missing = [col for col in 费用列 + ['统筹基金支付金额', '入组的DIP基准分值'] if col not in cases.columns]
+        if missing:
+            raise ValueError(f"病例数据缺少必要列: {', '.join(missing)}")
+        values = {col: cases[col].to_numpy(dtype=np.float64) for col in
+                  费用列 + ['统筹基金支付金额', '入组的DIP基准分值']}
+        self.病例数 = len(cases)
+        self.统筹基金支付金额合计 = float(np.nansum(values['统筹基金支付金额']))
+
+        if '医院等级系数' in cases.columns:
+            医院等级系数 = cases['医院等级系数'].to_numpy(dtype=np.float64)
+        全部分值 = values['入组的DIP基准分值'] * 医院等级系数
+        # 基准分值或按行的医院等级系数为空时，逐病例计算的指标为空，不计入合计
+        可入组 = ~np.isnan(全部分值)
+        分值 = 全部分值[可入组]
+        统筹基金支付金额 = values['统筹基金支付金额'][可入组]
+        病人自付金额 = (values['诊疗费用'] + values['检查检验费用'] + values['药品费用'] + values['耗材费用'])[可入组] \
+            - 统筹基金支付金额
+        self.可入组病例数 = int(可入组.sum())
+
+        # 分值为0的病例核算金额与点值无关
+        有分值 = 分值 > 0
+        self._固定核算金额 = float(np.maximum(-病人自付金额[~有分值], 0.0).sum())
+        order = np.argsort(病人自付金额[有分值] / 分值[有分值], kind='stable')
+        self._临界点值 = (病人自付金额[有分值] / 分值[有分值])[order]
+        # 前k个临界点值最小的病例的分值、病人自付金额累计，第0项为0
+        self._累计分值 = np.concatenate([[0.0], np.cumsum(分值[有分值][order])])
+        self._累计自付金额 = np.concatenate([[0.0], np.cumsum(病人自付金额[有分值][order])])
+        self.可入组统筹基金支付金额 = float(统筹基金支付金额.sum())
+
+        # 病例真实盈亏金额 = 分值 × 点值 - 医疗性收入 × 医疗性收入成本率 - 药耗收入 × 药耗成本率
+        self._分值合计 = float(分值.sum())
+        self._医疗性收入合计 = float((values['诊疗费用'] + values['检查检验费用'])[可入组].sum())
+        self._药耗收入合计 = float((values['药品费用'] + values['耗材费用'])[可入组].sum())
+
+    def dip_settlement(self, 点值):
+        """一组点值下的DIP核算金额合计"""
+        点值 = np.asarray(点值, dtype=np.float64)
+        # 临界点值小于点值的病例核算金额为正
+        k = np.searchsorted(self._临界点值, 点值, side='left')
+        return self._累计分值[k] * 点值 - self._累计自付金额[k] + self._固定核算金额
+
+    def dip_profit(self, 点值):
+        """一组点值下的DIP盈亏金额合计"""
+        return self.dip_settlement(点值) - self.可入组统筹基金支付金额
+
+    def case_profit(self, 点值, 医疗性收入成本率, 药耗成本率):
+        """一组点值和成本率下的病例真实盈亏金额合计"""
+        return (self._分值合计 * np.asarray(点值, dtype=np.float64)
+                - self._医疗性收入合计 * np.asarray(医疗性收入成本率, dtype=np.float64)
+                - self._药耗收入合计 * np.asarray(药耗成本率, dtype=np.float64))
+
+
+def simulate_point_value_risk(cases, 分布, draws=100000, 医院等级系数=默认医院等级系数, seed=None,
+                              batch_size=每批抽样次数):
+    """蒙特卡洛模拟：按分布抽样点值和成本率，每次抽样计算整批病例的指标合计
+
+    分布为 参数名 -> (分布名称, 参数)，缺少的参数使用默认值的固定分布。
+    抽样按批进行，每批的全部抽样一次向量化计算，不逐次循环。
+    返回每次抽样一行：抽样的点值和成本率、DIP核算金额、DIP盈亏金额、病例真实盈亏金额合计和DIP回款率。
+    """
+    默认值 = {'点值': 默认点值['职工'], '医疗性收入成本率': 默认医疗性收入成本率, '药耗成本率': 默认药耗成本率}
+    分布 = {name: check_distribution(分布.get(name, ('fixed', (默认值[name],)))) for name in 模拟参数}
+    curve = DipProfitCurve(cases, 医院等级系数)
+    rng = np.random.default_rng(seed)
+
+    columns = 模拟参数 + ['DIP核算金额', 'DIP盈亏金额', '病例真实盈亏金额']
+    results = {col: np.empty(draws, dtype=np.float64) for col in columns}
+    for start in range(0, draws, batch_size):
+        size = min(batch_size, draws - start)
+        samples = {name: sample_distribution(rng, 分布[name], size) for name in 模拟参数}
+        DIP核算金额 = curve.dip_settlement(samples['点值'])
+        batch = {
+            **samples,
+            'DIP核算金额': DIP核算金额,
+            'DIP盈亏金额': DIP核算金额 - curve.可入组统筹基金支付金额,
+            '病例真实盈亏金额': curve.case_profit(samples['点值'], samples['医疗性收入成本率'], samples['药耗成本率'])
+        }
+        for col in columns:
+            results[col][start:start + size] = batch[col]
+
+    simulation = pd.DataFrame(results)
+    simulation['DIP回款率'] = (simulation['DIP核算金额'] / curve.统筹基金支付金额合计
+                            if curve.统筹基金支付金额合计 != 0 else 0.0)
+    return simulation
+
+
+def summarize_simulation(simulation, percentiles=None, metrics=None):
+    """模拟结果的分布汇总：每个指标一行，包括均值、标准差、最小值、百分位数、最大值和小于0的概率"""
+    percentiles = 默认百分位数 if percentiles is None else percentiles
+    metrics = metrics or ['DIP盈亏金额', '病例真实盈亏金额', 'DIP回款率']
+    rows = []
+    for metric in metrics:
+        values = simulation[metric].to_numpy()
+        row = {'指标': metric, '均值': values.mean(), '标准差': values.std(), '最小值': values.min()}
+        row.update({f'P{p:g}': value for p, value in zip(percentiles, np.percentile(values, percentiles))})
+        row['最大值'] = values.max()
+        row['小于0的概率'] = float((values < 0).mean())
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="点值风险模拟：按分布抽样点值和成本率，输出整批病例DIP盈亏金额合计的分布和百分位数"
+    )
+    parser.add_argument('cases', help="已入组的病例文件（dip_batch.py输出的结果文件，需包含入组的DIP基准分值）")
+    parser.add_argument('-o', '--output', help="每次抽样的结果文件（.csv或Excel），不指定时只输出汇总")
+    parser.add_argument('--point-value', default=f"normal:{默认点值['职工']}:3",
+                        help="点值分布，如 normal:73.6011:3、uniform:65:80、triangular:60:73.6:80 或固定值")
+    parser.add_argument('--medical-cost-ratio', default=str(默认医疗性收入成本率), help="医疗性收入成本率分布")
+    parser.add_argument('--drug-cost-ratio', default=str(默认药耗成本率), help="药耗成本率分布")
+    parser.add_argument('--level-coefficient', type=float, default=默认医院等级系数, help="医院等级系数")
+    parser.add_argument('--draws', type=int, default=100000, help="抽样次数")
+    parser.add_argument('--seed', type=int, help="随机数种子，指定后结果可以重现")
+    args = parser.parse_args(argv)
+
+    try:
+        分布 = {'点值': parse_distribution(args.point_value),
+              '医疗性收入成本率': parse_distribution(args.medical_cost_ratio),
+              '药耗成本率': parse_distribution(args.drug_cost_ratio)}
+        simulation = simulate_point_value_risk(read_case_file(args.cases), 分布, args.draws,
+                                               args.level_coefficient, args.seed)
+        if args.output:
+            write_result_file(simulation, args.output)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    print(f"抽样次数: {len(simulation)}")
+    print(summarize_simulation(simulation).to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
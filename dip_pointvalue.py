@@ -0,0 +1,232 @@
+# dip_pointvalue.py - 年终点值估算：由统筹基金预算和入组病例的总分值反推居民、职工点值
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from dip_codes import CodeDictionary
+from dip_io import iter_case_chunks, write_result_file
+from dip_metrics import 默认点值, 默认医院等级系数, 费用列
+
+# 病例表中的参保类型列（取值与点值类型一致：居民、职工）
+默认参保类型列 = '参保类型'
+
+# 费用偏差病例的倍率界限：住院总费用 / DIP支付标准 高于高倍率界限为高倍率病例，低于低倍率界限为低倍率病例
+默认高倍率界限 = 2.0
+默认低倍率界限 = 0.5
+
+# 迭代估算的收敛条件（相邻两次点值的相对变化）和最大迭代次数
+默认收敛精度 = 1e-6
+最大迭代次数 = 100
+
+# 按块读取病例文件时每块的行数
+每块病例数 = 500000
+
+
+def prepare_point_value_cases(chunks, 医院等级系数=默认医院等级系数, 参保类型列=默认参保类型列, 默认参保类型=None):
+    """由病例块序列提取估算所需的列，返回每个病例一行的DataFrame：参保类型（categorical）、分值、住院总费用
+
+    分值 = 入组的DIP基准分值 × 医院等级系数（病例表中有医院等级系数列时按行取值），未入组的病例分值为NaN。
+    每块只保留三个数值列和参保类型编号，百万行级别的病例文件也只占用很少的内存。
+    病例表没有参保类型列时全部病例计入默认参保类型。
+    """
+    code_dictionary = CodeDictionary()
+    parts = {'参保类型': [], '分值': [], '住院总费用': []}
+    for chunk in chunks:
+        missing = [col for col in 费用列 + ['入组的DIP基准分值'] if col not in chunk.columns]
+        if 参保类型列 not in chunk.columns and 默认参保类型 is None:
+            missing.append(参保类型列)
+        if missing:
+            raise ValueError(f"病例数据缺少必要列: {', '.join(missing)}（需先用dip_batch.py入组）")
+
+        参保类型 = chunk[参保类型列] if 参保类型列 in chunk.columns else pd.Series(默认参保类型, index=chunk.index)
+        系数 = chunk['医院等级系数'] if '医院等级系数' in chunk.columns else 医院等级系数
+        parts['参保类型'].append(code_dictionary.encode(参保类型.astype(object)))
+        parts['分值'].append(chunk['入组的DIP基准分值'].to_numpy(dtype=np.float64) * np.asarray(系数, dtype=np.float64))
+        parts['住院总费用'].append(chunk[费用列].to_numpy(dtype=np.float64).sum(axis=1))
+
+    if not parts['分值']:
+        return pd.DataFrame({'参保类型': pd.Categorical([]), '分值': [], '住院总费用': []})
+    return pd.DataFrame({
+        '参保类型': pd.Categorical.from_codes(np.concatenate(parts['参保类型']),
+                                          categories=[str(code) for code in code_dictionary.codes]),
+        '分值': np.concatenate(parts['分值']),
+        '住院总费用': np.concatenate(parts['住院总费用'])
+    })
+
+
+def _pool_codes(points, 基金预算):
+    """每个病例所属的预算编号（基金预算中参保类型的顺序），不在预算中的参保类型和未入组的病例为-1"""
+    categories = points['参保类型'].cat.categories
+    category_pools = pd.Index(list(基金预算)).get_indexer(categories.astype(str))
+    codes = points['参保类型'].cat.codes.to_numpy()
+    pools = np.where(codes >= 0, category_pools[np.maximum(codes, 0)], -1) if len(categories) else np.full(len(codes), -1)
+    return np.where(np.isnan(points['分值'].to_numpy()), -1, pools)
+
+
+def _point_values(预算, 总分值):
+    """点值 = 基金预算 / 总分值，总分值为0时为NaN"""
+    点值 = np.full(len(预算), np.nan)
+    np.divide(预算, 总分值, out=点值, where=总分值 > 0)
+    return 点值
+
+
+def _estimate_table(基金预算, pools, 总分值, 点值):
+    """估算结果表的公共列"""
+    return pd.DataFrame({
+        '参保类型': list(基金预算),
+        '病例数': np.bincount(pools[pools >= 0], minlength=len(基金预算)),
+        '基金预算': [float(value) for value in 基金预算.values()],
+        '总分值': 总分值,
+        '估算点值': 点值
+    })
+
+
+def estimate_point_values(points, 基金预算):
+    """总分值法：点值 = 基金预算 / Σ(入组的DIP基准分值 × 医院等级系数)，按参保类型分别计算
+
+    points为prepare_point_value_cases的结果，基金预算为 参保类型 -> 预算金额。返回每个参保类型一行。
+    """
+    pools = _pool_codes(points, 基金预算)
+    valid = pools >= 0
+    预算 = np.array([float(value) for value in 基金预算.values()])
+    总分值 = np.bincount(pools[valid], weights=points['分值'].to_numpy()[valid], minlength=len(预算))
+    return _estimate_table(基金预算, pools, 总分值, _point_values(预算, 总分值))
+
+
+def adjust_case_points(分值, 住院总费用, 点值, 高倍率界限=默认高倍率界限, 低倍率界限=默认低倍率界限):
+    """按费用倍率调整病例分值，返回(调整后分值, 倍率)
+
+    倍率 = 住院总费用 / (分值 × 点值)；高倍率病例分值 = 分值 × (倍率 - 高倍率界限 + 1)，
+    低倍率病例分值 = 分值 × 倍率，其余病例分值不变。
+    """
+    支付标准 = 分值 * 点值
+    倍率 = np.full(len(分值), 1.0)
+    np.divide(住院总费用, 支付标准, out=倍率, where=支付标准 > 0)
+    调整后分值 = np.where(倍率 > 高倍率界限, 分值 * (倍率 - 高倍率界限 + 1),
+                     np.where(倍率 < 低倍率界限, 分值 * 倍率, 分值))
+    return 调整后分值, 倍率
+
+
+def _adjusted_payments(pools, 分值, 住院总费用, 点值, 高倍率界限, 低倍率界限):
+    """各参保类型按点值调整病例分值后的支付总额：点值 × 调整后总分值"""
+    调整后分值, _ = adjust_case_points(分值, 住院总费用, 点值[pools], 高倍率界限, 低倍率界限)
+    return 点值 * np.bincount(pools, weights=调整后分值, minlength=len(点值))
+
+
+def estimate_point_values_iterative(points, 基金预算, 高倍率界限=默认高倍率界限, 低倍率界限=默认低倍率界限,
+                                    tolerance=默认收敛精度, max_iterations=最大迭代次数):
+    """迭代法：考虑高、低倍率病例的分值调整后估算点值
+
+    病例的费用倍率取决于点值，调整后的总分值又决定点值，需要求点值 × 调整后总分值(点值) = 基金预算。
+    直接反复代入（点值 = 基金预算 / 调整后总分值）在高倍率病例多时会发散，因此从总分值法的点值出发，
+    按倍数向两侧寻找支付总额跨过预算的区间，再对区间二分，直到区间宽度小于点值的tolerance倍。
+    每次迭代对全部病例做一次向量化计算，所有参保类型同时迭代。
+    返回总分值法的列，加上调整后总分值、高倍率病例数、低倍率病例数、迭代次数和是否收敛；
+    找不到跨过预算的区间或达到最大迭代次数时是否收敛为False。
+    """
+    pools = _pool_codes(points, 基金预算)
+    valid = pools >= 0
+    pools_valid = pools[valid]
+    分值 = points['分值'].to_numpy()[valid]
+    住院总费用 = points['住院总费用'].to_numpy()[valid]
+    预算 = np.array([float(value) for value in 基金预算.values()])
+    总分值 = np.bincount(pools_valid, weights=分值, minlength=len(预算))
+
+    def budget_gap(点值):
+        return _adjusted_payments(pools_valid, 分值, 住院总费用, 点值, 高倍率界限, 低倍率界限) - 预算
+
+    # 区间的一端固定为总分值法的点值，另一端按2的倍数交替向上、向下寻找，支付总额与预算之差变号为止
+    初始点值 = _point_values(预算, 总分值)
+    下端, 下端差额 = 初始点值.copy(), budget_gap(初始点值)
+    上端 = 初始点值.copy()
+    # 总分值为0的参保类型点值为NaN，不参与迭代
+    找到区间 = np.isnan(初始点值) | (下端差额 == 0)
+    iterations = 1
+    for factor in (2.0 ** (k * sign) for k in range(1, 31) for sign in (1, -1)):
+        if 找到区间.all() or iterations >= max_iterations:
+            break
+        iterations += 1
+        候选 = 初始点值 * factor
+        变号 = ~找到区间 & (np.sign(budget_gap(候选)) != np.sign(下端差额))
+        上端[变号] = 候选[变号]
+        找到区间 |= 变号
+
+    收敛 = 找到区间 & ~(np.abs(上端 - 下端) > tolerance * np.abs(下端))
+    while iterations < max_iterations and not (收敛 | ~找到区间).all():
+        iterations += 1
+        中点 = np.where(收敛 | ~找到区间, 下端, (下端 + 上端) / 2)
+        中点差额 = budget_gap(中点)
+        同号 = np.sign(中点差额) == np.sign(下端差额)
+        下端, 下端差额 = np.where(同号, 中点, 下端), np.where(同号, 中点差额, 下端差额)
+        上端 = np.where(同号, 上端, 中点)
+        收敛 = 找到区间 & ~(np.abs(上端 - 下端) > tolerance * np.abs(下端))
+
+    点值 = np.where(找到区间, (下端 + 上端) / 2, 初始点值)
+    调整后分值, 倍率 = adjust_case_points(分值, 住院总费用, 点值[pools_valid], 高倍率界限, 低倍率界限)
+    result = _estimate_table(基金预算, pools, 总分值, 点值)
+    result['调整后总分值'] = np.bincount(pools_valid, weights=调整后分值, minlength=len(预算))
+    result['高倍率病例数'] = np.bincount(pools_valid[倍率 > 高倍率界限], minlength=len(预算))
+    result['低倍率病例数'] = np.bincount(pools_valid[倍率 < 低倍率界限], minlength=len(预算))
+    result['迭代次数'] = iterations
+    result['是否收敛'] = 收敛
+    return result
+
+
+def parse_budgets(items):
+    """解析"参保类型=预算金额"列表，返回 参保类型 -> 预算金额"""
+    基金预算 = {}
+    for item in items:
+        参保类型, _, 金额 = item.partition('=')
+        try:
+            基金预算[参保类型.strip()] = float(金额)
+        except ValueError:
+            raise ValueError(f"基金预算格式错误: {item}（应为 参保类型=金额，如 职工=350000000）") from None
+        if not 参保类型.strip() or 基金预算[参保类型.strip()] < 0:
+            raise ValueError(f"基金预算格式错误: {item}（应为 参保类型=金额，如 职工=350000000）")
+    return 基金预算
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="年终点值估算：由统筹基金预算和入组病例的总分值，分别估算居民、职工点值"
+    )
+    parser.add_argument('cases', help="已入组的病例文件（dip_batch.py输出的结果文件），可以是全地区百万行级别的文件")
+    parser.add_argument('--budget', action='append', required=True,
+                        help="参保类型的基金预算，如 --budget 居民=120000000 --budget 职工=350000000")
+    parser.add_argument('-o', '--output', help="估算结果文件（.csv或Excel）")
+    parser.add_argument('--type-column', default=默认参保类型列,
+                        help="病例表中的参保类型列；病例表没有该列且只给出一个预算时，全部病例计入该参保类型")
+    parser.add_argument('--level-coefficient', type=float, default=默认医院等级系数,
+                        help="医院等级系数（病例表中有医院等级系数列时按行取值）")
+    parser.add_argument('--iterative', action='store_true', help="迭代估算，考虑高、低倍率病例的分值调整")
+    parser.add_argument('--high-ratio', type=float, default=默认高倍率界限, help="高倍率界限（住院总费用/DIP支付标准）")
+    parser.add_argument('--low-ratio', type=float, default=默认低倍率界限, help="低倍率界限（住院总费用/DIP支付标准）")
+    parser.add_argument('--chunk-rows', type=int, default=每块病例数, help="按块读取病例文件时每块的行数")
+    args = parser.parse_args(argv)
+
+    try:
+        基金预算 = parse_budgets(args.budget)
+        默认参保类型 = next(iter(基金预算)) if len(基金预算) == 1 else None
+        columns = 费用列 + ['入组的DIP基准分值', '医院等级系数', args.type_column]
+        points = prepare_point_value_cases(iter_case_chunks(args.cases, args.chunk_rows, columns),
+                                           args.level_coefficient, args.type_column, 默认参保类型)
+        if args.iterative:
+            result = estimate_point_values_iterative(points, 基金预算, args.high_ratio, args.low_ratio)
+        else:
+            result = estimate_point_values(points, 基金预算)
+        result['默认点值'] = result['参保类型'].map(默认点值)
+        if args.output:
+            write_result_file(result, args.output)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    print(f"病例数: {len(points)}，可入组: {int(points['分值'].notna().sum())}")
+    print(result.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# dip_registry.py - 进程级只读目录注册表
+import weakref
+
+from dip_cache import LRUCache
+from dip_catalog import CatalogIndex, catalog_hash
+
+# 注册表最多保留的目录版本数（三个目录合计），超过时淘汰最久未使用的版本
+最大目录版本数 = 32
+
+# 最多保留的目录索引数
+最大索引条目数 = 8
+
+
+class CatalogRegistry:
+    """进程级只读目录注册表，所有Streamlit会话共享
+
+    目录按内容哈希注册，内容相同的目录在进程中只保存一份，会话中只保存版本键（内容哈希）。
+    注册新版本只是加入一个新条目，会话切换版本只是替换自己的版本键：正在用旧版本查询的会话
+    持有的是旧目录和旧索引对象本身，不会被阻塞也不会看到修改到一半的目录。
+    注册的目录和索引被多个会话共享，调用方不能修改。
+    超过最大版本数时淘汰最久未使用的版本，但仍被会话持有（pin）的目录不会丢失：取用时重新放回注册表。
+    """
+
+    def __init__(self, max_versions=最大目录版本数, max_indexes=最大索引条目数):
+        self._catalogs = LRUCache(max_versions)
+        # 版本键 -> 目录的弱引用，目录仍被会话持有时即使已被淘汰也能取回
+        self._live = weakref.WeakValueDictionary()
+        # 来源键（如快照文件路径和修改时间） -> 版本键，同一来源只读取一次
+        self._sources = LRUCache(max_versions)
+        # (三个目录的版本键, 组别规则) -> 目录索引
+        self._indexes = LRUCache(max_indexes)
+
+    def register(self, catalog):
+        """注册目录，返回版本键；内容相同的目录已注册时沿用已有的目录对象"""
+        version = catalog_hash(catalog)
+        if self.get(version) is None:
+            self._catalogs.put(version, catalog)
+            self._live[version] = catalog
+        return version
+
+    def register_source(self, source_key, load):
+        """按来源注册目录：来源已注册且对应版本仍在注册表中时直接返回版本键，否则调用load()读取并注册"""
+        version = self._sources.get(source_key)
+        if version is None or self.get(version) is None:
+            version = self.register(load())
+            self._sources.put(source_key, version)
+        return version
+
+    def get(self, version):
+        """按版本键取出目录，版本不存在（未注册，或已被淘汰且没有会话持有）时返回None"""
+        catalog = self._catalogs.get(version)
+        if catalog is None:
+            catalog = self._live.get(version)
+            if catalog is not None:
+                self._catalogs.put(version, catalog)
+        return catalog
+
+    def get_index(self, dip_version, surgery_version, diagnosis_version, category_suffixes=None):
+        """取出三个目录版本和组别规则对应的目录索引，同一组合在进程中只构建一次
+
+        索引需要重新构建而任一目录版本已不在注册表中时返回None。
+        """
+        规则键 = None if category_suffixes is None else tuple(sorted(category_suffixes.items(), key=repr))
+        key = (dip_version, surgery_version, diagnosis_version, 规则键)
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+
+        catalogs = [self.get(version) for version in (dip_version, surgery_version, diagnosis_version)]
+        if any(catalog is None for catalog in catalogs):
+            return None
+        index = CatalogIndex(*catalogs, category_suffixes)
+        self._indexes.put(key, index)
+        return index
+
+    def __len__(self):
+        return len(self._catalogs)
+
+
+# 进程级目录注册表
+catalog_registry = CatalogRegistry()
@@ -0,0 +1,252 @@
+# dip_replay.py - 目录变更影响模拟：同一批历史病例分别按原目录和新目录入组，对比DIP核算金额、盈亏金额和回款率
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dip_batch import build_catalog_index, load_catalogs, resolve_point_value
+from dip_fuzzy import 默认匹配阈值
+from dip_grouping import case_group_inputs, expand_unique_results, group_unique_inputs, unique_case_inputs, 分组列
+from dip_io import load_category_suffixes, read_case_file, write_result_file
+from dip_metrics import (calculate_dip_metrics_frame, 默认点值, 默认医院等级系数,
+                         默认医疗性收入成本率, 默认药耗成本率, 参数列, 费用列)
+
+# 两次入组结果列名的前缀
+版本前缀 = ['原', '新']
+
+# 对比表中按版本保留的分组列和指标列
+对比列 = ['DIP编码', 'DIP名称', '病种类型', '入组的DIP基准分值', '可入组', 'DIP核算金额', 'DIP盈亏金额', 'DIP回款率']
+
+# 病例表中的科室列
+默认科室列 = '科室'
+
+# 基准分值保留4位小数，变化小于该值视为未变化
+分值容差 = 5e-5
+
+
+def _group_unique_task(task):
+    """对去重后的组合按一个目录入组（在工作进程中执行）"""
+    index, 诊断列表, 操作列表, fuzzy_threshold = task
+    return group_unique_inputs(index, 诊断列表, 操作列表, fuzzy_threshold)
+
+
+def replay_cases(old_index, new_index, cases, 医疗性收入成本率, 药耗成本率, 医院等级系数, 原点值, 新点值,
+                 fuzzy_threshold=None, workers=2):
+    """同一批病例分别按原目录和新目录入组并计算DIP指标，返回(原结果, 新结果)，行索引与cases一致
+
+    病例的读取、诊断编码规范化和(诊断, 操作)组合去重只做一次，两个目录只对去重后的组合入组；
+    workers>1时两个目录在两个工作进程中并行入组。
+    """
+    诊断输入, 操作输入 = case_group_inputs(cases)
+    # 组合去重只做一次，两个目录共用去重结果
+    诊断列表, 操作列表, codes = unique_case_inputs(old_index.code_dictionary.overlay(), 诊断输入, 操作输入)
+
+    if workers is not None and workers <= 0:
+        workers = os.cpu_count() or 1
+    tasks = [(index, 诊断列表, 操作列表, fuzzy_threshold) for index in (old_index, new_index)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            unique_results = list(executor.map(_group_unique_task, tasks))
+    else:
+        unique_results = [_group_unique_task(task) for task in tasks]
+
+    # 指标计算只需要费用列和按行变化的参数列
+    费用 = cases[[col for col in 费用列 + ['统筹基金支付金额'] + 参数列 if col in cases.columns]]
+    results = []
+    for unique, 点值 in zip(unique_results, (原点值, 新点值)):
+        grouped = expand_unique_results(unique, codes, cases.index)
+        metrics = calculate_dip_metrics_frame(pd.concat([费用, grouped], axis=1),
+                                              医疗性收入成本率, 药耗成本率, 医院等级系数, 点值)
+        results.append(pd.concat([grouped, metrics], axis=1))
+    return results[0], results[1]
+
+
+def compare_replay(cases, old_result, new_result):
+    """合并两次入组结果，返回每个病例一行的对比表
+
+    对比表为病例原始列 + 原/新两个版本的分组和指标列 + 核算金额变化、盈亏金额变化和变化类型。
+    DIP组别不同的病例变化类型为"组别变化"，组别相同而基准分值不同的为"分值变化"，其余为空字符串。
+    """
+    comparison = cases.drop(columns=[col for col in 分组列 if col in cases.columns])
+    for 前缀, result in zip(版本前缀, (old_result, new_result)):
+        for col in 对比列:
+            comparison[f'{前缀}{col}'] = result[col]
+    comparison['核算金额变化'] = comparison['新DIP核算金额'] - comparison['原DIP核算金额']
+    comparison['盈亏金额变化'] = comparison['新DIP盈亏金额'] - comparison['原DIP盈亏金额']
+
+    组别变化 = comparison['原DIP编码'].to_numpy() != comparison['新DIP编码'].to_numpy()
+    分值变化 = ~np.isclose(comparison['新入组的DIP基准分值'].to_numpy(dtype=np.float64),
+                         comparison['原入组的DIP基准分值'].to_numpy(dtype=np.float64),
+                         rtol=0.0, atol=分值容差, equal_nan=True)
+    comparison['变化类型'] = np.select([组别变化, 分值变化], ['组别变化', '分值变化'], default='')
+    return comparison
+
+
+def changed_cases(comparison):
+    """对比表中DIP组别或基准分值有变化的病例"""
+    return comparison[comparison['变化类型'] != '']
+
+
+def _version_totals(comparison, 前缀, 维度列, 维度名称):
+    """按一个版本下的维度取值汇总病例数、DIP核算金额、DIP盈亏金额和统筹基金支付金额"""
+    keys = comparison[维度列].rename(维度名称)
+    return comparison.groupby(keys, sort=False, dropna=False).agg(**{
+        f'{前缀}病例数': (f'{前缀}DIP编码', 'size'),
+        f'{前缀}DIP核算金额': (f'{前缀}DIP核算金额', 'sum'),
+        f'{前缀}DIP盈亏金额': (f'{前缀}DIP盈亏金额', 'sum'),
+        f'{前缀}统筹基金支付金额': ('统筹基金支付金额', 'sum')
+    })
+
+
+def _return_rate(核算金额, 统筹基金支付金额):
+    """回款率 = DIP核算金额合计 / 统筹基金支付金额合计，统筹基金支付金额为0时记为0"""
+    核算金额 = np.asarray(核算金额, dtype=np.float64)
+    统筹基金支付金额 = np.asarray(统筹基金支付金额, dtype=np.float64)
+    回款率 = np.zeros(核算金额.shape, dtype=np.float64)
+    np.divide(核算金额, 统筹基金支付金额, out=回款率, where=统筹基金支付金额 != 0)
+    return 回款率
+
+
+def summarize_replay(comparison, 原维度列, 新维度列, 维度名称):
+    """按维度对比两个目录下的金额合计和回款率，只保留有变化病例的维度取值，末尾为全部病例的合计行
+
+    原目录下的金额按原维度列汇总，新目录下的金额按新维度列汇总：按科室汇总时两者相同，
+    按DIP组汇总时分别为原DIP编码和新DIP编码，组别变化的病例从原组转出、计入新组。
+    未能入组的病例不计DIP核算金额，但统筹基金支付金额计入回款率的分母。
+    """
+    summary = _version_totals(comparison, '原', 原维度列, 维度名称).join(
+        _version_totals(comparison, '新', 新维度列, 维度名称), how='outer').fillna(0)
+
+    # 有变化的病例在原、新两个维度取值下都计入变化病例数，两者相同时只计一次
+    changed = changed_cases(comparison)
+    pairs = pd.concat([pd.DataFrame({维度名称: changed[col].to_numpy(), '病例': np.arange(len(changed))})
+                       for col in (原维度列, 新维度列)]).drop_duplicates()
+    summary['变化病例数'] = pairs[维度名称].value_counts(dropna=False).reindex(summary.index, fill_value=0)
+    summary = summary[summary['变化病例数'] > 0]
+
+    合计 = pd.DataFrame([{
+        **{f'{前缀}{col}': comparison[f'{前缀}{col}'].sum() for 前缀 in 版本前缀
+           for col in ['DIP核算金额', 'DIP盈亏金额']},
+        **{f'{前缀}病例数': len(comparison) for 前缀 in 版本前缀},
+        **{f'{前缀}统筹基金支付金额': comparison['统筹基金支付金额'].sum() for 前缀 in 版本前缀},
+        '变化病例数': len(changed)
+    }], index=pd.Index(['合计'], name=维度名称))
+    summary = pd.concat([summary, 合计])
+
+    for 前缀 in 版本前缀:
+        summary[f'{前缀}DIP回款率'] = _return_rate(summary[f'{前缀}DIP核算金额'], summary[f'{前缀}统筹基金支付金额'])
+    summary['核算金额变化'] = summary['新DIP核算金额'] - summary['原DIP核算金额']
+    summary['盈亏金额变化'] = summary['新DIP盈亏金额'] - summary['原DIP盈亏金额']
+    summary['回款率变化'] = summary['新DIP回款率'] - summary['原DIP回款率']
+    for col in ['原病例数', '新病例数', '变化病例数']:
+        summary[col] = summary[col].astype(np.int64)
+
+    columns = (['变化病例数', '原病例数', '新病例数'] +
+               [f'{前缀}{col}' for col in ['DIP核算金额', 'DIP盈亏金额', 'DIP回款率'] for 前缀 in 版本前缀] +
+               ['核算金额变化', '盈亏金额变化', '回款率变化'])
+    return summary[columns].reset_index()
+
+
+def summarize_by_department(comparison, 科室列=默认科室列):
+    """按科室汇总，病例表没有科室列时返回None"""
+    if 科室列 not in comparison.columns:
+        return None
+    return summarize_replay(comparison, 科室列, 科室列, '科室')
+
+
+def summarize_by_dip_group(comparison):
+    """按DIP组汇总，附带DIP名称（新目录优先）"""
+    summary = summarize_replay(comparison, '原DIP编码', '新DIP编码', 'DIP编码')
+    names = pd.concat([
+        pd.Series(comparison['新DIP名称'].to_numpy(), index=comparison['新DIP编码'].to_numpy()),
+        pd.Series(comparison['原DIP名称'].to_numpy(), index=comparison['原DIP编码'].to_numpy())
+    ])
+    names = names[~names.index.duplicated()]
+    summary.insert(1, 'DIP名称', summary['DIP编码'].map(names).fillna(''))
+    return summary
+
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="目录变更影响模拟：同一批病例分别按原目录和新目录入组，按科室和DIP组对比DIP核算金额、盈亏金额和回款率"
+    )
+    parser.add_argument('cases', help="历史病例文件（.csv或Excel），列要求与dip_batch.py相同，可包含科室列")
+    parser.add_argument('-o', '--output', required=True, help="变化病例明细文件（.csv或Excel），只包含组别或分值有变化的病例")
+    parser.add_argument('--summary-output', help="按科室和DIP组的汇总文件（.csv或Excel）")
+    parser.add_argument('--store-dir', default='catalog_store', help="多版本目录库所在目录")
+    parser.add_argument('--old-catalog-version', help="原目录：目录库中的命名版本")
+    parser.add_argument('--new-catalog-version', help="新目录：目录库中的命名版本")
+    parser.add_argument('--old-dip-catalog', help="原DIP病种及分值目录（.xlsx/.csv/.npz），优先于原目录版本中的DIP目录")
+    parser.add_argument('--new-dip-catalog', help="新DIP病种及分值目录（.xlsx/.csv/.npz），优先于新目录版本中的DIP目录")
+    parser.add_argument('--surgery-catalog', help="手术操作分类目录（.xlsx/.csv/.npz），两个版本共用")
+    parser.add_argument('--diagnosis-catalog', help="诊断编码及名称目录（.xlsx/.csv/.npz），两个版本共用")
+    parser.add_argument('--rules', help="入组规则文件（JSON），配置综合病种操作类别对应的DIP组别后缀")
+    parser.add_argument('--department-column', default=默认科室列, help="病例表中的科室列名")
+    parser.add_argument('--point-type', choices=list(默认点值), default='职工', help="点值类型，决定默认点值")
+    parser.add_argument('--point-value', type=float,
+                        help="两个版本共用的点值，默认各自使用目录库版本保存的点值，没有时按点值类型取值")
+    parser.add_argument('--level-coefficient', type=float, default=默认医院等级系数, help="医院等级系数")
+    parser.add_argument('--medical-cost-ratio', type=float, default=默认医疗性收入成本率, help="医疗性收入成本率")
+    parser.add_argument('--drug-cost-ratio', type=float, default=默认药耗成本率, help="药耗成本率")
+    parser.add_argument('--workers', type=int, default=2, help="大于1时两个目录在两个进程中并行入组，1为单进程")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help=f"目录中找不到的诊断名称和操作按名称模糊匹配入组（最低得分默认{默认匹配阈值}）")
+    parser.add_argument('--fuzzy-threshold', type=float, default=默认匹配阈值, help="模糊匹配最低得分（0~1）")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    fuzzy_threshold = args.fuzzy_threshold if args.fuzzy else None
+
+    start = time.perf_counter()
+    try:
+        category_suffixes = load_category_suffixes(args.rules) if args.rules else None
+        indexes = []
+        点值列表 = []
+        for 前缀, version, dip_catalog, 参数 in [
+                ('原', args.old_catalog_version, args.old_dip_catalog, 'old'),
+                ('新', args.new_catalog_version, args.new_dip_catalog, 'new')]:
+            if not version and not dip_catalog:
+                raise ValueError(f"未指定{前缀}目录（--{参数}-catalog-version 或 --{参数}-dip-catalog）")
+            catalogs = load_catalogs(None, dip_catalog, args.surgery_catalog, args.diagnosis_catalog,
+                                     args.store_dir, version)
+            indexes.append(build_catalog_index(catalogs, category_suffixes))
+            点值列表.append(resolve_point_value(args.point_value, args.point_type, args.store_dir, version))
+        if fuzzy_threshold is not None:
+            for index in indexes:
+                index.fuzzy_matchers()
+
+        cases = read_case_file(args.cases)
+        old_result, new_result = replay_cases(indexes[0], indexes[1], cases, args.medical_cost_ratio,
+                                              args.drug_cost_ratio, args.level_coefficient, *点值列表,
+                                              fuzzy_threshold, args.workers)
+        comparison = compare_replay(cases, old_result, new_result)
+        write_result_file(changed_cases(comparison), args.output)
+
+        summaries = [('科室', summarize_by_department(comparison, args.department_column)),
+                     ('DIP组', summarize_by_dip_group(comparison))]
+        summaries = [(name, summary) for name, summary in summaries if summary is not None]
+        if args.summary_output:
+            write_result_file(pd.concat([summary.rename(columns={summary.columns[0]: '汇总取值'})
+                                         .assign(汇总维度=name) for name, summary in summaries]),
+                              args.summary_output)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    print(f"病例数: {len(comparison)}，组别或分值有变化: {len(changed_cases(comparison))}，"
+          f"耗时: {time.perf_counter() - start:.2f}秒")
+    for name, summary in summaries:
+        print(f"\n按{name}汇总:")
+        print(summary.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# dip_search.py - 诊断/操作下拉框的增量搜索索引
+import bisect
+
+import numpy as np
+
+from dip_cache import LRUCache
+from dip_catalog import get_option_lists
+
+# 每次搜索最多返回的选项数
+默认返回条数 = 50
+
+# 搜索索引缓存最多保留的目录版本数
+最大搜索缓存条目数 = 8
+
+
+def normalize_query(text):
+    """统一查询和索引文本：去除首尾空白、字母转大写"""
+    return str(text).strip().upper()
+
+
+def _bigrams(text):
+    """文本中的全部相邻两字符组合"""
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class SearchIndex:
+    """编码前缀索引 + 名称字符n-gram倒排索引
+
+    编码按字典序排序，前缀查询用二分查找定位；名称按单字和相邻两字建立倒排表，
+    多字查询取各两字组合倒排表的交集后再确认包含关系。条目按名称长度排序，
+    倒排表中的编号越小排名越靠前，只需取交集中的前k条即可，不需要全表扫描。
+    """
+
+    def __init__(self, codes, names, labels):
+        order = sorted(range(len(labels)), key=lambda i: (len(names[i]), names[i], codes[i]))
+        self.labels = [labels[i] for i in order]
+        self.codes = [normalize_query(codes[i]) for i in order]
+        self.names = [normalize_query(names[i]) for i in order]
+
+        # 编码前缀索引：按编码排序的(编码, 条目编号)
+        sorted_codes = sorted((code, i) for i, code in enumerate(self.codes))
+        self._code_keys = [code for code, _ in sorted_codes]
+        self._code_ids = [i for _, i in sorted_codes]
+
+        # 名称n-gram倒排索引：单字和两字组合 -> 条目编号数组（升序）
+        postings = {}
+        for i, name in enumerate(self.names):
+            for gram in set(name) | _bigrams(name):
+                postings.setdefault(gram, []).append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    @classmethod
+    def from_options(cls, options):
+        """由"编码 - 名称"格式的下拉框选项构建索引，选项本身作为返回值"""
+        codes, names = [], []
+        for option in options:
+            code, _, name = option.partition(" - ")
+            codes.append(code)
+            names.append(name)
+        return cls(codes, names, list(options))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search_codes(self, query, limit=默认返回条数):
+        """按编码前缀查找，返回条目编号列表"""
+        ids = []
+        pos = bisect.bisect_left(self._code_keys, query)
+        while pos < len(self._code_keys) and len(ids) < limit and self._code_keys[pos].startswith(query):
+            ids.append(self._code_ids[pos])
+            pos += 1
+        return ids
+
+    def search_names(self, query, limit=默认返回条数):
+        """按名称包含关系查找，返回条目编号列表（按名称长度排序）"""
+        grams = _bigrams(query) if len(query) > 1 else {query}
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+
+        postings.sort(key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            if len(candidates) == 0:
+                return []
+
+        ids = []
+        for i in candidates.tolist():
+            if query in self.names[i]:
+                ids.append(i)
+                if len(ids) >= limit:
+                    break
+        return ids
+
+    def search(self, query, limit=默认返回条数):
+        """增量搜索：编码前缀匹配在前，名称包含匹配在后，最多返回limit条选项；查询为空时返回排名最前的选项"""
+        query = normalize_query(query)
+        if not query:
+            return self.labels[:limit]
+
+        ids = self.search_codes(query, limit)
+        if len(ids) < limit:
+            seen = set(ids)
+            ids += [i for i in self.search_names(query, limit) if i not in seen][:limit - len(ids)]
+        return [self.labels[i] for i in ids]
+
+
+def build_search_indexes(index):
+    """为先诊断后操作的诊断选项和先操作后诊断的操作选项构建搜索索引"""
+    选项列表 = get_option_lists(index)
+    return {
+        '诊断选项': SearchIndex.from_options(选项列表['诊断选项']),
+        '操作选项': SearchIndex.from_options(选项列表['操作选项'])
+    }
+
+
+# 搜索索引按DIP目录内容哈希缓存，所有会话共享
+search_indexes_cache = LRUCache(最大搜索缓存条目数)
+
+
+def get_search_indexes(index):
+    """获取目录索引对应的搜索索引，同一版本目录只构建一次"""
+    return search_indexes_cache.get_or_create(index.dip_version, lambda: build_search_indexes(index))
@@ -0,0 +1,114 @@
+# dip_store.py - 磁盘上的多版本目录库
+import json
+import os
+import shutil
+import time
+
+from dip_catalog import catalog_hash
+from dip_io import load_catalog_snapshot, save_catalog_snapshot, 快照目录名称
+
+# 每个版本目录中的元数据文件名
+元数据文件名 = 'catalog.json'
+
+
+def _check_version_name(name):
+    """检查版本名称能否作为目录名使用"""
+    if not name or not name.strip():
+        raise ValueError("目录版本名称不能为空")
+    if name != name.strip() or name in ('.', '..') or any(char in name for char in '/\\:*?"<>|'):
+        raise ValueError(f"目录版本名称不能包含特殊字符或首尾空白: {name}")
+
+
+class CatalogStore:
+    """磁盘上的多版本目录库
+
+    每个命名版本（如"南充4.0-职工"）保存在库目录下的一个子目录中，包含三个目录的列式快照（.npz）
+    和元数据（说明、点值、保存时间、各目录内容哈希）。切换版本只读取快照，不需要重新解析Excel；
+    读取后的目录和索引由进程级注册表共享，同一版本再次切换时直接使用。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _version_dir(self, name):
+        _check_version_name(name)
+        return os.path.join(self.directory, name)
+
+    def list_versions(self):
+        """列出库中的全部版本元数据，按名称排序"""
+        if not os.path.isdir(self.directory):
+            return []
+        versions = []
+        for name in sorted(os.listdir(self.directory)):
+            metadata_path = os.path.join(self.directory, name, 元数据文件名)
+            if os.path.exists(metadata_path):
+                with open(metadata_path, encoding='utf-8') as f:
+                    metadata = json.load(f)
+                # 跳过保存过程中的临时目录
+                if metadata.get('名称') == name:
+                    versions.append(metadata)
+        return versions
+
+    def names(self):
+        """库中的全部版本名称"""
+        return [metadata['名称'] for metadata in self.list_versions()]
+
+    def get_metadata(self, name):
+        """读取版本元数据，版本不存在时抛出ValueError"""
+        metadata_path = os.path.join(self._version_dir(name), 元数据文件名)
+        if not os.path.exists(metadata_path):
+            raise ValueError(f"目录版本不存在: {name}")
+        with open(metadata_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, name, catalogs, 说明="", 点值=None):
+        """保存一个命名版本，同名版本被整体替换
+
+        catalogs为 目录名称 -> DataFrame，需包含三个目录；点值为 点值类型 -> 点值（可选）。
+        先写入临时目录再替换，读取方不会看到写了一半的版本。
+        """
+        missing = [catalog_name for catalog_name in 快照目录名称 if catalog_name not in catalogs]
+        if missing:
+            raise ValueError(f"目录版本缺少目录: {', '.join(missing)}")
+        version_dir = self._version_dir(name)
+        os.makedirs(self.directory, exist_ok=True)
+
+        tmp_dir = f"{version_dir}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        save_catalog_snapshot(tmp_dir, {catalog_name: catalogs[catalog_name] for catalog_name in 快照目录名称})
+        metadata = {
+            '名称': name,
+            '说明': 说明,
+            '点值': dict(点值 or {}),
+            '保存时间': time.strftime('%Y-%m-%d %H:%M:%S'),
+            '目录哈希': {catalog_name: catalog_hash(catalogs[catalog_name]) for catalog_name in 快照目录名称}
+        }
+        with open(os.path.join(tmp_dir, 元数据文件名), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+        # 新版本在临时目录中写完后再整体替换旧版本，读取方不会读到新旧混合的文件
+        old_dir = f"{version_dir}.old{os.getpid()}"
+        if os.path.exists(version_dir):
+            os.replace(version_dir, old_dir)
+        os.replace(tmp_dir, version_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return metadata
+
+    def load(self, name):
+        """读取版本中的三个目录，返回 目录名称 -> DataFrame"""
+        catalogs = load_catalog_snapshot(self._version_dir(name))
+        missing = [catalog_name for catalog_name in 快照目录名称 if catalog_name not in catalogs]
+        if missing:
+            raise ValueError(f"目录版本 {name} 缺少目录: {', '.join(missing)}")
+        return catalogs
+
+    def snapshot_path(self, name, catalog_name):
+        """版本中某个目录的快照文件路径"""
+        return os.path.join(self._version_dir(name), f'{catalog_name}.npz')
+
+    def delete(self, name):
+        """删除一个版本"""
+        version_dir = self._version_dir(name)
+        if not os.path.isdir(version_dir):
+            raise ValueError(f"目录版本不存在: {name}")
+        shutil.rmtree(version_dir)
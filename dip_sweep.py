@@ -0,0 +1,123 @@
+# dip_sweep.py - 参数敏感性扫描：在点值、医院等级系数、成本率的笛卡尔网格上一次广播计算DIP指标
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from dip_io import read_case_file, write_result_file
+from dip_metrics import (calculate_dip_metrics_batch, 默认点值, 默认医院等级系数,
+                         默认医疗性收入成本率, 默认药耗成本率, 费用列)
+
+# 可以扫描的参数，依次对应网格的各个维度
+扫描参数 = ['点值', '医院等级系数', '医疗性收入成本率', '药耗成本率']
+
+# 在病例上求和的指标
+扫描指标 = ['DIP核算金额', 'DIP盈亏金额', '病例真实盈亏金额']
+
+# 每次广播计算的最大元素数（网格点数 × 病例数），超过时病例按块计算后累加
+最大广播元素数 = 20000000
+
+
+def sweep_dip_metrics(cases, 参数网格, max_elements=最大广播元素数):
+    """在参数的笛卡尔网格上计算病例的DIP指标合计，每个网格点一行
+
+    cases需要包含四项费用列、统筹基金支付金额和入组的DIP基准分值，可以只有一个病例；
+    参数网格为 参数名 -> 标量或取值序列，四个参数都要给出。四个参数各占一个维度、病例占最后一个维度，
+    用calculate_dip_metrics_batch一次广播计算，再在病例维度上求和；病例很多时按块计算以限制内存。
+    未能入组（基准分值为空）的病例不计金额，但统筹基金支付金额计入DIP回款率的分母。
+    返回列：四个参数、DIP核算金额、DIP盈亏金额、病例真实盈亏金额（均为合计）和DIP回款率。
+    """
+    missing = [col for col in 费用列 + ['统筹基金支付金额', '入组的DIP基准分值'] if col not in cases.columns]
+    missing += [name for name in 扫描参数 if name not in 参数网格]
+    if missing:
+        raise ValueError(f"缺少参数敏感性扫描的必要列或参数: {', '.join(missing)}")
+
+    取值 = [np.atleast_1d(np.asarray(参数网格[name], dtype=np.float64)) for name in 扫描参数]
+    shape = tuple(len(values) for values in 取值)
+    # 第i个参数放在第i个维度上，最后一个维度留给病例
+    网格 = {name: values.reshape([len(values) if axis == i else 1 for axis in range(len(shape))] + [1])
+          for i, (name, values) in enumerate(zip(扫描参数, 取值))}
+
+    病例 = {col: cases[col].to_numpy(dtype=np.float64) for col in 费用列 + ['统筹基金支付金额', '入组的DIP基准分值']}
+    chunk_rows = max(1, max_elements // max(1, int(np.prod(shape))))
+    totals = {metric: np.zeros(shape) for metric in 扫描指标}
+    for start in range(0, len(cases), chunk_rows):
+        part = {col: values[start:start + chunk_rows] for col, values in 病例.items()}
+        results = calculate_dip_metrics_batch(
+            part['诊疗费用'], part['检查检验费用'], part['药品费用'], part['耗材费用'],
+            网格['医疗性收入成本率'], 网格['药耗成本率'], part['统筹基金支付金额'],
+            part['入组的DIP基准分值'], 网格['医院等级系数'], 网格['点值']
+        )
+        # 指标只在它依赖的参数维度上展开（如DIP盈亏金额与成本率无关），先在病例维度上求和再广播到整个网格
+        for metric in 扫描指标:
+            totals[metric] += np.nansum(results[metric], axis=-1)
+
+    坐标 = np.meshgrid(*取值, indexing='ij')
+    sweep = pd.DataFrame({name: values.ravel() for name, values in zip(扫描参数, 坐标)})
+    for metric in 扫描指标:
+        sweep[metric] = totals[metric].ravel()
+    统筹基金支付金额合计 = float(np.nansum(病例['统筹基金支付金额']))
+    sweep['DIP回款率'] = sweep['DIP核算金额'] / 统筹基金支付金额合计 if 统筹基金支付金额合计 != 0 else 0.0
+    return sweep
+
+
+def sweep_matrix(sweep, x, y, metric):
+    """把扫描结果整理为热力图矩阵：行为y参数取值、列为x参数取值
+
+    其余参数必须只有一个取值，否则同一格子有多个结果，抛出ValueError。
+    """
+    others = [name for name in 扫描参数 if name not in (x, y) and sweep[name].nunique() > 1]
+    if others:
+        raise ValueError(f"热力图只能有两个扫描参数，以下参数有多个取值: {', '.join(others)}")
+    return sweep.pivot(index=y, columns=x, values=metric)
+
+
+def parse_sweep_values(text):
+    """解析参数取值：单个数值、逗号分隔的取值列表，或"起始:结束:步长"（包含结束值）"""
+    try:
+        if ':' in text:
+            start, stop, step = (float(part) for part in text.split(':'))
+            if step <= 0 or stop < start:
+                raise ValueError
+            return np.round(np.arange(start, stop + step / 2, step), 10)
+        return np.array([float(part) for part in text.split(',')])
+    except ValueError:
+        raise ValueError(f"参数取值格式错误: {text}（应为数值、逗号分隔的列表或 起始:结束:步长）") from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="参数敏感性扫描：在点值、医院等级系数和成本率的网格上计算病例（或批量结果）的DIP盈亏金额合计"
+    )
+    parser.add_argument('cases', help="已入组的病例文件（dip_batch.py输出的结果文件，需包含入组的DIP基准分值）")
+    parser.add_argument('-o', '--output', required=True, help="扫描结果文件（.csv或Excel），每个网格点一行")
+    parser.add_argument('--point-values', default=str(默认点值['职工']), help="点值取值，如 60:80:1 或 63.3253,73.6011")
+    parser.add_argument('--level-coefficients', default=str(默认医院等级系数), help="医院等级系数取值")
+    parser.add_argument('--medical-cost-ratios', default=str(默认医疗性收入成本率), help="医疗性收入成本率取值，如 0.3:1.0:0.05")
+    parser.add_argument('--drug-cost-ratios', default=str(默认药耗成本率), help="药耗成本率取值")
+    args = parser.parse_args(argv)
+
+    try:
+        参数网格 = {
+            '点值': parse_sweep_values(args.point_values),
+            '医院等级系数': parse_sweep_values(args.level_coefficients),
+            '医疗性收入成本率': parse_sweep_values(args.medical_cost_ratios),
+            '药耗成本率': parse_sweep_values(args.drug_cost_ratios)
+        }
+        sweep = sweep_dip_metrics(read_case_file(args.cases), 参数网格)
+        write_result_file(sweep, args.output)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+    print(f"网格点数: {len(sweep)}")
+    # 恰好两个参数有多个取值时输出DIP盈亏金额矩阵
+    扫描中 = [name for name in 扫描参数 if sweep[name].nunique() > 1]
+    if len(扫描中) == 2:
+        print(sweep_matrix(sweep, 扫描中[0], 扫描中[1], 'DIP盈亏金额').round(2).to_string())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+# dip_codes的测试：冻结的目录字典与病例覆盖层
+import numpy as np
+import pandas as pd
+import pytest
+
+from dip_codes import CodeDictionary
+
+
+def test_overlay_does_not_modify_frozen_dictionary():
+    catalog = CodeDictionary()
+    catalog.register_catalog(pd.DataFrame({'诊断编码': ['I10.x', 'K35.8'], '操作编码': ['无', '无']}))
+    catalog.freeze()
+
+    overlay = catalog.overlay()
+    ids = overlay.encode(['K35.8', 'Z99.9', None, 'Z99.9'])
+    assert ids.tolist() == [1, 3, -1, 3]
+    assert overlay.decode(ids).tolist() == ['K35.8', 'Z99.9', None, 'Z99.9']
+    assert len(catalog) == 3 and catalog.all_codes() == ['I10.x', 'K35.8', '无']
+
+    with pytest.raises(ValueError):
+        catalog.encode(['Z99.9'])
+
+
+def test_memory_report_uses_object_layout():
+    frame = pd.DataFrame({'诊断编码': pd.Categorical(['I10.x'] * 100)})
+    report = CodeDictionary().memory_report(frame)
+    assert report['int32字节数'] == 100 * np.dtype(np.int32).itemsize
+    assert report['object字节数'] == int(frame['诊断编码'].astype(object).memory_usage(deep=True, index=False))
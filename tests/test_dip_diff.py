@@ -0,0 +1,48 @@
+# dip_diff的测试：综合病种各组别的分值调整、重复组合键
+import pandas as pd
+import pytest
+
+from dip_diff import diff_catalogs, summarize_catalog_diff
+
+
+def make_catalog(诊断组分值=50.0):
+    """K35.8有无操作的手术组、治疗组、诊断组三条综合病种记录，另有一条核心病种记录"""
+    return pd.DataFrame({
+        '诊断编码': ['K35.8', 'K35.8', 'K35.8', 'J18.9'],
+        '诊断名称': ['急性阑尾炎', '急性阑尾炎', '急性阑尾炎', '肺炎'],
+        '操作编码': ['无', '无', '无', '无'],
+        '操作名称': ['无', '无', '无', '无'],
+        'DIP编码': ['K35.8-1', 'K35.8-2', 'K35.8-3', 'J18.9'],
+        'DIP名称': ['急性阑尾炎手术组', '急性阑尾炎治疗组', '急性阑尾炎诊断组', '肺炎'],
+        '病种类型': ['综合病种', '综合病种', '综合病种', '核心病种'],
+        '入组的DIP基准分值': [120.0, 80.0, 诊断组分值, 60.0]
+    })
+
+
+def test_changed_comprehensive_group_is_reported():
+    diff = diff_catalogs(make_catalog(), make_catalog(诊断组分值=99.0))
+
+    assert len(diff) == 4
+    changed = diff[diff['变化类型'] != '未变化']
+    assert changed[['DIP编码', '组别', '变化类型']].values.tolist() == [['K35.8-3', '诊断组', '分值调整']]
+    assert changed['原基准分值'].iloc[0] == 50.0
+    assert changed['新基准分值'].iloc[0] == 99.0
+
+    summary = summarize_catalog_diff(diff).set_index('病种类型')
+    assert summary.loc['综合病种', '分值调整'] == 1
+    assert summary.loc['综合病种', '未变化'] == 2
+    assert summary.loc['综合病种', '分值变化合计'] == 49.0
+
+
+def test_custom_category_suffixes():
+    old = make_catalog()
+    new = make_catalog(诊断组分值=99.0)
+    diff = diff_catalogs(old, new, {'手术': '手术组', '治疗性操作': '治疗组', '诊断性操作': '诊断组'})
+    assert (diff['变化类型'] == '分值调整').sum() == 1
+
+
+def test_duplicate_keys_raise():
+    catalog = make_catalog()
+    catalog.loc[1, 'DIP名称'] = '急性阑尾炎手术组'
+    with pytest.raises(ValueError, match='K35.8/无/手术组'):
+        diff_catalogs(catalog, make_catalog())
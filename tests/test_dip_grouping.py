@@ -0,0 +1,40 @@
+# dip_grouping的测试：批量入组与单个病例入组对诊断编码大小写的处理一致
+import pandas as pd
+import pytest
+
+from dip_catalog import CatalogIndex, normalize_diagnosis_key
+from dip_grouping import group_case, group_cases, normalize_diagnosis_codes, 手动输入诊断, 无操作选项
+
+
+def make_index(诊断编码):
+    dip_database = pd.DataFrame({
+        '诊断编码': [诊断编码],
+        '诊断名称': ['原发性高血压'],
+        '操作编码': ['无'],
+        '操作名称': ['无'],
+        'DIP编码': ['I10'],
+        'DIP名称': ['原发性高血压'],
+        '病种类型': ['核心病种'],
+        '入组的DIP基准分值': [45.0]
+    })
+    surgery_database = pd.DataFrame({'操作编码': ['无'], '操作名称': ['无'], '操作类别': ['无']})
+    diagnosis_database = pd.DataFrame({'诊断编码': [诊断编码], '诊断名称': ['原发性高血压']})
+    return CatalogIndex(dip_database, surgery_database, diagnosis_database)
+
+
+@pytest.mark.parametrize('目录编码', ['I10.X', 'I10.x'])
+@pytest.mark.parametrize('病例编码', ['I10.X00', 'I10.x00', 'i10.x00', 'Ｉ10.X00 '])
+def test_extension_case_groups_the_same_in_batch_and_single(目录编码, 病例编码):
+    index = make_index(目录编码)
+
+    single = group_case(index, 手动输入诊断, 病例编码, 无操作选项, "")
+    batch = group_cases(index, pd.DataFrame({'诊断编码': [病例编码]}))
+
+    assert single['可入组'] and batch['可入组'].iloc[0]
+    assert single['入组的DIP基准分值'] == batch['入组的DIP基准分值'].iloc[0] == 45.0
+
+
+def test_scalar_and_column_normalization_agree():
+    codes = ['I10.X', 'i10.x', 'Ｋ35.8', ' k35.800x001 ', '原发性高血压', 'x', '']
+    expected = normalize_diagnosis_codes(pd.Series(codes), truncate=False).tolist()
+    assert [normalize_diagnosis_key(code) for code in codes] == expected
@@ -0,0 +1,82 @@
+# dip_incremental的测试：目录和点值变化后增量更新的结果与按新目录、新参数完整重算一致
+import json
+
+import numpy as np
+import pandas as pd
+
+from dip_batch import score_cases
+from dip_catalog import CatalogIndex
+from dip_incremental import DependencyTracker, changed_rows, update_scored_results
+
+参数 = {'医疗性收入成本率': 0.6, '药耗成本率': 0.8, '医院等级系数': 1.033, '点值': 5.2}
+
+
+def make_index(肺炎分值=60.0):
+    """K35.8有操作的手术组和无操作的诊断组、肺炎和高血压核心病种"""
+    dip_database = pd.DataFrame({
+        '诊断编码': ['K35.8', 'K35.8', 'J18.9', 'I10.x'],
+        '诊断名称': ['急性阑尾炎', '急性阑尾炎', '肺炎', '原发性高血压'],
+        '操作编码': ['47.0901', '无', '无', '无'],
+        '操作名称': ['腹腔镜下阑尾切除术', '无', '无', '无'],
+        'DIP编码': ['K35.8-1', 'K35.8-3', 'J18.9', 'I10'],
+        'DIP名称': ['急性阑尾炎手术组', '急性阑尾炎诊断组', '肺炎', '原发性高血压'],
+        '病种类型': ['综合病种', '综合病种', '核心病种', '核心病种'],
+        '入组的DIP基准分值': [120.0, 50.0, 肺炎分值, 45.0]
+    })
+    surgery_database = pd.DataFrame({
+        '操作编码': ['47.0901', '无'],
+        '操作名称': ['腹腔镜下阑尾切除术', '无'],
+        '操作类别': ['手术', '无']
+    })
+    diagnosis_database = pd.DataFrame({
+        '诊断编码': ['K35.8', 'J18.9', 'I10.x'],
+        '诊断名称': ['急性阑尾炎', '肺炎', '原发性高血压']
+    })
+    return CatalogIndex(dip_database, surgery_database, diagnosis_database)
+
+
+def make_cases():
+    return pd.DataFrame({
+        '诊断编码': ['K35.800', 'K35.800', 'J18.900', 'I10.x00', 'J18.900', 'Z99.999'],
+        '操作编码': ['47.0901', '', '', '', '', ''],
+        '诊疗费用': [3000.0, 1200.0, 800.0, 500.0, 900.0, 400.0],
+        '检查检验费用': [1000.0, 300.0, 200.0, 100.0, 250.0, 100.0],
+        '药品费用': [1500.0, 400.0, 300.0, 0.0, 350.0, 50.0],
+        '耗材费用': [500.0, 100.0, 100.0, 0.0, 50.0, 0.0],
+        '统筹基金支付金额': [4200.0, 1500.0, 1000.0, 450.0, 1100.0, 400.0]
+    })
+
+
+def score_with_metadata(index, 参数):
+    scored = score_cases(index, make_cases(), **参数)
+    # 依赖记录按写入结果文件时的JSON格式往返一次
+    metadata = json.loads(json.dumps(DependencyTracker(index, 参数).update(scored).metadata()))
+    return scored, metadata
+
+
+def test_incremental_update_matches_full_rerun():
+    old_index = make_index()
+    scored, metadata = score_with_metadata(old_index, 参数)
+
+    new_index = make_index(肺炎分值=72.0)
+    new_参数 = dict(参数, 点值=6.1)
+    updated, new_metadata, report = update_scored_results(scored, metadata, new_index, new_参数)
+    expected, expected_metadata = score_with_metadata(new_index, new_参数)
+
+    pd.testing.assert_frame_equal(updated, expected, check_dtype=False)
+    assert new_metadata == expected_metadata
+    # 只有肺炎病例依赖的目录记录变化，点值变化重算全部行
+    assert report['重新入组行数'] == 2
+    assert report['重算指标行数'] == len(scored)
+
+
+def test_unchanged_catalog_and_threshold_regroup_nothing():
+    index = make_index()
+    scored, metadata = score_with_metadata(index, 参数)
+    assert not changed_rows(scored, metadata, make_index()).any()
+
+    updated, _, report = update_scored_results(scored, metadata, make_index(), 参数)
+    pd.testing.assert_frame_equal(updated, scored)
+    assert report['重算指标行数'] == 0
+    assert np.array_equal(changed_rows(scored, metadata, make_index(肺炎分值=72.0)),
+                          [False, False, True, False, True, False])
@@ -0,0 +1,56 @@
+# dip_montecarlo的测试：DipProfitCurve的合计与逐病例计算的指标合计一致
+import numpy as np
+import pandas as pd
+import pytest
+
+from dip_metrics import calculate_dip_metrics_frame
+from dip_montecarlo import DipProfitCurve
+
+点值列表 = [0.0, 3.5, 5.2, 7.0, 12.0]
+成本率列表 = [(0.0, 0.0), (0.6, 0.8), (0.9, 1.1)]
+
+
+def make_cases(按行系数=False):
+    """包含未入组（基准分值为空）、分值为0和病人自付金额为负的病例"""
+    cases = pd.DataFrame({
+        '诊疗费用': [3000.0, 1200.0, 800.0, 500.0, 6000.0, 2500.0],
+        '检查检验费用': [1000.0, 300.0, 200.0, 100.0, 2000.0, 700.0],
+        '药品费用': [1500.0, 400.0, 300.0, 0.0, 3000.0, 900.0],
+        '耗材费用': [500.0, 100.0, 100.0, 0.0, 1000.0, 400.0],
+        '统筹基金支付金额': [4200.0, 1800.0, 1000.0, 700.0, 9000.0, 3000.0],
+        '入组的DIP基准分值': [1000.0, np.nan, 0.0, 0.0, 2200.0, 800.0]
+    })
+    if 按行系数:
+        cases['医院等级系数'] = [1.0, 1.1, 0.9, 1.2, 0.95, 1.05]
+    return cases
+
+
+@pytest.mark.parametrize('按行系数', [False, True])
+def test_curve_matches_per_case_sums(按行系数):
+    cases = make_cases(按行系数)
+    curve = DipProfitCurve(cases, 医院等级系数=1.033)
+
+    for 点值 in 点值列表:
+        for 医疗性收入成本率, 药耗成本率 in 成本率列表:
+            metrics = calculate_dip_metrics_frame(cases, 医疗性收入成本率, 药耗成本率, 1.033, 点值)
+            assert curve.dip_settlement(点值) == pytest.approx(metrics['DIP核算金额'].sum())
+            assert curve.dip_profit(点值) == pytest.approx(metrics['DIP盈亏金额'].sum())
+            assert curve.case_profit(点值, 医疗性收入成本率, 药耗成本率) == \
+                pytest.approx(metrics['病例真实盈亏金额'].sum())
+
+
+def test_curve_evaluates_point_value_arrays():
+    cases = make_cases(按行系数=True)
+    curve = DipProfitCurve(cases)
+    expected = [calculate_dip_metrics_frame(cases, 0.6, 0.8, None, 点值)['DIP核算金额'].sum() for 点值 in 点值列表]
+    np.testing.assert_allclose(curve.dip_settlement(点值列表), expected)
+
+
+def test_row_coefficient_overrides_scalar():
+    cases = make_cases(按行系数=True)
+    assert curve_total(cases, 1.0) == curve_total(cases, 2.0)
+    assert curve_total(cases.drop(columns='医院等级系数'), 1.0) != curve_total(cases, 1.0)
+
+
+def curve_total(cases, 医院等级系数):
+    return float(DipProfitCurve(cases, 医院等级系数).dip_settlement(6.0))
@@ -0,0 +1,26 @@
+# dip_registry的测试：被会话持有的目录版本在淘汰后仍能取回
+import gc
+
+import pandas as pd
+
+from dip_registry import CatalogRegistry
+
+
+def make_catalogs(count):
+    return [pd.DataFrame({'诊断编码': [f'A{i:02d}.0'], '入组的DIP基准分值': [float(i)]}) for i in range(count)]
+
+
+def test_held_catalog_survives_eviction():
+    registry = CatalogRegistry(max_versions=2)
+    catalogs = make_catalogs(4)
+    held = catalogs[0]
+    versions = [registry.register(catalog) for catalog in catalogs]
+    assert registry.get(versions[0]) is held
+
+
+def test_released_catalog_is_evicted():
+    registry = CatalogRegistry(max_versions=2)
+    versions = [registry.register(catalog) for catalog in make_catalogs(4)]
+    gc.collect()
+    assert registry.get(versions[0]) is None
+    assert registry.get(versions[3]) is not None